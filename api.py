@@ -0,0 +1,430 @@
+"""Headless HTTP API for bill audits.
+
+A plain ASGI application (no web framework needed) around the same engine,
+reference store and audit store the Streamlit app uses:
+
+    POST /audits        bill as JSON {"items": [...]}, a multipart upload
+                        (field "file") or a raw CSV/XLSX/PDF/image body
+    GET  /audits/{id}   a stored audit with its lines
+    GET  /health
+
+Serve it with any ASGI server; `python api.py` starts uvicorn with HTTP
+keep-alive and a connection cap, e.g.
+
+    MEDIAUDIT_API_KEYS=key1,key2 python api.py --port 8000 --workers 4
+
+Requests authenticate with `Authorization: Bearer <key>` or `X-API-Key`;
+each key only sees its own audits, which are kept for the store's retention
+period (MEDIAUDIT_RETENTION_DAYS). Extraction and audits run on a thread
+pool behind a semaphore of `API_CONCURRENCY` slots; once `API_MAX_PENDING`
+requests are running or waiting for a slot, further ones get 503 with
+Retry-After instead of queueing without bound. Each server process has its
+own pool, so use one process per core for throughput.
+"""
+import argparse
+import asyncio
+import email.parser
+import email.policy
+import hashlib
+import hmac
+import json
+import logging
+import os
+import re
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from io import BytesIO
+from urllib.parse import parse_qs
+
+import pandas as pd
+
+from audit_engine import audit_bill
+from audit_store import DATE_FORMAT, LINE_FIELDS, AuditRecord, AuditStore
+from batch import read_table
+from extraction import (ITEM_COLUMNS, extract_text_from_image_bytes, extraction_cache, iter_pdf_items,
+                        text_to_items_from_lines)
+from reference_store import CITY_TIER_FACTORS, ReferenceStore
+
+API_KEYS = [key.strip() for key in os.environ.get("MEDIAUDIT_API_KEYS", "").split(",") if key.strip()]
+API_CONCURRENCY = int(os.environ.get("MEDIAUDIT_API_CONCURRENCY", os.cpu_count() or 1))
+API_MAX_PENDING = int(os.environ.get("MEDIAUDIT_API_MAX_PENDING", 256))
+API_MAX_BODY_BYTES = int(os.environ.get("MEDIAUDIT_API_MAX_BODY_BYTES", 20 * 1024 * 1024))
+# Open client connections the server accepts, idle keep-alive ones included
+API_MAX_CONNECTIONS = int(os.environ.get("MEDIAUDIT_API_MAX_CONNECTIONS", 1000))
+# Seconds an idle client connection is kept open for its next request
+KEEP_ALIVE_SECONDS = 30
+RETRY_AFTER_SECONDS = 1
+
+AUDIT_PATH = re.compile(r"^/audits/(\d+)$")
+
+UPLOAD_TYPES = {
+    "text/csv": "csv",
+    "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet": "xlsx",
+    "application/pdf": "pdf",
+    "image/png": "png",
+    "image/jpeg": "jpg"
+}
+
+logger = logging.getLogger(__name__)
+
+# JSON item fields -> engine columns
+ITEM_FIELDS = {"item": "Item", "qty": "Qty", "unit_rate": "Unit Rate (₹)", "amount": "Amount (₹)", "date": "Date"}
+
+
+class ApiError(Exception):
+    def __init__(self, status, message, headers=()):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+        self.headers = list(headers)
+
+
+def owner_for_key(key):
+    # Audits are stored under a digest, never the key itself
+    return "api:" + hashlib.sha256(key.encode()).hexdigest()[:16]
+
+
+def _header(scope, name):
+    for key, value in scope.get("headers", ()):
+        if key.decode("latin-1").lower() == name:
+            return value.decode("latin-1")
+    return None
+
+
+def authenticate(scope, keys=None):
+    keys = API_KEYS if keys is None else keys
+    if not keys:
+        raise ApiError(401, "No API keys are configured (MEDIAUDIT_API_KEYS)")
+    authorization = _header(scope, "authorization") or ""
+    key = authorization[7:].strip() if authorization.lower().startswith("bearer ") else _header(scope, "x-api-key")
+    # Compare against every key so timing does not reveal which prefix matched
+    valid = False
+    for candidate in keys:
+        valid |= hmac.compare_digest((key or "").encode(), candidate.encode())
+    if not key or not valid:
+        raise ApiError(401, "Missing or invalid API key", [(b"www-authenticate", b"Bearer")])
+    return owner_for_key(key)
+
+
+def items_from_json(entries):
+    """Engine items frame from [{"item": ..., "amount": ...}, ...] or [[item, amount], ...]"""
+    if not isinstance(entries, list) or not entries:
+        raise ApiError(400, '"items" must be a non-empty list')
+    rows = []
+    for i, entry in enumerate(entries):
+        if isinstance(entry, dict):
+            row = {column: entry.get(field) for field, column in ITEM_FIELDS.items()}
+        elif isinstance(entry, (list, tuple)) and len(entry) >= 2:
+            row = {"Item": entry[0], "Amount (₹)": entry[-1]}
+        else:
+            raise ApiError(400, "Each item must be an object with item and amount, or an [item, amount] pair")
+        item, amount = row["Item"], row["Amount (₹)"]
+        if not isinstance(item, str) or not item.strip():
+            raise ApiError(400, f"items[{i}]: item must be a non-empty string")
+        # bool is an int subclass, but true is not an amount
+        if isinstance(amount, bool) or not isinstance(amount, (int, float, str)) or not str(amount).strip():
+            raise ApiError(400, f"items[{i}]: amount must be a number or a numeric string")
+        rows.append(row)
+    items = pd.DataFrame(rows)
+    # Optional columns nobody sent would otherwise reach the engine as all-blank
+    unused = [c for c in items.columns if c not in ("Item", "Amount (₹)") and items[c].isna().all()]
+    return items.drop(columns=unused)
+
+
+def items_from_file(data, filename):
+    """Engine items frame from an uploaded CSV/XLSX, PDF or image bill"""
+    ext = filename.rsplit(".", 1)[-1].lower() if "." in filename else filename.lower()
+    if ext in ("csv", "xlsx"):
+        try:
+            items = read_table(BytesIO(data), filename)
+        except Exception as e:
+            raise ApiError(400, f"Unreadable {ext.upper()} file: {e}")
+        if "Item" not in items.columns or "Amount (₹)" not in items.columns:
+            raise ApiError(400, "The file needs Item and Amount columns")
+        return items
+    if ext not in ("pdf", "png", "jpg", "jpeg"):
+        raise ApiError(415, f"Unsupported file type: {ext}")
+
+    cache_key = extraction_cache.key(data, "pdf" if ext == "pdf" else "image")
+    items = extraction_cache.get(cache_key)
+    if items is None:
+        failed_pages = []
+        if ext == "pdf":
+            def note_page(page_no, source, seconds):
+                if source == "failed":
+                    failed_pages.append(page_no)
+
+            items = [item for _, page_items in iter_pdf_items(data, on_page=note_page) for item in page_items]
+        else:
+            txt = extract_text_from_image_bytes(data)
+            items = text_to_items_from_lines(txt.splitlines()) if txt else []
+        if failed_pages:
+            raise ApiError(422, f"Pages {', '.join(map(str, failed_pages))} of the PDF could not be read")
+        extraction_cache.put(cache_key, items)
+    if not items:
+        raise ApiError(422, "No line items could be read from this file")
+    return pd.DataFrame(items, columns=ITEM_COLUMNS)
+
+
+def _text_option(options, name):
+    """Optional string request field; None when absent or blank"""
+    value = options.get(name)
+    if value is None:
+        return None
+    if not isinstance(value, str):
+        raise ApiError(400, f"{name} must be a string")
+    return value.strip() or None
+
+
+def _flag_option(options, name, default):
+    value = options.get(name, default)
+    if isinstance(value, bool):
+        return value
+    if not isinstance(value, str):
+        raise ApiError(400, f"{name} must be true or false")
+    return value.strip().lower() not in ("0", "false", "no")
+
+
+def _multipart(body, content_type):
+    """(fields, (filename, bytes) or None) of a multipart/form-data body"""
+    message = email.parser.BytesParser(policy=email.policy.HTTP).parsebytes(
+        b"Content-Type: " + content_type.encode("latin-1") + b"\r\n\r\n" + body)
+    fields = {}
+    upload = None
+    for part in message.iter_parts():
+        name = part.get_param("name", header="content-disposition")
+        payload = part.get_payload(decode=True) or b""
+        if part.get_filename() or name == "file":
+            upload = (part.get_filename() or "", payload)
+        elif name:
+            fields[name] = payload.decode("utf-8", errors="replace")
+    return fields, upload
+
+
+def _json_scalar(value):
+    # NumPy numbers from the engine's summaries
+    if hasattr(value, "item"):
+        return value.item()
+    raise TypeError(f"{type(value).__name__} is not JSON serializable")
+
+
+def audit_json(record, lines=True):
+    body = {
+        "id": record.id,
+        "patient_name": record.patient_name,
+        "hospital": record.hospital,
+        "date": record.date,
+        "total_billed": record.total_billed,
+        "total_standard": record.total_standard,
+        "potential_savings": record.potential_savings,
+        "audit_score": record.audit_score,
+        "flagged_count": record.flagged_count,
+        "excluded_count": record.excluded_count,
+        "excluded_amount": record.excluded_amount,
+        "alerts": list(record.alerts),
+        "overcharge_types": dict(record.overcharge_types)
+    }
+    if lines:
+        body["lines"] = [dict(zip(LINE_FIELDS, row)) for row in record.line_rows()]
+    return body
+
+
+class AuditApi:
+    """The ASGI application; one instance per server process"""
+
+    def __init__(self, concurrency=API_CONCURRENCY, max_pending=API_MAX_PENDING, keys=None, audits=None,
+                 references=None):
+        self.concurrency = concurrency
+        self.max_pending = max_pending
+        self.keys = keys
+        self._audits = audits
+        self._references = references
+        self._executor = None
+        self._slots = None
+        self.pending = 0
+
+    @property
+    def audits(self):
+        if self._audits is None:
+            self._audits = AuditStore()
+        return self._audits
+
+    @property
+    def references(self):
+        if self._references is None:
+            self._references = ReferenceStore()
+        return self._references
+
+    def startup(self):
+        self._executor = ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix="audit-api")
+        self._slots = asyncio.Semaphore(self.concurrency)
+        # Load the rates and open the database before the first request, not during it
+        self.references.current()
+        self.audits
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "lifespan":
+            await self._lifespan(receive, send)
+        elif scope["type"] == "http":
+            await self._http(scope, receive, send)
+
+    async def _lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                try:
+                    self.startup()
+                except Exception as e:
+                    await send({"type": "lifespan.startup.failed", "message": str(e)})
+                    return
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                self.shutdown()
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+    async def _run(self, fn, *args):
+        """Run blocking work on the pool, shedding load once too many requests wait"""
+        if self._executor is None:
+            self.startup()
+        if self.pending >= self.max_pending:
+            raise ApiError(503, "Too many audits in progress, retry shortly",
+                           [(b"retry-after", str(RETRY_AFTER_SECONDS).encode())])
+        self.pending += 1
+        try:
+            async with self._slots:
+                return await asyncio.get_running_loop().run_in_executor(self._executor, fn, *args)
+        finally:
+            self.pending -= 1
+
+    async def _http(self, scope, receive, send):
+        try:
+            status, body, headers = await self._route(scope, receive)
+        except ApiError as e:
+            status, body, headers = e.status, {"error": e.message}, e.headers
+        except Exception:
+            # Details go to the server log; clients could otherwise read paths or data from the message
+            logger.exception("Unhandled error in %s %s", scope.get("method"), scope.get("path"))
+            status, body, headers = 500, {"error": "Internal server error"}, []
+        payload = json.dumps(body, ensure_ascii=False, default=_json_scalar).encode("utf-8")
+        await send({
+            "type": "http.response.start",
+            "status": status,
+            "headers": [(b"content-type", b"application/json; charset=utf-8"),
+                        (b"content-length", str(len(payload)).encode())] + headers
+        })
+        await send({"type": "http.response.body", "body": payload})
+
+    async def _route(self, scope, receive):
+        method, path = scope["method"], scope["path"].rstrip("/") or "/"
+        if path == "/health":
+            return 200, {"status": "ok", "reference_version": self.references.version, "pending": self.pending}, []
+        if path == "/audits":
+            if method != "POST":
+                raise ApiError(405, "Use POST /audits", [(b"allow", b"POST")])
+            owner = authenticate(scope, self.keys)
+            body = await self._read_body(receive)
+            audit_id, record = await self._run(self.create_audit, owner, scope, body)
+            return 201, dict(audit_json(record), id=audit_id), [(b"location", f"/audits/{audit_id}".encode())]
+        match = AUDIT_PATH.match(path)
+        if match:
+            if method != "GET":
+                raise ApiError(405, "Use GET /audits/{id}", [(b"allow", b"GET")])
+            owner = authenticate(scope, self.keys)
+            record = await self._run(self.audits.audit, owner, int(match.group(1)), True)
+            if record is None:
+                raise ApiError(404, f"No audit {match.group(1)}")
+            return 200, audit_json(record), []
+        raise ApiError(404, f"No route for {path}")
+
+    async def _read_body(self, receive):
+        chunks = []
+        size = 0
+        while True:
+            message = await receive()
+            if message["type"] == "http.disconnect":
+                raise ApiError(400, "Client disconnected")
+            chunk = message.get("body", b"")
+            size += len(chunk)
+            if size > API_MAX_BODY_BYTES:
+                raise ApiError(413, f"Request body over {API_MAX_BODY_BYTES:,} bytes")
+            chunks.append(chunk)
+            if not message.get("more_body", False):
+                return b"".join(chunks)
+
+    def create_audit(self, owner, scope, body):
+        """Parse the request, audit the bill and store it; runs on the worker pool"""
+        content_type = _header(scope, "content-type") or ""
+        media_type = content_type.split(";")[0].strip().lower()
+        options = {k: v[-1] for k, v in parse_qs(scope.get("query_string", b"").decode("latin-1")).items()}
+
+        if media_type == "application/json":
+            try:
+                request = json.loads(body or b"{}")
+            except ValueError as e:
+                raise ApiError(400, f"Invalid JSON: {e}")
+            if not isinstance(request, dict):
+                raise ApiError(400, "Expected a JSON object")
+            options.update(request)
+            items = items_from_json(request.get("items"))
+        elif media_type == "multipart/form-data":
+            fields, upload = _multipart(body, content_type)
+            options.update(fields)
+            if upload is None:
+                raise ApiError(400, 'Multipart uploads need a "file" field')
+            filename, data = upload
+            items = items_from_file(data, filename or options.get("filename", ""))
+        elif media_type in UPLOAD_TYPES or options.get("filename"):
+            items = items_from_file(body, options.get("filename") or UPLOAD_TYPES[media_type])
+        else:
+            raise ApiError(415, "Send application/json, multipart/form-data or a CSV/XLSX/PDF/image body")
+
+        tier = _text_option(options, "city_tier")
+        if tier is not None and tier not in CITY_TIER_FACTORS:
+            raise ApiError(400, f"city_tier must be one of {', '.join(CITY_TIER_FACTORS)}")
+        as_of = _text_option(options, "admission_date")
+        if as_of is not None:
+            try:
+                as_of = pd.Timestamp(as_of)
+            except ValueError:
+                raise ApiError(400, f"Invalid admission_date: {as_of}")
+        flag_exclusions = _flag_option(options, "flag_exclusions", True)
+        hospital = _text_option(options, "hospital")
+
+        reference = self.references.current(hospital, tier, as_of)
+        result = audit_bill(items, reference, flag_exclusions=flag_exclusions, insurer=_text_option(options, "insurer"))
+        record = AuditRecord.from_result(
+            result,
+            patient_name=_text_option(options, "patient_name"),
+            hospital=hospital,
+            contact=_text_option(options, "contact"),
+            email=_text_option(options, "email"),
+            date=datetime.now().strftime(DATE_FORMAT)
+        )
+        return self.audits.save_audit(owner, record), record
+
+
+app = AuditApi()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="MediAudit REST API")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--workers", type=int, default=1, help="server processes, each with its own pool")
+    args = parser.parse_args(argv)
+    try:
+        import uvicorn
+    except ImportError:
+        raise SystemExit("Serving the API needs an ASGI server: pip install uvicorn")
+    uvicorn.run("api:app", host=args.host, port=args.port, workers=args.workers,
+                timeout_keep_alive=KEEP_ALIVE_SECONDS, limit_concurrency=API_MAX_CONNECTIONS)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,15 +1,18 @@
 import streamlit as st
 import pandas as pd
-import pdfplumber
-import pytesseract
-from PIL import Image
-from io import BytesIO
-import difflib
 import plotly.express as px
 import plotly.graph_objects as go
 import os
 from datetime import datetime, timedelta
 import time
+import uuid
+
+from audit_engine import StageTimer, audit_bill
+from audit_store import DATE_FORMAT, AuditRecord, AuditStore
+from batch import read_bulk_file, read_table, run_batch, summary_frame, template_frame
+from extraction import ITEM_COLUMNS, extract_text_from_image_bytes, extraction_cache, iter_pdf_items, text_to_items_from_lines
+from reference_store import CITY_TIER_FACTORS, ReferenceStore
+from workers import DEFAULT_CHUNK_SIZE, DEFAULT_WORKERS
 
 # Page config
 st.set_page_config(
@@ -209,96 +212,50 @@ st.markdown("""
 """, unsafe_allow_html=True)
 
 # Helper functions
-@st.cache_data
-def load_reference_data():
-    try:
-        cghs = pd.read_csv("cghs_rates.csv")
-    except Exception:
-        cghs = pd.DataFrame({
-            "Service": ["Room Rent", "Doctor Fees", "Lab Test", "Surgery", "ICU Charges", "CT Scan", "MRI", "X-Ray"],
-            "Rate (₹)": [4000, 2500, 1500, 50000, 8000, 3000, 5000, 800]
-        })
-    return cghs
-
-def normalize_text(s):
-    if pd.isna(s):
-        return ""
-    return str(s).strip().lower()
+@st.cache_resource
+def reference_store():
+    # One store per server; it picks up edited rate files without a restart
+    return ReferenceStore()
 
-def fuzzy_match_service(service, cghs_services, cutoff=0.70):
-    if not service:
-        return None, 0.0
-    best = None
-    best_score = 0.0
-    for cand in cghs_services:
-        score = difflib.SequenceMatcher(None, service, cand).ratio()
-        if score > best_score:
-            best_score = score
-            best = cand
-    if best_score >= cutoff:
-        return best, best_score
-    return None, best_score
+def load_reference_data(hospital=None, tier=None, as_of=None):
+    return reference_store().current(hospital, tier, as_of)
 
-def detect_overcharge_type(item_name, amount, standard_rate):
-    """Detect type of overcharge based on patterns"""
-    item_lower = item_name.lower()
-    
-    # Inflated Consumables
-    if any(word in item_lower for word in ['syringe', 'gloves', 'mask', 'cotton', 'bandage', 'gauze', 'sanitizer']):
-        if amount > standard_rate * 2:
-            return "Inflated Consumables"
-    
-    # Duplicate Billing (simplified detection)
-    return "Overcharge Detected"
+@st.cache_resource
+def audit_store():
+    # Queue, payments and negotiations live in SQLite, not in each session's memory
+    return AuditStore()
 
-def text_to_items_from_lines(lines):
-    items = []
-    for line in lines:
-        line = line.strip()
-        if not line:
-            continue
-        parts = line.rsplit(" ", 1)
-        if len(parts) == 2:
-            left, right = parts
-            amount_token = right.replace("₹", "").replace(",", "").replace("Rs.", "").strip()
-            if amount_token.replace(".", "", 1).isdigit():
-                try:
-                    amt = float(amount_token)
-                    items.append((left.strip(), amt))
-                    continue
-                except:
-                    pass
-    return items
+# Bills and negotiation requests rendered per page; only that page is read from the store
+LIST_PAGE_SIZE = 10
 
-def extract_text_from_pdf_bytes(pdf_bytes):
-    text_accum = ""
-    try:
-        with pdfplumber.open(BytesIO(pdf_bytes)) as pdf:
-            for page in pdf.pages:
-                page_text = page.extract_text()
-                if page_text:
-                    text_accum += page_text + "\n"
-    except Exception:
-        pass
-    return text_accum
+def page_offset(total, key, page_size=LIST_PAGE_SIZE):
+    """Page picker for a list of `total` rows; returns the offset of the page to render"""
+    pages = max(1, -(-total // page_size))
+    if pages == 1:
+        return 0
+    # Removing rows can leave the remembered page past the end
+    if st.session_state.get(key, 1) > pages:
+        st.session_state[key] = pages
+    page = st.number_input(f"Page (of {pages})", min_value=1, max_value=pages, step=1, key=key)
+    return (page - 1) * page_size
 
-def extract_text_from_image_bytes(img_bytes):
-    try:
-        img = Image.open(BytesIO(img_bytes)).convert("RGB")
-        text = pytesseract.image_to_string(img)
-        return text
-    except Exception as e:
-        return ""
+AUDIT_STAGES = {
+    "extract": "Extracting bill items",
+    "match": "Matching services to CGHS rates",
+    "score": "Scoring overcharges",
+    "render": "Rendering report"
+}
 
 # Initialize session state
-if 'bill_queue' not in st.session_state:
-    st.session_state.bill_queue = []
-if 'current_audit' not in st.session_state:
-    st.session_state.current_audit = None
-if 'payment_history' not in st.session_state:
-    st.session_state.payment_history = []
-if 'negotiation_requests' not in st.session_state:
-    st.session_state.negotiation_requests = []
+# Session state holds audit ids only; records and their lines stay in the store
+if 'current_audit_id' not in st.session_state:
+    st.session_state.current_audit_id = None
+# Stored audits belong to this id; it is kept in the URL so a refresh or restart finds them again
+if 'owner_id' not in st.session_state:
+    st.session_state.owner_id = st.query_params.get("sid") or uuid.uuid4().hex
+st.query_params["sid"] = st.session_state.owner_id
+owner_id = st.session_state.owner_id
+store = audit_store()
 
 # Sidebar
 with st.sidebar:
@@ -316,15 +273,15 @@ with st.sidebar:
     
     if user_type == "👤 Patient Portal":
         st.markdown("### 📊 Your Stats")
+        queue_count, total_queue = store.queue_totals(owner_id)
         col1, col2 = st.columns(2)
         with col1:
-            st.metric("Audits", str(len(st.session_state.payment_history) + len(st.session_state.bill_queue)))
+            st.metric("Audits", str(store.payment_count(owner_id) + queue_count))
         with col2:
-            st.metric("In Queue", str(len(st.session_state.bill_queue)))
+            st.metric("In Queue", str(queue_count))
         
-        if st.session_state.bill_queue:
+        if queue_count:
             st.markdown("---")
-            total_queue = sum([b['total_billed'] for b in st.session_state.bill_queue])
             st.info(f"**Queue Total**\n₹{total_queue:,.0f}")
     
     st.markdown("---")
@@ -435,6 +392,7 @@ elif user_type == "👤 Patient Portal":
                            "Medanta", "Manipal Hospital", "Narayana Health", "Max Hospital"]
             hospital = st.selectbox("Hospital", hospital_list)
             admission_date = st.date_input("Admission Date")
+            city_tier = st.selectbox("CGHS City Tier", list(CITY_TIER_FACTORS))
         
         with col3:
             contact_number = st.text_input("Contact Number", placeholder="+91-9876543210")
@@ -458,176 +416,132 @@ elif user_type == "👤 Patient Portal":
         manual_extract = st.checkbox("📝 Enter manually")
         
         if uploaded or manual_extract:
-            df_items = pd.DataFrame(columns=["Item", "Amount (₹)"])
+            extract_started = time.perf_counter()
+            df_items = pd.DataFrame(columns=["Item", "Amount (₹)", "Date"])
             
             if manual_extract:
                 txt = st.text_area("Paste bill text", height=150)
                 if txt:
                     lines = txt.splitlines()
                     items = text_to_items_from_lines(lines)
-                    df_items = pd.DataFrame(items, columns=["Item", "Amount (₹)"])
+                    df_items = pd.DataFrame(items, columns=ITEM_COLUMNS)
             else:
                 ext = uploaded.name.split(".")[-1].lower()
                 
                 with st.spinner("🔄 Extracting bill data..."):
                     if ext in ("csv", "xlsx"):
                         try:
-                            df_items = pd.read_csv(uploaded) if ext == "csv" else pd.read_excel(uploaded)
-                            col_map = {}
-                            for c in df_items.columns:
-                                lc = c.strip().lower()
-                                if "item" in lc or "service" in lc:
-                                    col_map[c] = "Item"
-                                if "amount" in lc or "₹" in lc or "cost" in lc:
-                                    col_map[c] = "Amount (₹)"
-                            df_items = df_items.rename(columns=col_map)
+                            df_items = read_table(uploaded, uploaded.name)
                             if "Item" in df_items.columns and "Amount (₹)" in df_items.columns:
-                                df_items = df_items[["Item", "Amount (₹)"]]
+                                # Service dates let repeated charges be told from repeat visits
+                                df_items = df_items.reindex(columns=["Item", "Amount (₹)", "Date"])
                         except Exception as e:
                             st.error(f"Error: {e}")
                     
-                    elif ext in ("jpg", "jpeg", "png"):
-                        bytes_data = uploaded.read()
-                        txt = extract_text_from_image_bytes(bytes_data)
-                        if txt:
-                            items = text_to_items_from_lines(txt.splitlines())
-                            df_items = pd.DataFrame(items, columns=["Item", "Amount (₹)"])
-                    
-                    elif ext == "pdf":
-                        txt = extract_text_from_pdf_bytes(uploaded.read())
-                        if txt.strip():
-                            items = text_to_items_from_lines(txt.splitlines())
-                            df_items = pd.DataFrame(items, columns=["Item", "Amount (₹)"])
+                    elif ext in ("jpg", "jpeg", "png", "pdf"):
+                        bytes_data = uploaded.getvalue()
+                        cache_key = extraction_cache.key(bytes_data, "pdf" if ext == "pdf" else "image")
+                        items = extraction_cache.get(cache_key)
+                        
+                        if items is None and ext == "pdf":
+                            # Show items page by page while later pages are still extracting
+                            preview = st.empty()
+                            items = []
+                            page_sources = []
+                            failed_pages = []
+                            
+                            def note_page(page_no, source, seconds):
+                                page_sources.append((source, seconds))
+                                if source == "failed":
+                                    failed_pages.append(page_no)
+                            
+                            for page_no, page_items in iter_pdf_items(bytes_data, on_page=note_page):
+                                items.extend(page_items)
+                                with preview.container():
+                                    st.caption(f"📄 Page {page_no} ({page_sources[-1][0]}): {len(items)} items found so far")
+                                    st.dataframe(pd.DataFrame(items, columns=ITEM_COLUMNS),
+                                                 use_container_width=True, height=200)
+                            preview.empty()
+                            
+                            ocr_pages = [seconds for source, seconds in page_sources if source == "ocr"]
+                            text_pages = [seconds for source, seconds in page_sources if source == "text"]
+                            st.caption(f"📄 {len(text_pages)} text page(s) in {sum(text_pages):.2f}s · "
+                                       f"{len(ocr_pages)} scanned page(s) OCR'd in {sum(ocr_pages):.2f}s")
+                            if failed_pages:
+                                # Not cached, so the next upload tries these pages again
+                                st.warning(f"⚠️ Page(s) {', '.join(map(str, failed_pages))} could not be read. "
+                                           "Please add their items below.")
+                            else:
+                                extraction_cache.put(cache_key, items)
+                        elif items is None:
+                            txt = extract_text_from_image_bytes(bytes_data)
+                            items = text_to_items_from_lines(txt.splitlines()) if txt else []
+                            extraction_cache.put(cache_key, items)
+                        
+                        if items:
+                            df_items = pd.DataFrame(items, columns=ITEM_COLUMNS)
+                        else:
+                            st.warning("⚠️ No line items could be read from this file. Please enter them below.")
+            
+            extract_seconds = time.perf_counter() - extract_started
             
             if df_items.empty:
-                df_items = pd.DataFrame([["", ""], ["", ""]], columns=["Item", "Amount (₹)"])
+                df_items = pd.DataFrame([["", "", ""], ["", "", ""]], columns=["Item", "Amount (₹)", "Date"])
             
             st.markdown("### 📋 Extracted Items")
-            edited = st.data_editor(df_items, num_rows="dynamic", use_container_width=True)
+            if "Date" in df_items.columns:
+                df_items["Date"] = df_items["Date"].fillna("").astype(str)
+            edited = st.data_editor(df_items, num_rows="dynamic", use_container_width=True, column_config={
+                "Date": st.column_config.TextColumn("Date", help="Optional service date, e.g. 02/03/2024")
+            })
             
             col1, col2 = st.columns(2)
             with col1:
                 run_audit = st.button("🚀 Run FREE Audit", use_container_width=True, type="primary")
             
             if run_audit and not edited.empty and patient_name:
-                # Audit Progress Animation
+                # Audit progress follows the engine's real stages
                 st.markdown("### 🔍 Auditing Your Bill...")
                 
                 progress_bar = st.progress(0)
                 status_text = st.empty()
                 
-                audit_steps = [
-                    ("Checking for Inflated Consumables...", 25),
-                    ("Detecting Duplicate Billing...", 50),
-                    ("Analyzing for Upcoding...", 75),
-                    ("Checking Unbundling Practices...", 100)
-                ]
-                
-                for step, progress in audit_steps:
-                    status_text.text(step)
-                    progress_bar.progress(progress)
-                    time.sleep(0.8)
+                def show_audit_stage(stage, seconds):
+                    progress_bar.progress((list(AUDIT_STAGES).index(stage) + 1) / len(AUDIT_STAGES))
+                    status_text.text(f"✓ {AUDIT_STAGES[stage]} ({seconds * 1000:,.0f} ms)")
                 
-                status_text.empty()
-                progress_bar.empty()
+                audit_timer = StageTimer(on_stage=show_audit_stage)
+                audit_timer.record("extract", extract_seconds)
                 
                 # Perform Audit
-                cghs_df = load_reference_data()
-                cghs_df["service_norm"] = cghs_df["Service"].astype(str).str.strip().str.lower()
-                cghs_services = list(cghs_df["service_norm"].dropna().unique())
-                
-                results = []
-                alerts = []
-                overcharge_types = {
-                    "Inflated Consumables": 0,
-                    "Duplicate Billing": 0,
-                    "Upcoding": 0,
-                    "Unbundling": 0
-                }
-                
-                total_billed = 0
-                total_standard = 0
-                potential_savings = 0
-                
-                for idx, r in edited.iterrows():
-                    item = normalize_text(r.get("Item", ""))
-                    if not item:
-                        continue
-                    
-                    try:
-                        amount = float(str(r.get("Amount (₹)", 0)).replace(",", "").replace("₹", "").strip())
-                    except:
-                        amount = 0.0
-                    
-                    total_billed += amount
-                    status = "Normal"
-                    overcharge_type = ""
-                    comment = ""
-                    standard_rate = amount
-                    
-                    matched, score = fuzzy_match_service(item, cghs_services, cutoff=0.65)
-                    
-                    if matched:
-                        row_ref = cghs_df[cghs_df["service_norm"] == matched].iloc[0]
-                        rate = float(row_ref["Rate (₹)"])
-                        standard_rate = rate
-                        total_standard += rate
-                        
-                        if amount > rate * 1.15:  # 15% tolerance
-                            status = "Overcharged"
-                            savings = amount - rate
-                            potential_savings += savings
-                            
-                            # Determine overcharge type
-                            if any(word in item for word in ['syringe', 'glove', 'mask', 'cotton', 'bandage', 'gauze']):
-                                overcharge_type = "Inflated Consumables"
-                                overcharge_types["Inflated Consumables"] += 1
-                            elif amount > rate * 2:
-                                overcharge_type = "Upcoding"
-                                overcharge_types["Upcoding"] += 1
-                            else:
-                                overcharge_type = "Overcharge Detected"
-                            
-                            comment = f"₹{amount:,.0f} vs ₹{rate:,.0f} (Save ₹{savings:,.0f})"
-                            alerts.append(f"⚠️ {r.get('Item')}: {overcharge_type} - Save ₹{savings:,.0f}")
-                        else:
-                            total_standard += amount
-                    else:
-                        status = "Unlisted"
-                        comment = "Not in CGHS rates"
-                        total_standard += amount
-                    
-                    results.append({
-                        "Service": r.get("Item"),
-                        "Billed (₹)": amount,
-                        "Standard (₹)": standard_rate,
-                        "Status": status,
-                        "Type": overcharge_type,
-                        "Comments": comment
-                    })
+                # Rates in force on the admission date, for this hospital's tariff and city tier
+                reference = load_reference_data(None if hospital == "Select hospital" else hospital,
+                                                city_tier, admission_date)
+                audit = audit_bill(edited, reference, audit_timer)
                 
-                results_df = pd.DataFrame(results)
-                flagged_count = len([r for r in results if r['Status'] == 'Overcharged'])
-                audit_score = max(0, 100 - flagged_count * 10)
-                
-                # Store audit
-                st.session_state.current_audit = {
-                    'patient_name': patient_name,
-                    'hospital': hospital,
-                    'contact': contact_number,
-                    'email': email,
-                    'date': datetime.now().strftime("%Y-%m-%d %H:%M"),
-                    'results_df': results_df,
-                    'total_billed': total_billed,
-                    'total_standard': total_standard,
-                    'potential_savings': potential_savings,
-                    'audit_score': audit_score,
-                    'flagged_count': flagged_count,
-                    'alerts': alerts,
-                    'overcharge_types': overcharge_types
-                }
+                status_text.empty()
+                progress_bar.empty()
+                audit_timer.on_stage = None
+                render_started = time.perf_counter()
+                results_df = audit.results_df
+                alerts = audit.alerts
+                overcharge_types = audit.overcharge_types
+                potential_savings = audit.potential_savings
+                flagged_count = audit.flagged_count
+                audit_score = audit.audit_score
+                
+                # Store audit once; queue, payment and negotiation refer to it by id
+                st.session_state.current_audit_id = store.save_audit(owner_id, AuditRecord.from_result(
+                    audit,
+                    patient_name=patient_name,
+                    hospital=hospital,
+                    contact=contact_number,
+                    email=email,
+                    date=datetime.now().strftime(DATE_FORMAT)
+                ))
                 
                 st.success("✅ Audit Complete!")
+                timing_caption = st.empty()
                 st.markdown("---")
                 
                 # Results
@@ -711,8 +625,10 @@ elif user_type == "👤 Patient Portal":
                 st.markdown("### 🔍 Detailed Results")
                 
                 def highlight_status(row):
-                    if row["Status"] == "Overcharged":
+                    if row["Status"] in ("Overcharged", "Duplicate", "Unbundled"):
                         return ['background-color: #fee2e2'] * len(row)
+                    elif row["Status"] in ("Excluded", "Possible Duplicate"):
+                        return ['background-color: #fef3c7'] * len(row)
                     elif row["Status"] == "Unlisted":
                         return ['background-color: #e0f2fe'] * len(row)
                     return ['background-color: #d1fae5'] * len(row)
@@ -724,6 +640,11 @@ elif user_type == "👤 Patient Portal":
                     for alert in alerts:
                         st.warning(alert)
                 
+                audit_timer.record("render", time.perf_counter() - render_started)
+                timing_caption.caption("⏱️ " + " · ".join(
+                    f"{AUDIT_STAGES[stage]}: {seconds * 1000:,.0f} ms" for stage, seconds in audit_timer.timings.items()
+                ))
+                
                 # Negotiation Offer
                 if potential_savings > 500:
                     st.markdown("---")
@@ -751,10 +672,10 @@ elif user_type == "👤 Patient Portal":
                                 'potential_savings': potential_savings,
                                 'commission': potential_savings * 0.15,
                                 'status': 'Pending',
-                                'date': datetime.now().strftime("%Y-%m-%d %H:%M"),
-                                'audit_data': st.session_state.current_audit
+                                'date': datetime.now().strftime(DATE_FORMAT),
+                                'audit_id': st.session_state.current_audit_id
                             }
-                            st.session_state.negotiation_requests.append(negotiation_request)
+                            store.add_negotiation(owner_id, negotiation_request)
                             st.success("✅ Negotiation request submitted! Our team will contact you within 24 hours.")
                             st.balloons()
                     
@@ -770,13 +691,13 @@ elif user_type == "👤 Patient Portal":
                 
                 with col1:
                     if st.button("🗂️ Add to Bill Queue", use_container_width=True):
-                        st.session_state.bill_queue.append(st.session_state.current_audit)
-                        st.success(f"✓ Added! {len(st.session_state.bill_queue)} bills in queue")
+                        store.queue(owner_id, st.session_state.current_audit_id)
+                        st.success(f"✓ Added! {store.queue_totals(owner_id)[0]} bills in queue")
                         st.rerun()
                 
                 with col2:
                     if st.button("💰 Pay This Bill Now", use_container_width=True, type="primary"):
-                        st.session_state.payment_bills = [st.session_state.current_audit]
+                        st.session_state.payment_bill_ids = [st.session_state.current_audit_id]
                         st.session_state.show_payment = True
                         st.rerun()
                 
@@ -814,33 +735,7 @@ elif user_type == "👤 Patient Portal":
             demo_contact = "+91-9876543210"
             demo_email = "demo@mediaudit.com"
             
-            st.markdown("### 🔍 Running Demo Audit...")
-            
-            progress_bar = st.progress(0)
-            status_text = st.empty()
-            
-            audit_steps = [
-                ("Checking for Inflated Consumables...", 25),
-                ("Detecting Duplicate Billing...", 50),
-                ("Analyzing for Upcoding...", 75),
-                ("Checking Unbundling Practices...", 100)
-            ]
-            
-            for step, progress in audit_steps:
-                status_text.text(step)
-                progress_bar.progress(progress)
-                time.sleep(0.8)
-            
-            status_text.empty()
-            progress_bar.empty()
-            
-            # Perform Demo Audit
-            cghs_df = load_reference_data()
-            cghs_df["service_norm"] = cghs_df["Service"].astype(str).str.strip().str.lower()
-            cghs_services = list(cghs_df["service_norm"].dropna().unique())
-            
-            results = []
-            alerts = []
+            # Demo audit uses a staged result set
             overcharge_types = {
                 "Inflated Consumables": 2,
                 "Duplicate Billing": 0,
@@ -884,23 +779,23 @@ elif user_type == "👤 Patient Portal":
             flagged_count = 4
             audit_score = 60
             
-            # Store demo audit
-            st.session_state.current_audit = {
-                'patient_name': demo_patient_name,
-                'hospital': demo_hospital,
-                'contact': demo_contact,
-                'email': demo_email,
-                'date': datetime.now().strftime("%Y-%m-%d %H:%M"),
-                'results_df': results_df,
-                'total_billed': total_billed,
-                'total_standard': total_standard,
-                'potential_savings': potential_savings,
-                'audit_score': audit_score,
-                'flagged_count': flagged_count,
-                'alerts': alerts,
-                'overcharge_types': overcharge_types,
-                'is_demo': True
-            }
+            # The demo is only stored if it is added to the queue; running it saves nothing
+            demo_record = AuditRecord(
+                results_df,
+                patient_name=demo_patient_name,
+                hospital=demo_hospital,
+                contact=demo_contact,
+                email=demo_email,
+                date=datetime.now().strftime(DATE_FORMAT),
+                total_billed=total_billed,
+                total_standard=total_standard,
+                potential_savings=potential_savings,
+                audit_score=audit_score,
+                flagged_count=flagged_count,
+                alerts=alerts,
+                overcharge_types=overcharge_types,
+                is_demo=True
+            )
             
             st.success("✅ Demo Audit Complete!")
             st.markdown("---")
@@ -1018,8 +913,8 @@ elif user_type == "👤 Patient Portal":
             
             with col1:
                 if st.button("🗂️ Add Demo to Queue", use_container_width=True):
-                    st.session_state.bill_queue.append(st.session_state.current_audit)
-                    st.success(f"✓ Demo added! {len(st.session_state.bill_queue)} bills in queue")
+                    store.save_audit(owner_id, demo_record, queued=True)
+                    st.success(f"✓ Demo added! {store.queue_totals(owner_id)[0]} bills in queue")
             
             with col2:
                 st.button("💰 Try Payment Flow", use_container_width=True, disabled=True)
@@ -1032,63 +927,70 @@ elif user_type == "👤 Patient Portal":
     with tabs[1]:
         st.markdown("### 🗂️ Bill Queue & Payment")
         
-        if not st.session_state.bill_queue:
+        if st.session_state.pop('payment_completed', False):
+            st.success("✅ Payment Successful!")
+            st.balloons()
+            st.info("📧 Payment receipt sent to your email")
+        
+        queue_count, total_queue = store.queue_totals(owner_id)
+        if not queue_count:
             st.info("📭 No bills in queue. Audit a bill and add it to queue to pay multiple bills together!")
         else:
-            total_queue = sum([b['total_billed'] for b in st.session_state.bill_queue])
-            
             st.markdown(f"""
                 <div class="info-card" style="background: linear-gradient(135deg, #fff7ed 0%, #ffedd5 100%); border-color: #fb923c;">
-                    <h3>📋 {len(st.session_state.bill_queue)} Bills in Queue</h3>
+                    <h3>📋 {queue_count} Bills in Queue</h3>
                     <p style="font-size: 1.3rem; font-weight: 700; color: #1e3a8a;">Total: ₹{total_queue:,.0f}</p>
                 </div>
             """, unsafe_allow_html=True)
             
-            # Display queued bills
-            for idx, bill in enumerate(st.session_state.bill_queue):
-                is_demo = bill.get('is_demo', False)
+            # Display one page of queued bills
+            offset = page_offset(queue_count, "queue_page")
+            for idx, bill in enumerate(store.queued(owner_id, LIST_PAGE_SIZE, offset), start=offset):
+                is_demo = bill.is_demo
                 demo_badge = " 🎭 DEMO" if is_demo else ""
                 
-                with st.expander(f"Bill #{idx+1}{demo_badge}: {bill['patient_name']} - {bill['hospital']} (₹{bill['total_billed']:,.0f})"):
+                with st.expander(f"Bill #{idx+1}{demo_badge}: {bill.patient_name} - {bill.hospital} (₹{bill.total_billed:,.0f})"):
                     col1, col2, col3 = st.columns(3)
                     with col1:
-                        st.write(f"**Date:** {bill['date']}")
-                        st.write(f"**Hospital:** {bill['hospital']}")
+                        st.write(f"**Date:** {bill.date}")
+                        st.write(f"**Hospital:** {bill.hospital}")
                     with col2:
-                        st.write(f"**Audit Score:** {bill['audit_score']}/100")
-                        st.write(f"**Issues:** {bill['flagged_count']}")
+                        st.write(f"**Audit Score:** {bill.audit_score}/100")
+                        st.write(f"**Issues:** {bill.flagged_count}")
                     with col3:
-                        st.write(f"**Total:** ₹{bill['total_billed']:,.0f}")
-                        st.write(f"**Savings:** ₹{bill['potential_savings']:,.0f}")
+                        st.write(f"**Total:** ₹{bill.total_billed:,.0f}")
+                        st.write(f"**Savings:** ₹{bill.potential_savings:,.0f}")
                     
-                    st.dataframe(bill['results_df'], use_container_width=True)
+                    # Line items are read and built into a table only on request
+                    if st.toggle("Show line items", key=f"lines_{bill.id}"):
+                        st.dataframe(store.results_df(owner_id, bill.id), use_container_width=True)
                     
                     col1, col2 = st.columns(2)
                     with col1:
                         if not is_demo:
-                            if st.button(f"💰 Pay Bill #{idx+1}", key=f"pay_{idx}", use_container_width=True):
-                                st.session_state.payment_bills = [bill]
+                            if st.button(f"💰 Pay Bill #{idx+1}", key=f"pay_{bill.id}", use_container_width=True):
+                                st.session_state.payment_bill_ids = [bill.id]
                                 st.session_state.show_payment = True
                                 st.rerun()
                         else:
-                            st.button(f"💰 Pay Bill #{idx+1}", key=f"pay_{idx}", use_container_width=True, disabled=True)
+                            st.button(f"💰 Pay Bill #{idx+1}", key=f"pay_{bill.id}", use_container_width=True, disabled=True)
                             st.caption("Demo bills can't be paid")
                     
                     with col2:
-                        if st.button(f"🗑️ Remove", key=f"remove_{idx}", use_container_width=True):
-                            st.session_state.bill_queue.pop(idx)
+                        if st.button(f"🗑️ Remove", key=f"remove_{bill.id}", use_container_width=True):
+                            store.unqueue(owner_id, [bill.id])
                             st.rerun()
             
             st.markdown("---")
             
             # Check if any non-demo bills exist
-            non_demo_bills = [b for b in st.session_state.bill_queue if not b.get('is_demo', False)]
+            non_demo_ids = store.queued_ids(owner_id, include_demo=False)
             
             col1, col2 = st.columns(2)
             with col1:
-                if non_demo_bills:
+                if non_demo_ids:
                     if st.button("💳 Pay All Bills Together", use_container_width=True, type="primary"):
-                        st.session_state.payment_bills = non_demo_bills
+                        st.session_state.payment_bill_ids = non_demo_ids
                         st.session_state.show_payment = True
                         st.rerun()
                 else:
@@ -1097,7 +999,7 @@ elif user_type == "👤 Patient Portal":
             
             with col2:
                 if st.button("🗑️ Clear Queue", use_container_width=True):
-                    st.session_state.bill_queue = []
+                    store.clear_queue(owner_id)
                     st.rerun()
         
         # Payment Section
@@ -1105,8 +1007,9 @@ elif user_type == "👤 Patient Portal":
             st.markdown("---")
             st.markdown("## 💳 Complete Your Payment")
             
-            payment_bills = st.session_state.get('payment_bills', [])
-            total_payment = sum([bill['total_billed'] for bill in payment_bills])
+            payment_bills = [store.audit(owner_id, audit_id) for audit_id in st.session_state.get('payment_bill_ids', [])]
+            payment_bills = [bill for bill in payment_bills if bill is not None]
+            total_payment = sum([bill.total_billed for bill in payment_bills])
             
             st.success(f"💰 **Total Payment Amount: ₹{total_payment:,.0f}**")
             
@@ -1299,34 +1202,22 @@ elif user_type == "👤 Patient Portal":
             
             with col2:
                 if st.button("💳 Complete Payment", use_container_width=True, type="primary", disabled=not agree):
-                    with st.spinner("Processing your payment..."):
-                        time.sleep(2)
-                    
-                    # Add to payment history
-                    for bill in payment_bills:
-                        payment_record = bill.copy()
-                        payment_record['payment_date'] = datetime.now().strftime("%Y-%m-%d %H:%M")
-                        payment_record['payment_method'] = payment_method
-                        payment_record['payment_status'] = 'Completed'
-                        if payment_method == "💼 EMI Options":
-                            payment_record['emi_tenure'] = emi_tenure
-                            payment_record['monthly_emi'] = emi_amount
-                        st.session_state.payment_history.append(payment_record)
-                    
-                    # Remove from queue
-                    st.session_state.bill_queue = [b for b in st.session_state.bill_queue if b not in payment_bills]
+                    # Add to payment history and remove from queue in one transaction
+                    is_emi = payment_method == "💼 EMI Options"
+                    store.record_payments(owner_id, [bill.id for bill in payment_bills], payment_method,
+                                          emi_tenure=emi_tenure if is_emi else None,
+                                          monthly_emi=emi_amount if is_emi else None)
                     st.session_state.show_payment = False
                     
-                    st.success("✅ Payment Successful!")
-                    st.balloons()
-                    st.info("📧 Payment receipt sent to your email")
-                    time.sleep(2)
+                    # Confirmation is shown after the rerun instead of holding this run open
+                    st.session_state.payment_completed = True
                     st.rerun()
     
     with tabs[2]:
         st.markdown("### 🤝 Negotiation Requests")
         
-        if not st.session_state.negotiation_requests:
+        negotiation_count = store.negotiation_count(owner_id)
+        if not negotiation_count:
             st.info("📭 No negotiation requests yet. Submit a request after auditing a bill with potential savings!")
         else:
             st.markdown(f"""
@@ -1336,7 +1227,8 @@ elif user_type == "👤 Patient Portal":
                 </div>
             """, unsafe_allow_html=True)
             
-            for idx, req in enumerate(st.session_state.negotiation_requests):
+            offset = page_offset(negotiation_count, "negotiation_page")
+            for req in store.negotiations(owner_id, LIST_PAGE_SIZE, offset):
                 status_color = {
                     'Pending': '🟡',
                     'In Progress': '🔵',
@@ -1377,17 +1269,18 @@ elif user_type == "👤 Patient Portal":
                     if req['status'] == 'Pending':
                         col1, col2 = st.columns(2)
                         with col1:
-                            if st.button(f"📞 Schedule Call", key=f"call_{idx}", use_container_width=True):
+                            if st.button(f"📞 Schedule Call", key=f"call_{req['request_id']}", use_container_width=True):
                                 st.success("Call scheduled! We'll contact you soon.")
                         with col2:
-                            if st.button(f"❌ Cancel Request", key=f"cancel_{idx}", use_container_width=True):
-                                st.session_state.negotiation_requests.pop(idx)
+                            if st.button(f"❌ Cancel Request", key=f"cancel_{req['request_id']}", use_container_width=True):
+                                store.cancel_negotiation(owner_id, req['request_id'])
                                 st.rerun()
     
     with tabs[3]:
         st.markdown("### 📋 Payment & Audit History")
         
-        if not st.session_state.payment_history:
+        payment_history = store.payments(owner_id)
+        if not payment_history:
             st.info("📭 No payment history yet. Complete a bill payment to see it here!")
             
             # Show sample history
@@ -1402,7 +1295,7 @@ elif user_type == "👤 Patient Portal":
             st.dataframe(sample_history, use_container_width=True)
         else:
             history_data = []
-            for record in st.session_state.payment_history:
+            for record in payment_history:
                 history_data.append({
                     'Date': record['payment_date'],
                     'Patient': record['patient_name'],
@@ -1419,9 +1312,9 @@ elif user_type == "👤 Patient Portal":
             # Summary stats
             col1, col2, col3 = st.columns(3)
             
-            total_paid = sum([r['total_billed'] for r in st.session_state.payment_history])
-            total_saved = sum([r['potential_savings'] for r in st.session_state.payment_history])
-            total_audits = len(st.session_state.payment_history)
+            total_paid = sum([r['total_billed'] for r in payment_history])
+            total_saved = sum([r['potential_savings'] for r in payment_history])
+            total_audits = len(payment_history)
             
             with col1:
                 st.metric("Total Paid", f"₹{total_paid:,.0f}")
@@ -1522,19 +1415,70 @@ elif user_type == "🏢 B2B Enterprise":
         with col2:
             st.info("**Features**\n\n✓ Up to 1000 bills\n✓ Auto validation\n✓ Real-time updates\n✓ Export results")
             
-            if st.button("📥 Download Template", use_container_width=True):
-                st.success("✓ Template downloaded!")
+            st.download_button("📥 Download Template", template_frame().to_csv(index=False),
+                               file_name="mediaudit_bulk_template.csv", mime="text/csv",
+                               use_container_width=True)
         
         if bulk_file:
             st.success(f"✓ File uploaded: {bulk_file.name}")
             
+            col1, col2 = st.columns(2)
+            with col1:
+                batch_workers = st.number_input("Worker Processes", min_value=1, max_value=64, value=DEFAULT_WORKERS,
+                                                help="1 audits in this process; more fans bills out across CPU cores")
+            with col2:
+                batch_chunk_size = st.number_input("Bills per Work Unit", min_value=10, max_value=5000,
+                                                   value=DEFAULT_CHUNK_SIZE, step=10)
+            
             if st.button("🚀 Start Batch Processing", use_container_width=True, type="primary"):
-                with st.spinner("Processing batch..."):
+                try:
+                    bulk_df = read_bulk_file(bulk_file, bulk_file.name)
+                except Exception as e:
+                    st.error(f"Error: {e}")
+                else:
                     progress_bar = st.progress(0)
-                    for i in range(100):
-                        progress_bar.progress(i + 1)
-                        time.sleep(0.02)
-                st.success("✓ Batch processing completed!")
+                    status_text = st.empty()
+                    
+                    shown_percent = [-1]
+                    
+                    def show_batch_progress(done, total, elapsed):
+                        # Redraw only when the whole percent moves, so the UI doesn't throttle the batch;
+                        # chunks can jump several percent at once, so compare with the last redraw
+                        percent = 100 * done // total
+                        if percent > shown_percent[0]:
+                            shown_percent[0] = percent
+                            progress_bar.progress(done / total)
+                            status_text.text(f"Audited {done}/{total} bills ({done / max(elapsed, 1e-9):,.0f} bills/sec)")
+                    
+                    # The setting lives in the Enterprise Settings tab, which renders after this one
+                    records, elapsed = run_batch(bulk_df, load_reference_data(), on_progress=show_batch_progress,
+                                                 workers=int(batch_workers), chunk_size=int(batch_chunk_size),
+                                                 flag_exclusions=st.session_state.get('auto_flag_exclusions', True))
+                    st.session_state.batch_summary = summary_frame(records)
+                    st.session_state.batch_elapsed = elapsed
+                    st.session_state.batch_file = bulk_file.name
+                    status_text.empty()
+            
+            if st.session_state.get('batch_file') == bulk_file.name:
+                batch_summary = st.session_state.batch_summary
+                batch_elapsed = st.session_state.batch_elapsed
+                st.success(f"✓ Batch processing completed! {len(batch_summary)} bills in {batch_elapsed:.2f}s "
+                           f"({len(batch_summary) / max(batch_elapsed, 1e-9):,.0f} bills/sec)")
+                
+                col1, col2, col3 = st.columns(3)
+                with col1:
+                    st.metric("Total Billed", f"₹{batch_summary['Billed (₹)'].sum():,.0f}")
+                with col2:
+                    st.metric("Potential Savings", f"₹{batch_summary['Savings (₹)'].sum():,.0f}")
+                with col3:
+                    st.metric("Bills With Issues", int((batch_summary['Issues'] > 0).sum()))
+                if batch_summary['Excluded (₹)'].sum() > 0:
+                    st.warning(f"🚫 ₹{batch_summary['Excluded (₹)'].sum():,.0f} billed for services excluded by insurer policy")
+                
+                st.dataframe(batch_summary, use_container_width=True, height=300)
+                st.download_button("📥 Export Results", batch_summary.to_csv(index=False),
+                                   file_name="mediaudit_batch_results.csv", mime="text/csv",
+                                   use_container_width=True)
     
     with tabs[2]:
         st.markdown("### 🔧 Enterprise Settings")
@@ -1545,10 +1489,13 @@ elif user_type == "🏢 B2B Enterprise":
             st.markdown("#### API Configuration")
             api_key = st.text_input("API Key", type="password", value="sk_live_xxxxx")
             webhook_url = st.text_input("Webhook URL", placeholder="https://your-domain.com/webhook")
+            st.caption("REST API (`python api.py`): POST /audits, GET /audits/{id}. "
+                       "Keys are read from the MEDIAUDIT_API_KEYS environment variable.")
             
             st.markdown("#### Compliance Rules")
             max_variance = st.slider("Max Price Variance (%)", 0, 50, 15)
-            auto_flag = st.checkbox("Auto-flag excluded items", value=True)
+            auto_flag = st.checkbox("Auto-flag excluded items", value=True, key="auto_flag_exclusions",
+                                    help="Mark bill lines the insurer's policy excludes (insurer_exclusions.csv)")
         
         with col2:
             st.markdown("#### Notifications")
@@ -1560,6 +1507,25 @@ elif user_type == "🏢 B2B Enterprise":
         
         if st.button("💾 Save Settings", use_container_width=True):
             st.success("✓ Settings saved!")
+        
+        with st.expander("📈 Rate Matching Stats"):
+            rates_store = reference_store()
+            st.write(f"**Reference Version:** {rates_store.version} "
+                     f"(loaded {datetime.fromtimestamp(rates_store.snapshot.loaded_at).strftime('%Y-%m-%d %H:%M:%S')})")
+            if rates_store.last_error:
+                st.warning(f"Last rate file reload failed, still using version {rates_store.version}: {rates_store.last_error}")
+            # Summed over every tier and hospital tariff the portal and batches audited against
+            match_stats = rates_store.match_stats()
+            st.write(f"**Lookups:** {match_stats['total']}")
+            st.dataframe(pd.DataFrame({
+                'Tier': list(match_stats['counts']),
+                'Lookups': list(match_stats['counts'].values()),
+                'Hit Ratio': [f"{r:.1%}" for r in match_stats['ratios'].values()]
+            }), use_container_width=True)
+            cache_stats = match_stats['cache']
+            st.write(f"**Match Cache:** {cache_stats['size']:,}/{cache_stats['maxsize']:,} entries | "
+                     f"Hits {cache_stats['hits']:,} | Misses {cache_stats['misses']:,} | "
+                     f"Evictions {cache_stats['evictions']:,} | Hit Ratio {cache_stats['hit_ratio']:.1%}")
 
 elif user_type == "ℹ️ About & Pricing":
     st.markdown("""
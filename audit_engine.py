@@ -0,0 +1,446 @@
+"""Headless bill audit engine.
+
+Everything here is free of Streamlit so the same audit can run from the UI,
+batch workers and benchmarks.
+"""
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+
+import numpy as np
+import pandas as pd
+
+from duplicates import duplicate_mask, possible_duplicate_mask
+from exclusions import ExclusionIndex
+from service_matcher import MatchCache, ServiceMatcher, normalize_text
+from unbundling import PackageRules
+
+REFERENCE_CSV = "cghs_rates.csv"
+ALIAS_CSV = "service_aliases.csv"
+PACKAGE_CSV = "package_components.csv"
+EXCLUSION_CSV = "insurer_exclusions.csv"
+
+# Billed amounts up to 15% above the CGHS rate are accepted
+TOLERANCE = 0.15
+MATCH_CUTOFF = 0.65
+MATCH_CACHE_SIZE = 10000
+# Stricter than MATCH_CUTOFF: package and exclusion rules act on a whole line
+RULE_MATCH_CUTOFF = 0.8
+
+OVERCHARGE_TYPES = ["Inflated Consumables", "Duplicate Billing", "Upcoding", "Unbundling"]
+CONSUMABLE_WORDS = ['syringe', 'glove', 'mask', 'cotton', 'bandage', 'gauze']
+# Charged once per day, so the same amount on different days is not a duplicate
+RECURRING_WORDS = ['room', 'bed', 'ward', 'icu', 'nursing', 'day']
+# The same item and amount billed this many days apart still counts as a duplicate
+DUPLICATE_WINDOW_DAYS = 1
+
+RESULT_COLUMNS = ["Service", "Billed (₹)", "Standard (₹)", "Status", "Type", "Comments"]
+
+# Line mask counted under each overcharge type
+TYPE_MASKS = {
+    "Inflated Consumables": "_consumable",
+    "Duplicate Billing": "_duplicate",
+    "Upcoding": "_upcoding",
+    "Unbundling": "_unbundled"
+}
+
+MATCH_TIERS = ["exact", "alias", "fuzzy", "miss"]
+
+
+def load_reference_csv(path=REFERENCE_CSV):
+    try:
+        cghs = pd.read_csv(path)
+    except Exception:
+        cghs = pd.DataFrame({
+            "Service": ["Room Rent", "Doctor Fees", "Lab Test", "Surgery", "ICU Charges", "CT Scan", "MRI", "X-Ray"],
+            "Rate (₹)": [4000, 2500, 1500, 50000, 8000, 3000, 5000, 800]
+        })
+    return cghs
+
+
+def load_alias_csv(path=ALIAS_CSV):
+    """User-maintained bill wording -> CGHS service name table"""
+    try:
+        aliases = pd.read_csv(path)
+    except Exception:
+        aliases = pd.DataFrame(columns=["Alias", "Service"])
+    return aliases
+
+
+def load_package_csv(path=PACKAGE_CSV):
+    """CGHS package procedure -> included component table"""
+    try:
+        packages = pd.read_csv(path)
+    except Exception:
+        packages = pd.DataFrame(columns=["Package", "Component"])
+    return packages
+
+
+def load_exclusion_csv(path=EXCLUSION_CSV):
+    """Services excluded by insurer policy, optionally per Insurer"""
+    try:
+        exclusions = pd.read_csv(path, skip_blank_lines=True)
+    except Exception:
+        exclusions = pd.DataFrame(columns=["Services", "Excluded_Service"])
+    return exclusions
+
+
+class RateReference:
+    """CGHS rate table plus the lookup structures built from it once"""
+
+    def __init__(self, table, aliases=None, packages=None, exclusions=None, cache_size=MATCH_CACHE_SIZE,
+                 matcher=None):
+        self.table = table
+        self.service_norm = table["Service"].astype(str).str.strip().str.lower().to_numpy()
+        self.services = list(pd.unique(self.service_norm))
+        # A prebuilt matcher over a larger catalogue (see rate_artifact) is shared, not rebuilt
+        self.matcher = matcher.restricted_to(self.services) if matcher is not None else ServiceMatcher(self.services)
+
+        # First row wins when a service is listed more than once
+        self.rates = {}
+        for service, rate in zip(self.service_norm.tolist(), table["Rate (₹)"].to_numpy(dtype=float).tolist()):
+            self.rates.setdefault(service, rate)
+
+        self.exact = set(self.services)
+        self.aliases = {}
+        if aliases is not None:
+            for alias, service in zip(aliases["Alias"], aliases["Service"]):
+                alias, service = normalize_text(alias), normalize_text(service)
+                # Aliases pointing at services missing from this table are ignored
+                if alias and service in self.exact:
+                    self.aliases[alias] = service
+        self.packages = PackageRules(packages, cutoff=RULE_MATCH_CUTOFF, cache_size=cache_size)
+        self.exclusions = ExclusionIndex(exclusions, cutoff=RULE_MATCH_CUTOFF, cache_size=cache_size)
+
+        # (digest, hospital, tier, as_of) when built by a ReferenceStore, so a worker process can rebuild it
+        self.key = None
+        self._stats = Counter()
+        self._stats_lock = threading.Lock()
+        # Lives and dies with this table version, so a rate change starts cold
+        self.match_cache = MatchCache(cache_size)
+
+    def match(self, item, cutoff=MATCH_CUTOFF):
+        """Exact name, then alias table, then fuzzy matcher"""
+        if item in self.exact:
+            tier, result = "exact", (item, 1.0)
+        elif item in self.aliases:
+            tier, result = "alias", (self.aliases[item], 1.0)
+        else:
+            key = (item, cutoff)
+            result = self.match_cache.get(key)
+            if result is None:
+                result = self.matcher.match(item, cutoff=cutoff)
+                self.match_cache.put(key, result)
+            tier = "fuzzy" if result[0] else "miss"
+        with self._stats_lock:
+            self._stats[tier] += 1
+        return result
+
+    def match_stats(self):
+        """Lookup counts and hit ratio per tier since the reference was built"""
+        with self._stats_lock:
+            counts = {tier: self._stats[tier] for tier in MATCH_TIERS}
+        total = sum(counts.values())
+        return {
+            'total': total,
+            'counts': counts,
+            'ratios': {tier: (n / total if total else 0.0) for tier, n in counts.items()},
+            'cache': self.match_cache.stats()
+        }
+
+
+class StageTimer:
+    """Wall-clock time of named audit stages (extract, match, score, render).
+
+    `on_stage(name, seconds)` is called as each stage finishes, which is what
+    drives the UI progress bar.
+    """
+
+    def __init__(self, on_stage=None):
+        self.on_stage = on_stage
+        self.timings = {}
+
+    def record(self, name, seconds):
+        self.timings[name] = self.timings.get(name, 0.0) + seconds
+        if self.on_stage:
+            self.on_stage(name, seconds)
+
+    @contextmanager
+    def stage(self, name):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - started)
+
+
+@dataclass
+class AuditResult:
+    """Outcome of auditing one bill against the reference rates"""
+    results_df: pd.DataFrame
+    total_billed: float = 0.0
+    total_standard: float = 0.0
+    potential_savings: float = 0.0
+    audit_score: int = 100
+    flagged_count: int = 0
+    alerts: list = field(default_factory=list)
+    overcharge_types: dict = field(default_factory=dict)
+    excluded_count: int = 0
+    excluded_amount: float = 0.0
+    timings: dict = field(default_factory=dict)
+
+    def to_dict(self):
+        return {
+            'results_df': self.results_df,
+            'total_billed': self.total_billed,
+            'total_standard': self.total_standard,
+            'potential_savings': self.potential_savings,
+            'audit_score': self.audit_score,
+            'flagged_count': self.flagged_count,
+            'alerts': self.alerts,
+            'overcharge_types': self.overcharge_types,
+            'excluded_count': self.excluded_count,
+            'excluded_amount': self.excluded_amount,
+            'timings': self.timings
+        }
+
+
+def _as_items_frame(items):
+    if isinstance(items, pd.DataFrame):
+        return items
+    return pd.DataFrame(list(items), columns=["Item", "Amount (₹)"])
+
+
+def _column(items, name, default):
+    if name in items.columns:
+        return items[name]
+    return pd.Series(default, index=items.index, dtype=object)
+
+
+def clean_amounts(values):
+    """Strip ₹ and thousands separators; blank or unparseable amounts become 0"""
+    cleaned = (values.astype(str)
+               .str.replace(",", "", regex=False)
+               .str.replace("₹", "", regex=False)
+               .str.strip())
+    return pd.to_numeric(cleaned, errors="coerce").fillna(0.0).astype(float)
+
+
+LINE_COLUMNS = RESULT_COLUMNS + ["_rate", "_matched", "_over", "_duplicate", "_unbundled", "_flagged",
+                                 "_excluded", "_consumable", "_upcoding", "_savings", "_standard_total"]
+
+
+def _match_items(items, reference):
+    raw_items = _column(items, "Item", "")
+    item_norm = raw_items.where(raw_items.notna(), "").astype(str).str.strip().str.lower()
+    keep = (item_norm != "").to_numpy()
+    raw_items = raw_items[keep]
+    item_norm = item_norm[keep]
+
+    matches = {item: reference.match(item)[0] for item in pd.unique(item_norm)}
+    return keep, raw_items, item_norm, item_norm.map(matches)
+
+
+def score_lines(items, reference, group_codes=None, flag_exclusions=False, insurer=None):
+    """Columnar audit of line items, without any per-bill totals.
+
+    Returns one row per non-blank item (keeping the input's index) with the
+    result columns plus the underscore-prefixed masks and amounts that
+    `summarize_lines` turns into an `AuditResult`. Each distinct item is
+    matched once, rates are joined through the reference's rate map and
+    status, savings and overcharge type come from NumPy masks, so several
+    bills can be scored in a single pass and summarized per bill afterwards.
+    Pass the bill number of every row as `group_codes` when scoring several
+    bills, so repeated charges are only looked for within each bill. With
+    `flag_exclusions`, lines the insurer's policy excludes are marked too;
+    the insurer comes from an "Insurer" column if there is one, else
+    `insurer`.
+    """
+    if not isinstance(reference, RateReference):
+        reference = RateReference(reference)
+    return _score_matched(items, reference, *_match_items(items, reference), group_codes=group_codes,
+                          flag_exclusions=flag_exclusions, insurer=insurer)
+
+
+def _score_matched(items, reference, keep, raw_items, item_norm, matched_service, group_codes=None,
+                   flag_exclusions=False, insurer=None):
+    amount = clean_amounts(_column(items, "Amount (₹)", 0)[keep]).to_numpy()
+    rate = matched_service.map(reference.rates).to_numpy(dtype=float)
+    matched = matched_service.notna().to_numpy()
+
+    dates = items["Date"][keep].to_numpy() if "Date" in items.columns else None
+    groups = None if group_codes is None else np.asarray(group_codes)[keep]
+    recurring = item_norm.str.contains("|".join(RECURRING_WORDS), regex=True).to_numpy()
+    duplicate = duplicate_mask(item_norm.to_numpy(), amount, dates=dates, groups=groups, recurring=recurring,
+                               window_days=DUPLICATE_WINDOW_DAYS)
+    packages = reference.packages
+    rule_names = packages.resolver.resolve_lines(item_norm, matched_service) if len(packages) else [None] * len(amount)
+    covering = packages.unbundled(rule_names, groups)
+    unbundled = ~duplicate & np.array([package is not None for package in covering], dtype=bool)
+
+    over = matched & ~duplicate & ~unbundled & (amount > rate * (1 + TOLERANCE))
+    consumable = over & item_norm.str.contains("|".join(CONSUMABLE_WORDS), regex=True).to_numpy()
+    upcoding = over & ~consumable & (amount > rate * 2)
+    # Repeated charges and components of a billed package should not be charged at all
+    charged_again = duplicate | unbundled
+    savings = np.where(charged_again, amount, np.where(over, amount - rate, 0.0))
+    # Undated repeats are reported for the patient to check, but no saving is claimed
+    possible = ~charged_again & ~over & possible_duplicate_mask(item_norm.to_numpy(), amount, dates=dates,
+                                                                groups=groups, recurring=recurring)
+
+    status = np.where(duplicate, "Duplicate", np.where(unbundled, "Unbundled", np.where(over, "Overcharged",
+                      np.where(possible, "Possible Duplicate", np.where(matched, "Normal", "Unlisted")))))
+    status = status.astype(object)
+    overcharge_type = np.full(len(amount), "", dtype=object)
+    overcharge_type[over] = "Overcharge Detected"
+    overcharge_type[upcoding] = "Upcoding"
+    overcharge_type[consumable] = "Inflated Consumables"
+    overcharge_type[duplicate] = "Duplicate Billing"
+    overcharge_type[possible] = "Possible Duplicate"
+    overcharge_type[unbundled] = "Unbundling"
+    comment = np.where(matched, "", "Not in CGHS rates").astype(object)
+    for i in np.flatnonzero(over):
+        comment[i] = f"₹{amount[i]:,.0f} vs ₹{rate[i]:,.0f} (Save ₹{savings[i]:,.0f})"
+    for i in np.flatnonzero(duplicate):
+        comment[i] = f"Repeats an earlier charge (Save ₹{savings[i]:,.0f})"
+    for i in np.flatnonzero(unbundled):
+        comment[i] = f"Included in {covering[i]} (Save ₹{savings[i]:,.0f})"
+    comment[possible] = "Same item and amount as an earlier line; add service dates to confirm"
+
+    excluded = np.zeros(len(amount), dtype=bool)
+    exclusions = reference.exclusions
+    if flag_exclusions and len(exclusions):
+        insurers = items["Insurer"][keep].to_numpy() if "Insurer" in items.columns else [insurer] * len(amount)
+        excluded = exclusions.excluded(exclusions.resolver.resolve_lines(item_norm, matched_service), insurers)
+        # Overcharge findings keep their status; the exclusion is noted alongside
+        status[excluded & np.isin(status, ["Normal", "Unlisted"])] = "Excluded"
+        for i in np.flatnonzero(excluded):
+            comment[i] = f"{comment[i]} · Not covered by insurer" if comment[i] else "Not covered by insurer"
+
+    return pd.DataFrame({
+        "Service": raw_items.to_numpy(),
+        "Billed (₹)": amount,
+        "Standard (₹)": np.where(charged_again, 0.0, np.where(matched, rate, amount)),
+        "Status": status,
+        "Type": overcharge_type,
+        "Comments": comment,
+        "_rate": rate,
+        "_matched": matched,
+        "_over": over,
+        # Possible duplicates count under Duplicate Billing too
+        "_duplicate": duplicate | possible,
+        "_unbundled": unbundled,
+        "_flagged": over | charged_again | possible,
+        "_excluded": excluded,
+        "_consumable": consumable,
+        "_upcoding": upcoding,
+        "_savings": savings,
+        # Matched lines count their CGHS rate, and lines within tolerance or
+        # unlisted also count the billed amount, as the per-line loop always did
+        "_standard_total": np.where(charged_again, 0.0, np.where(matched, rate, 0.0) + np.where(over, 0.0, amount))
+    }, index=raw_items.index, columns=LINE_COLUMNS)
+
+
+def _audit_result(results_df, services, types, flagged, savings, billed, standard_total, type_counts,
+                  excluded, line_billed):
+    alerts = [
+        f"⚠️ {service}: {overcharge_type} - Save ₹{saved:,.0f}" if saved else f"⚠️ {service}: {overcharge_type}"
+        for service, overcharge_type, saved in zip(services[flagged], types[flagged], savings[flagged])
+    ]
+    alerts += [
+        f"🚫 {service}: Not covered by insurer - ₹{amount:,.0f}"
+        for service, amount in zip(services[excluded], line_billed[excluded])
+    ]
+
+    overcharge_types = {name: int(type_counts.get(name, 0)) for name in OVERCHARGE_TYPES}
+    flagged_count = int(flagged.sum())
+
+    return AuditResult(
+        results_df=results_df,
+        total_billed=float(billed),
+        total_standard=float(standard_total),
+        potential_savings=float(savings.sum()),
+        audit_score=max(0, 100 - flagged_count * 10),
+        flagged_count=flagged_count,
+        alerts=alerts,
+        overcharge_types=overcharge_types,
+        excluded_count=int(excluded.sum()),
+        excluded_amount=float(line_billed[excluded].sum())
+    )
+
+
+def summarize_lines(lines):
+    """Build one bill's `AuditResult` from its rows of `score_lines` output"""
+    return _audit_result(
+        lines[RESULT_COLUMNS].reset_index(drop=True),
+        lines["Service"].to_numpy(),
+        lines["Type"].to_numpy(),
+        lines["_flagged"].to_numpy(),
+        lines["_savings"].to_numpy(),
+        lines["Billed (₹)"].sum(),
+        lines["_standard_total"].sum(),
+        {name: lines[mask].sum() for name, mask in TYPE_MASKS.items()},
+        lines["_excluded"].to_numpy(),
+        lines["Billed (₹)"].to_numpy()
+    )
+
+
+def summarize_groups(lines, group_codes):
+    """Yield (code, AuditResult) for each bill in `score_lines` output.
+
+    `group_codes` gives the bill number of every row. Rows are sorted by bill
+    once and per-bill totals come from `np.add.reduceat`, so a large batch
+    pays one slice per bill rather than a column lookup per bill and total.
+    """
+    group_codes = np.asarray(group_codes)
+    if not len(group_codes):
+        return
+    order = np.argsort(group_codes, kind="stable")
+    codes = group_codes[order]
+    starts = np.r_[0, np.flatnonzero(np.diff(codes)) + 1]
+    ends = np.r_[starts[1:], len(codes)]
+
+    results = lines[RESULT_COLUMNS].iloc[order].reset_index(drop=True)
+    services = lines["Service"].to_numpy()[order]
+    types = lines["Type"].to_numpy()[order]
+    flagged = lines["_flagged"].to_numpy()[order]
+    excluded = lines["_excluded"].to_numpy()[order]
+    line_billed = lines["Billed (₹)"].to_numpy()[order]
+    savings = lines["_savings"].to_numpy()[order]
+    billed = np.add.reduceat(lines["Billed (₹)"].to_numpy()[order], starts)
+    standard_total = np.add.reduceat(lines["_standard_total"].to_numpy()[order], starts)
+    type_counts = {name: np.add.reduceat(lines[mask].to_numpy(dtype=int)[order], starts)
+                   for name, mask in TYPE_MASKS.items()}
+
+    for i, (start, end) in enumerate(zip(starts, ends)):
+        yield codes[start], _audit_result(
+            results.iloc[start:end].reset_index(drop=True),
+            services[start:end], types[start:end], flagged[start:end], savings[start:end],
+            billed[i], standard_total[i], {name: counts[i] for name, counts in type_counts.items()},
+            excluded[start:end], line_billed[start:end]
+        )
+
+
+def audit_bill(items, reference, timer=None, flag_exclusions=False, insurer=None):
+    """Audit bill line items against a CGHS rate table.
+
+    `items` is a DataFrame with "Item" and "Amount (₹)" columns (or an iterable
+    of (item, amount) pairs); `reference` is a `RateReference` or a raw rate
+    table as returned by `load_reference_csv`. Pass a `StageTimer` to get
+    "match" and "score" timings reported while the audit runs, and
+    `flag_exclusions` to mark lines `insurer`'s policy does not cover.
+    """
+    items = _as_items_frame(items)
+    if not isinstance(reference, RateReference):
+        reference = RateReference(reference)
+    timer = timer or StageTimer()
+
+    with timer.stage("match"):
+        matched = _match_items(items, reference)
+    with timer.stage("score"):
+        result = summarize_lines(_score_matched(items, reference, *matched,
+                                                flag_exclusions=flag_exclusions, insurer=insurer))
+    result.timings = dict(timer.timings)
+    return result
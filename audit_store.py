@@ -0,0 +1,449 @@
+"""Durable storage for audits, the bill queue, payments and negotiations.
+
+The patient portal used to keep every audit (with its full results frame)
+in Streamlit session lists, which vanished on refresh and grew without bound
+in server memory. `AuditStore` keeps them in SQLite instead: summaries in
+`audits`, lines in `line_items`, and `payments` and `negotiations` pointing
+at an audit. In memory an audit is a compact, immutable `AuditRecord`.
+The queue is the `queued` flag on `audits`, keyed by audit id; its size and
+total are kept as running sums in `queue_totals`. Everything is scoped by an `owner` id (the browser session),
+read back per render, and written one transaction per user action with the
+line items inserted in a single `executemany`.
+
+Audits are not kept forever: once older than `RETENTION_DAYS`, an audit
+that is not queued, paid for or under negotiation is deleted with its line
+items. `save_audit` prunes at most once per `PRUNE_INTERVAL_SECONDS`.
+"""
+import json
+import os
+import sqlite3
+import threading
+import time
+from datetime import datetime, timedelta
+from types import MappingProxyType
+
+import numpy as np
+import pandas as pd
+
+from audit_engine import RESULT_COLUMNS
+
+DB_PATH = os.environ.get("MEDIAUDIT_DB", "mediaudit.db")
+# Days an audit nobody queued, paid for or negotiated is kept; 0 keeps them forever
+RETENTION_DAYS = int(os.environ.get("MEDIAUDIT_RETENTION_DAYS", 90))
+PRUNE_INTERVAL_SECONDS = 3600
+# Audit dates are written in this format, so comparing the text compares the times
+DATE_FORMAT = "%Y-%m-%d %H:%M"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS audits (
+    id INTEGER PRIMARY KEY,
+    owner TEXT NOT NULL,
+    patient_name TEXT,
+    hospital TEXT,
+    contact TEXT,
+    email TEXT,
+    date TEXT,
+    total_billed REAL,
+    total_standard REAL,
+    potential_savings REAL,
+    audit_score INTEGER,
+    flagged_count INTEGER,
+    excluded_count INTEGER,
+    excluded_amount REAL,
+    alerts TEXT,
+    overcharge_types TEXT,
+    is_demo INTEGER NOT NULL DEFAULT 0,
+    queued INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS audits_owner_queued ON audits (owner, queued);
+CREATE INDEX IF NOT EXISTS audits_date ON audits (date);
+
+CREATE TABLE IF NOT EXISTS line_items (
+    audit_id INTEGER NOT NULL REFERENCES audits (id) ON DELETE CASCADE,
+    line_no INTEGER NOT NULL,
+    service TEXT,
+    billed REAL,
+    standard REAL,
+    status TEXT,
+    type TEXT,
+    comments TEXT,
+    PRIMARY KEY (audit_id, line_no)
+);
+
+CREATE TABLE IF NOT EXISTS payments (
+    id INTEGER PRIMARY KEY,
+    owner TEXT NOT NULL,
+    audit_id INTEGER NOT NULL REFERENCES audits (id),
+    payment_date TEXT,
+    payment_method TEXT,
+    payment_status TEXT,
+    emi_tenure TEXT,
+    monthly_emi REAL
+);
+CREATE INDEX IF NOT EXISTS payments_owner ON payments (owner);
+CREATE INDEX IF NOT EXISTS payments_audit ON payments (audit_id);
+
+CREATE TABLE IF NOT EXISTS negotiations (
+    id INTEGER PRIMARY KEY,
+    owner TEXT NOT NULL,
+    audit_id INTEGER REFERENCES audits (id),
+    reference TEXT,
+    patient_name TEXT,
+    hospital TEXT,
+    contact TEXT,
+    email TEXT,
+    potential_savings REAL,
+    commission REAL,
+    status TEXT,
+    date TEXT,
+    actual_savings REAL
+);
+CREATE INDEX IF NOT EXISTS negotiations_owner ON negotiations (owner);
+CREATE INDEX IF NOT EXISTS negotiations_audit ON negotiations (audit_id);
+
+-- Running queue size and total per owner, kept in step with audits.queued by
+-- the triggers below so reading them never scans the queue. Amounts are in
+-- paise so repeated adds and removals cannot drift.
+CREATE TABLE IF NOT EXISTS queue_totals (
+    owner TEXT PRIMARY KEY,
+    bills INTEGER NOT NULL DEFAULT 0,
+    total_paise INTEGER NOT NULL DEFAULT 0
+);
+-- Databases created before the totals existed start from their current queue
+INSERT OR IGNORE INTO queue_totals (owner, bills, total_paise)
+    SELECT owner, COUNT(*), SUM(CAST(ROUND(COALESCE(total_billed, 0) * 100) AS INTEGER))
+    FROM audits WHERE queued = 1 GROUP BY owner;
+
+CREATE TRIGGER IF NOT EXISTS audits_queued_insert AFTER INSERT ON audits WHEN new.queued = 1
+BEGIN
+    INSERT INTO queue_totals (owner, bills, total_paise)
+        VALUES (new.owner, 1, CAST(ROUND(COALESCE(new.total_billed, 0) * 100) AS INTEGER))
+        ON CONFLICT (owner) DO UPDATE SET bills = bills + excluded.bills,
+                                          total_paise = total_paise + excluded.total_paise;
+END;
+CREATE TRIGGER IF NOT EXISTS audits_queued_update AFTER UPDATE OF queued ON audits
+    WHEN old.queued != new.queued
+BEGIN
+    INSERT INTO queue_totals (owner, bills, total_paise)
+        VALUES (new.owner, CASE WHEN new.queued THEN 1 ELSE -1 END,
+                CASE WHEN new.queued THEN 1 ELSE -1 END * CAST(ROUND(COALESCE(new.total_billed, 0) * 100) AS INTEGER))
+        ON CONFLICT (owner) DO UPDATE SET bills = bills + excluded.bills,
+                                          total_paise = total_paise + excluded.total_paise;
+END;
+CREATE TRIGGER IF NOT EXISTS audits_queued_delete AFTER DELETE ON audits WHEN old.queued = 1
+BEGIN
+    UPDATE queue_totals SET bills = bills - 1,
+                            total_paise = total_paise - CAST(ROUND(COALESCE(old.total_billed, 0) * 100) AS INTEGER)
+        WHERE owner = old.owner;
+END;
+"""
+
+# Summary columns read back for queue and history lists; never the line items
+AUDIT_FIELDS = ["id", "patient_name", "hospital", "contact", "email", "date", "total_billed", "total_standard",
+                "potential_savings", "audit_score", "flagged_count", "excluded_count", "excluded_amount",
+                "alerts", "overcharge_types", "is_demo"]
+LINE_FIELDS = ["service", "billed", "standard", "status", "type", "comments"]
+
+
+def _float(value):
+    return None if value is None or pd.isna(value) else float(value)
+
+
+def _int(value):
+    return None if value is None or pd.isna(value) else int(value)
+
+
+def _text(value):
+    return None if value is None or (not isinstance(value, str) and pd.isna(value)) else str(value)
+
+
+def _frozen(values, dtype=float):
+    array = np.array(values, dtype=dtype)
+    array.flags.writeable = False
+    return array
+
+
+def _pack_lines(results_df):
+    """Result lines as read-only column arrays; Status and Type as categorical codes"""
+    results = results_df.reindex(columns=RESULT_COLUMNS)
+    service, billed, standard, status, kind, comments = (results[c] for c in RESULT_COLUMNS)
+    return (
+        tuple(_text(v) for v in service),
+        _frozen(pd.to_numeric(billed, errors="coerce")),
+        _frozen(pd.to_numeric(standard, errors="coerce")),
+        pd.Categorical(status.map(_text)),
+        pd.Categorical(kind.map(_text)),
+        tuple(_text(v) for v in comments)
+    )
+
+
+def _pack_rows(rows):
+    """Same layout as `_pack_lines`, straight from LINE_FIELDS rows read from the store"""
+    service, billed, standard, status, kind, comments = zip(*rows) if rows else ((),) * len(LINE_FIELDS)
+    return (
+        tuple(service),
+        # None (SQL NULL) becomes NaN
+        _frozen(billed),
+        _frozen(standard),
+        pd.Categorical(status),
+        pd.Categorical(kind),
+        tuple(comments)
+    )
+
+
+class AuditRecord:
+    """One audit, immutable and stored once.
+
+    Summary fields are plain attributes; the result lines are column arrays
+    (float amounts, categorical Status/Type) that only become a DataFrame in
+    `results_df()`. Everything else (queue, payments, negotiations, the
+    session) refers to a record by its store id. Records listed from the
+    store are loaded without lines. Lines come either from an engine
+    `results_df` or, when read back, as LINE_FIELDS rows in `lines`.
+    """
+
+    __slots__ = tuple(AUDIT_FIELDS) + ("_lines",)
+
+    def __init__(self, results_df=None, lines=None, **fields):
+        for name in AUDIT_FIELDS:
+            object.__setattr__(self, name, fields.get(name))
+        object.__setattr__(self, "alerts", tuple(self.alerts or ()))
+        object.__setattr__(self, "overcharge_types", MappingProxyType(
+            {k: int(v) for k, v in (self.overcharge_types or {}).items()}))
+        object.__setattr__(self, "is_demo", bool(self.is_demo))
+        if results_df is not None:
+            packed = _pack_lines(results_df)
+        else:
+            packed = _pack_rows(lines) if lines is not None else None
+        object.__setattr__(self, "_lines", packed)
+
+    def __setattr__(self, name, value):
+        raise AttributeError(f"AuditRecord is immutable; cannot set {name!r}")
+
+    def __repr__(self):
+        return f"AuditRecord(id={self.id!r}, patient_name={self.patient_name!r}, total_billed={self.total_billed!r})"
+
+    @classmethod
+    def from_result(cls, result, **details):
+        """Record for an `AuditResult` plus patient details (patient_name, hospital, ...)"""
+        return cls(result.results_df, total_billed=result.total_billed, total_standard=result.total_standard,
+                   potential_savings=result.potential_savings, audit_score=result.audit_score,
+                   flagged_count=result.flagged_count, excluded_count=result.excluded_count,
+                   excluded_amount=result.excluded_amount, alerts=result.alerts,
+                   overcharge_types=result.overcharge_types, **details)
+
+    def line_rows(self):
+        """(Service, Billed, Standard, Status, Type, Comments) tuples with plain Python values"""
+        if self._lines is None:
+            return []
+        service, billed, standard, status, kind, comments = self._lines
+        return list(zip(service, (_float(v) for v in billed), (_float(v) for v in standard),
+                        (_text(v) for v in status), (_text(v) for v in kind), comments))
+
+    def results_df(self):
+        """Materialize the lines as a DataFrame in RESULT_COLUMNS layout"""
+        if self._lines is None:
+            raise ValueError("record was loaded without its lines")
+        service, billed, standard, status, kind, comments = self._lines
+        return pd.DataFrame({
+            "Service": list(service),
+            "Billed (₹)": billed,
+            "Standard (₹)": standard,
+            "Status": np.asarray(status, dtype=object),
+            "Type": np.asarray(kind, dtype=object),
+            "Comments": list(comments)
+        })
+
+
+def _audit_row(row, lines=None):
+    fields = dict(row)
+    fields['alerts'] = json.loads(fields['alerts'] or "[]")
+    fields['overcharge_types'] = json.loads(fields['overcharge_types'] or "{}")
+    return AuditRecord(lines=lines, **fields)
+
+
+class AuditStore:
+    """SQLite-backed audit history; safe to share across Streamlit sessions.
+
+    Each thread gets its own connection. WAL mode lets renders read while
+    another session is writing.
+    """
+
+    def __init__(self, path=DB_PATH, retention_days=RETENTION_DAYS):
+        self.path = path
+        self.retention_days = retention_days
+        self._local = threading.local()
+        with self._connect() as conn:
+            conn.executescript(SCHEMA)
+        self._pruned_at = time.monotonic()
+        self.prune()
+
+    def _connect(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("PRAGMA foreign_keys=ON")
+            self._local.conn = conn
+        return conn
+
+    def save_audit(self, owner, record, queued=False):
+        """Store an AuditRecord and its lines; returns the id it is referred to by"""
+        conn = self._connect()
+        with conn:
+            cursor = conn.execute(
+                "INSERT INTO audits (owner, patient_name, hospital, contact, email, date, total_billed, total_standard,"
+                " potential_savings, audit_score, flagged_count, excluded_count, excluded_amount, alerts,"
+                " overcharge_types, is_demo, queued) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (owner, _text(record.patient_name), _text(record.hospital), _text(record.contact),
+                 _text(record.email), _text(record.date), _float(record.total_billed),
+                 _float(record.total_standard), _float(record.potential_savings), _int(record.audit_score),
+                 _int(record.flagged_count), _int(record.excluded_count or 0), _float(record.excluded_amount or 0.0),
+                 json.dumps(list(record.alerts)), json.dumps(dict(record.overcharge_types)),
+                 int(record.is_demo), int(queued)))
+            audit_id = cursor.lastrowid
+            conn.executemany(
+                "INSERT INTO line_items (audit_id, line_no, service, billed, standard, status, type, comments)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                [(audit_id, i, *line) for i, line in enumerate(record.line_rows())])
+        if time.monotonic() - self._pruned_at >= PRUNE_INTERVAL_SECONDS:
+            self._pruned_at = time.monotonic()
+            self.prune()
+        return audit_id
+
+    def prune(self, now=None):
+        """Delete audits past the retention period that nothing refers to; returns how many"""
+        if not self.retention_days or self.retention_days <= 0:
+            return 0
+        cutoff = ((now or datetime.now()) - timedelta(days=self.retention_days)).strftime(DATE_FORMAT)
+        conn = self._connect()
+        with conn:
+            # Line items go with their audit (ON DELETE CASCADE)
+            cursor = conn.execute(
+                "DELETE FROM audits WHERE date < ? AND queued = 0"
+                " AND NOT EXISTS (SELECT 1 FROM payments p WHERE p.audit_id = audits.id)"
+                " AND NOT EXISTS (SELECT 1 FROM negotiations n WHERE n.audit_id = audits.id)", (cutoff,))
+        return cursor.rowcount
+
+    def audit(self, owner, audit_id, lines=False):
+        """AuditRecord by id, with its lines only when asked for"""
+        conn = self._connect()
+        row = conn.execute(f"SELECT {', '.join(AUDIT_FIELDS)} FROM audits WHERE owner = ? AND id = ?",
+                           (owner, audit_id)).fetchone()
+        if row is None:
+            return None
+        line_rows = None
+        if lines:
+            line_rows = conn.execute(
+                f"SELECT {', '.join(LINE_FIELDS)} FROM line_items WHERE audit_id = ? ORDER BY line_no",
+                (audit_id,)).fetchall()
+        return _audit_row(row, line_rows)
+
+    def results_df(self, owner, audit_id):
+        """Line results of one audit in the engine's RESULT_COLUMNS layout, built only when rendered"""
+        record = self.audit(owner, audit_id, lines=True)
+        return record.results_df() if record is not None else pd.DataFrame(columns=RESULT_COLUMNS)
+
+    # Bill queue
+
+    def queue(self, owner, audit_id):
+        conn = self._connect()
+        with conn:
+            conn.execute("UPDATE audits SET queued = 1 WHERE owner = ? AND id = ?", (owner, audit_id))
+
+    def unqueue(self, owner, audit_ids):
+        conn = self._connect()
+        with conn:
+            conn.executemany("UPDATE audits SET queued = 0 WHERE owner = ? AND id = ?",
+                             [(owner, audit_id) for audit_id in audit_ids])
+
+    def clear_queue(self, owner):
+        conn = self._connect()
+        with conn:
+            conn.execute("UPDATE audits SET queued = 0 WHERE owner = ? AND queued = 1", (owner,))
+
+    def queued(self, owner, limit=-1, offset=0):
+        """Queued audit summaries, oldest first, without their line items; one page with `limit`"""
+        rows = self._connect().execute(
+            f"SELECT {', '.join(AUDIT_FIELDS)} FROM audits WHERE owner = ? AND queued = 1 ORDER BY id"
+            " LIMIT ? OFFSET ?", (owner, limit, offset)).fetchall()
+        return [_audit_row(row) for row in rows]
+
+    def queued_ids(self, owner, include_demo=True):
+        demo = "" if include_demo else " AND is_demo = 0"
+        rows = self._connect().execute(f"SELECT id FROM audits WHERE owner = ? AND queued = 1{demo} ORDER BY id",
+                                       (owner,)).fetchall()
+        return [row[0] for row in rows]
+
+    def queue_totals(self, owner):
+        """(bills in queue, total billed) from the running totals; one primary-key lookup"""
+        row = self._connect().execute("SELECT bills, total_paise FROM queue_totals WHERE owner = ?",
+                                      (owner,)).fetchone()
+        return (row[0], row[1] / 100) if row is not None else (0, 0.0)
+
+    # Payments
+
+    def record_payments(self, owner, audit_ids, method, status="Completed", emi_tenure=None, monthly_emi=None):
+        """Record one payment per audit and take the audits off the queue, atomically"""
+        paid_at = datetime.now().strftime(DATE_FORMAT)
+        conn = self._connect()
+        with conn:
+            conn.executemany(
+                "INSERT INTO payments (owner, audit_id, payment_date, payment_method, payment_status, emi_tenure,"
+                " monthly_emi) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                [(owner, audit_id, paid_at, method, status, _text(emi_tenure), _float(monthly_emi))
+                 for audit_id in audit_ids])
+            conn.executemany("UPDATE audits SET queued = 0 WHERE owner = ? AND id = ?",
+                             [(owner, audit_id) for audit_id in audit_ids])
+
+    def payments(self, owner):
+        """Payment records joined with their audit summary, oldest first"""
+        rows = self._connect().execute(
+            "SELECT p.payment_date, p.payment_method, p.payment_status, p.emi_tenure, p.monthly_emi,"
+            " a.id AS audit_id, a.patient_name, a.hospital, a.total_billed, a.potential_savings"
+            " FROM payments p JOIN audits a ON a.id = p.audit_id WHERE p.owner = ? ORDER BY p.id",
+            (owner,)).fetchall()
+        return [dict(row) for row in rows]
+
+    def payment_count(self, owner):
+        return self._connect().execute("SELECT COUNT(*) FROM payments WHERE owner = ?", (owner,)).fetchone()[0]
+
+    # Negotiations
+
+    def add_negotiation(self, owner, request):
+        conn = self._connect()
+        with conn:
+            cursor = conn.execute(
+                "INSERT INTO negotiations (owner, audit_id, reference, patient_name, hospital, contact, email,"
+                " potential_savings, commission, status, date, actual_savings) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (owner, request.get('audit_id'), _text(request.get('id')), _text(request.get('patient_name')),
+                 _text(request.get('hospital')), _text(request.get('contact')), _text(request.get('email')),
+                 _float(request.get('potential_savings')), _float(request.get('commission')),
+                 _text(request.get('status', 'Pending')), _text(request.get('date')),
+                 _float(request.get('actual_savings'))))
+        return cursor.lastrowid
+
+    def negotiations(self, owner, limit=-1, offset=0):
+        """Negotiation requests, oldest first; 'id' is the NEG reference, 'request_id' the row"""
+        rows = self._connect().execute(
+            "SELECT id AS request_id, reference AS id, audit_id, patient_name, hospital, contact, email,"
+            " potential_savings, commission, status, date, actual_savings"
+            " FROM negotiations WHERE owner = ? ORDER BY request_id LIMIT ? OFFSET ?",
+            (owner, limit, offset)).fetchall()
+        requests = []
+        for row in rows:
+            request = dict(row)
+            if request['actual_savings'] is None:
+                del request['actual_savings']
+            requests.append(request)
+        return requests
+
+    def negotiation_count(self, owner):
+        return self._connect().execute("SELECT COUNT(*) FROM negotiations WHERE owner = ?", (owner,)).fetchone()[0]
+
+    def cancel_negotiation(self, owner, request_id):
+        conn = self._connect()
+        with conn:
+            conn.execute("DELETE FROM negotiations WHERE owner = ? AND id = ?", (owner, request_id))
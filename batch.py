@@ -0,0 +1,164 @@
+"""Bulk audit of multi-bill CSV/XLSX uploads for the B2B portal."""
+import time
+from functools import partial
+
+import pandas as pd
+
+from audit_engine import score_lines, summarize_groups
+from workers import DEFAULT_CHUNK_SIZE, imap_ordered, worker_reference
+
+REQUIRED_COLUMNS = ["Patient Name", "Hospital Name", "Item", "Amount (₹)"]
+TEMPLATE_COLUMNS = ["Bill ID", "Patient Name", "Hospital Name", "Bill Items", "Amounts"]
+
+SUMMARY_COLUMNS = ["Bill ID", "Patient", "Hospital", "Items", "Billed (₹)", "Standard (₹)",
+                   "Savings (₹)", "Issues", "Audit Score", "Excluded (₹)"]
+
+
+def canonical_column(name):
+    """Standard name for an uploaded column header"""
+    lc = str(name).strip().lower()
+    if lc in ("bill id", "bill no", "bill number", "bill_id", "invoice no", "invoice number"):
+        return "Bill ID"
+    if lc in ("date", "service date", "date of service", "item date", "line date"):
+        return "Date"
+    if lc in ("insurer", "insurance", "insurance company", "tpa", "payer"):
+        return "Insurer"
+    if "patient" in lc:
+        return "Patient Name"
+    if "hospital" in lc:
+        return "Hospital Name"
+    if "item" in lc or "service" in lc:
+        return "Item"
+    if "amount" in lc or "₹" in lc or "cost" in lc:
+        return "Amount (₹)"
+    return name
+
+
+def template_frame():
+    return pd.DataFrame([
+        ["B001", "Ravi Kumar", "Apollo Hospital", "Room Rent", 5000],
+        ["B001", "Ravi Kumar", "Apollo Hospital", "Doctor Fees", 3000],
+        ["B002", "Anita Sharma", "Fortis Hospital", "Lab Test", 1800],
+    ], columns=TEMPLATE_COLUMNS)
+
+
+def read_table(file, filename):
+    """CSV or XLSX upload with its columns renamed by `canonical_column`; the first of any repeats is kept"""
+    ext = filename.split(".")[-1].lower()
+    table = pd.read_csv(file) if ext == "csv" else pd.read_excel(file)
+    table = table.rename(columns={c: canonical_column(c) for c in table.columns})
+    return table.loc[:, ~table.columns.duplicated()]
+
+
+def read_bulk_file(file, filename):
+    """Load a multi-bill upload into one row per line item.
+
+    Bill-level columns (Bill ID, Patient Name, Hospital Name, Insurer) may be
+    filled only on a bill's first line; they are carried down to the lines
+    below.
+    """
+    bulk = read_table(file, filename)
+
+    missing = [c for c in REQUIRED_COLUMNS if c not in bulk.columns]
+    if missing:
+        raise ValueError(f"Missing required columns: {', '.join(missing)}")
+
+    bill_columns = [c for c in ("Bill ID", "Patient Name", "Hospital Name", "Insurer") if c in bulk.columns]
+    bulk[bill_columns] = bulk[bill_columns].ffill()
+    return bulk.dropna(how="all")
+
+
+def bill_keys(bulk):
+    """Bills are keyed by Bill ID, or else by patient + hospital"""
+    return ["Bill ID"] if "Bill ID" in bulk.columns else ["Patient Name", "Hospital Name"]
+
+
+def bill_numbers(bulk):
+    """Bill number of every row, counted in order of first appearance"""
+    return bulk.groupby(bill_keys(bulk), sort=False, dropna=False).ngroup().to_numpy()
+
+
+def iter_batch_audits(bulk, reference, flag_exclusions=False):
+    """Audit every bill in a bulk upload, yielding (done, total, record).
+
+    All line items are scored in one columnar pass; each bill then only
+    costs a slice of the scored lines.
+    """
+    keys = bill_keys(bulk)
+    bill_no = pd.Series(bill_numbers(bulk), index=bulk.index)
+    lines = score_lines(bulk, reference, bill_no.to_numpy(), flag_exclusions=flag_exclusions)
+    first_rows = bulk.loc[~bill_no.duplicated()].set_index(bill_no[~bill_no.duplicated()])
+    total = len(first_rows)
+    for number, audit in summarize_groups(lines, bill_no[lines.index].to_numpy()):
+        first = first_rows.loc[number]
+        record = {
+            'bill_id': " / ".join(str(first[k]) for k in keys),
+            'patient_name': first["Patient Name"],
+            'hospital': first["Hospital Name"],
+            'audit': audit
+        }
+        # Bills with no billable lines produce no record but still count as done
+        yield number + 1, total, record
+
+
+def audit_bulk_chunk(bulk_chunk, reference_key, flag_exclusions=False):
+    """Audit a slice of whole bills against the reference `reference_key` names; runs inside a worker process"""
+    reference = worker_reference(reference_key)
+    return [record for _, _, record in iter_batch_audits(bulk_chunk, reference, flag_exclusions)]
+
+
+def iter_batch_chunks(bulk, reference, workers=1, chunk_size=DEFAULT_CHUNK_SIZE, flag_exclusions=False):
+    """Audit a bulk upload, yielding (bills done, total bills, new records).
+
+    With more than one worker, whole bills are cut into chunks of
+    `chunk_size` and audited across the process pool. Each worker rebuilds
+    the same reference from its `key` (hospital, tier, date and file
+    version), so pooled and serial runs give the same results. A reference
+    not built by a `ReferenceStore` has no key and is always audited here.
+    Chunks are yielded in upload order as soon as they are ready, so the
+    output does not depend on which worker finishes first.
+    """
+    bill_no = bill_numbers(bulk)
+    total = int(bill_no.max()) + 1 if len(bill_no) else 0
+    reference_key = getattr(reference, "key", None)
+    if workers <= 1 or total <= chunk_size or reference_key is None:
+        for done, _, record in iter_batch_audits(bulk, reference, flag_exclusions):
+            yield done, total, [record]
+        return
+
+    chunks = [chunk for _, chunk in bulk.groupby(bill_no // chunk_size, sort=True)]
+    done = 0
+    audit_chunk = partial(audit_bulk_chunk, reference_key=reference_key, flag_exclusions=flag_exclusions)
+    for records in imap_ordered(audit_chunk, chunks, max_workers=workers):
+        done = min(done + chunk_size, total)
+        yield done, total, records
+
+
+def run_batch(bulk, reference, on_progress=None, workers=1, chunk_size=DEFAULT_CHUNK_SIZE, flag_exclusions=False):
+    """Audit a whole upload; returns (records, elapsed seconds)"""
+    started = time.perf_counter()
+    records = []
+    for done, total, chunk_records in iter_batch_chunks(bulk, reference, workers, chunk_size, flag_exclusions):
+        records.extend(chunk_records)
+        if on_progress:
+            on_progress(done, total, time.perf_counter() - started)
+    return records, time.perf_counter() - started
+
+
+def summary_frame(records):
+    rows = []
+    for record in records:
+        audit = record['audit']
+        rows.append([
+            record['bill_id'],
+            record['patient_name'],
+            record['hospital'],
+            len(audit.results_df),
+            audit.total_billed,
+            audit.total_standard,
+            audit.potential_savings,
+            audit.flagged_count,
+            audit.audit_score,
+            audit.excluded_amount
+        ])
+    return pd.DataFrame(rows, columns=SUMMARY_COLUMNS)
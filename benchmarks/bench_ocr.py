@@ -0,0 +1,82 @@
+"""Time per image for OCR of bill photos, before and after preprocessing.
+
+    python benchmarks/bench_ocr.py [image ...]
+
+Without arguments synthetic 12 MP phone photos of a slightly rotated bill
+are generated, with the item table closed by a rule and left open. "before" is the previous path: full-resolution RGB straight
+into pytesseract with default settings.
+"""
+import os
+import sys
+import time
+from io import BytesIO
+
+import cv2
+import numpy as np
+import pytesseract
+from PIL import Image
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from extraction import extract_text_from_image_bytes, text_to_items_from_lines  # noqa: E402
+from ocr import preprocess_for_ocr  # noqa: E402
+
+REPEAT = 3
+
+
+def synthetic_bill(width=3000, height=4000, angle=3.0, lines=30, closing_rule=True):
+    img = np.full((height, width), 235, np.uint8)
+    cv2.putText(img, "APOLLO HOSPITAL", (300, 300), cv2.FONT_HERSHEY_SIMPLEX, 4, 20, 8)
+    cv2.line(img, (200, 500), (width - 200, 500), 0, 6)
+    for i in range(lines):
+        y = 600 + i * 100
+        cv2.putText(img, f"Room Rent day {i + 1}", (250, y), cv2.FONT_HERSHEY_SIMPLEX, 2, 30, 4)
+        cv2.putText(img, f"{4000 + i * 25}.00", (2200, y), cv2.FONT_HERSHEY_SIMPLEX, 2, 30, 4)
+    if closing_rule:
+        cv2.line(img, (200, 600 + lines * 100), (width - 200, 600 + lines * 100), 0, 6)
+    matrix = cv2.getRotationMatrix2D((width / 2, height / 2), angle, 1.0)
+    img = cv2.warpAffine(img, matrix, (width, height), borderValue=235)
+    noise = np.random.default_rng(0).normal(0, 8, img.shape)
+    img = np.clip(img + noise, 0, 255).astype(np.uint8)
+    return cv2.imencode(".jpg", cv2.cvtColor(img, cv2.COLOR_GRAY2BGR))[1].tobytes()
+
+
+def ocr_before(img_bytes):
+    return pytesseract.image_to_string(Image.open(BytesIO(img_bytes)).convert("RGB"))
+
+
+def best_of(fn, img_bytes):
+    best = None
+    result = None
+    for _ in range(REPEAT):
+        started = time.perf_counter()
+        result = fn(img_bytes)
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def main(paths):
+    images = [(path, open(path, "rb").read()) for path in paths] or [
+        ("synthetic 12 MP", synthetic_bill()), ("synthetic 12 MP, open", synthetic_bill(closing_rule=False))]
+    try:
+        pytesseract.get_tesseract_version()
+    except Exception:
+        print("tesseract binary not found; timing preprocessing only")
+        for name, img_bytes in images:
+            seconds, _ = best_of(preprocess_for_ocr, img_bytes)
+            print(f"{name}: preprocess {seconds * 1000:,.0f} ms")
+        return
+
+    print(f"{'image':<24}{'before':>12}{'after':>12}{'speedup':>10}{'items before':>14}{'items after':>13}")
+    for name, img_bytes in images:
+        before, text_before = best_of(ocr_before, img_bytes)
+        after, text_after = best_of(extract_text_from_image_bytes, img_bytes)
+        items_before = len(text_to_items_from_lines(text_before.splitlines()))
+        items_after = len(text_to_items_from_lines(text_after.splitlines()))
+        print(f"{name[:23]:<24}{before * 1000:>10,.0f}ms{after * 1000:>10,.0f}ms{before / after:>9.1f}x"
+              f"{items_before:>14}{items_after:>13}")
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,88 @@
+"""Time to parse bill text into line items, old rsplit parser vs compiled pattern.
+
+    python benchmarks/bench_parser.py [text file ...]
+
+Without arguments a synthetic 10k-line OCR dump is generated, mixing
+"₹1,20,000.00", "Rs 500/-", "INR", qty x rate and trailing GST formats with
+headers and noise lines. "before" is the previous per-line str.replace and
+rsplit parser, which only understands a bare trailing amount.
+"""
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from extraction import text_to_items_from_lines  # noqa: E402
+
+REPEAT = 5
+SERVICES = ["Room Rent", "Doctor Fees", "Lab Test CBC", "MRI Brain", "Syringe 5ml", "ICU Charges",
+            "Nursing Charges", "2D Echo", "Pharmacy - Paracetamol", "X-Ray Chest PA"]
+
+
+def parse_before(lines):
+    items = []
+    for line in lines:
+        line = line.strip()
+        if not line:
+            continue
+        parts = line.rsplit(" ", 1)
+        if len(parts) == 2:
+            left, right = parts
+            amount_token = right.replace("₹", "").replace(",", "").replace("Rs.", "").strip()
+            if amount_token.replace(".", "", 1).isdigit():
+                try:
+                    amt = float(amount_token)
+                    items.append((left.strip(), amt))
+                    continue
+                except:
+                    pass
+    return items
+
+
+def synthetic_dump(lines=10000, seed=0):
+    rng = random.Random(seed)
+    formats = [
+        lambda s, q, r: f"{s} {q * r}",
+        lambda s, q, r: f"{s} ₹{q * r:,.2f}",
+        lambda s, q, r: f"{s} Rs {q * r}/-",
+        lambda s, q, r: f"{s} INR {q * r}",
+        lambda s, q, r: f"{s} {q} x {r} {q * r}",
+        lambda s, q, r: f"{s} {q} × {r}",
+        lambda s, q, r: f"{s} {q * r} 18% {q * r * 0.18:.2f}",
+        lambda s, q, r: f"{s} ....... {q * r}",
+        lambda s, q, r: "APOLLO HOSPITAL - FINAL BILL",
+        lambda s, q, r: "",
+    ]
+    out = []
+    for _ in range(lines):
+        fmt = rng.choice(formats)
+        out.append(fmt(rng.choice(SERVICES), rng.randint(1, 10), rng.randint(1, 90) * 50))
+    return out
+
+
+def best_of(fn, lines):
+    best = None
+    result = None
+    for _ in range(REPEAT):
+        started = time.perf_counter()
+        result = fn(lines)
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def main(paths):
+    dumps = [(path, open(path, encoding="utf-8").read().splitlines()) for path in paths]
+    dumps = dumps or [("synthetic 10k lines", synthetic_dump())]
+    print(f"{'input':<24}{'lines':>8}{'before':>12}{'after':>12}{'items before':>14}{'items after':>13}")
+    for name, lines in dumps:
+        before, items_before = best_of(parse_before, lines)
+        after, items_after = best_of(text_to_items_from_lines, lines)
+        print(f"{name[:23]:<24}{len(lines):>8}{before * 1000:>10,.1f}ms{after * 1000:>10,.1f}ms"
+              f"{len(items_before):>14}{len(items_after):>13}")
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
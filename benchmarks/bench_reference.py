@@ -0,0 +1,80 @@
+"""Cold-start time to a usable rate reference, CSV parse vs compiled artifact.
+
+    python benchmarks/bench_reference.py [rates.csv]
+
+Without arguments a synthetic 60k-row schedule (base, Tier II and hospital
+tariff rows, some with Effective From dates) is written to a temporary
+directory. "csv" is the previous path: pd.read_csv, then a RateReference
+that normalizes names and builds its own trigram index. "artifact" maps the
+compiled file written by the first `load_rates` call and builds the same
+reference on the shared matcher.
+"""
+import os
+import random
+import sys
+import tempfile
+import time
+
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from audit_engine import RateReference  # noqa: E402
+from rate_artifact import load_rates  # noqa: E402
+
+REPEAT = 3
+WORDS = ["room", "rent", "doctor", "fees", "lab", "test", "mri", "ct", "scan", "x-ray", "icu", "nursing",
+         "surgery", "knee", "hip", "cardiac", "echo", "blood", "culture", "cbc", "usg", "abdomen", "chest",
+         "ward", "consultation", "physiotherapy", "dialysis", "angiography", "stent"]
+
+
+def synthetic_schedule(path, rows=60000, seed=0):
+    rng = random.Random(seed)
+    pd.DataFrame({
+        "Service": [" ".join(rng.sample(WORDS, rng.randint(2, 4))) + f" {i % 7000}" for i in range(rows)],
+        "Rate (₹)": [rng.randint(1, 900) * 10 for _ in range(rows)],
+        "Schedule": [rng.choice(["", "", "", "Tier II", "Apollo"]) for _ in range(rows)],
+        "Effective From": [rng.choice(["", "2024-01-01", "01/04/2025"]) for _ in range(rows)]
+    }).to_csv(path, index=False)
+
+
+def from_csv(path):
+    table = pd.read_csv(path)
+    return RateReference(table[["Service", "Rate (₹)"]])
+
+
+def from_artifact(path):
+    compiled = load_rates(path)
+    table = pd.DataFrame({"Service": list(compiled.display), "Rate (₹)": compiled.rate})
+    return RateReference(table, matcher=compiled.matcher)
+
+
+def best_of(fn, path):
+    best = None
+    for _ in range(REPEAT):
+        started = time.perf_counter()
+        fn(path)
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def main(paths):
+    with tempfile.TemporaryDirectory() as tmp:
+        if not paths:
+            paths = [os.path.join(tmp, "rates.csv")]
+            synthetic_schedule(paths[0])
+        print(f"{'input':<24}{'rows':>8}{'compile':>12}{'csv':>12}{'artifact':>12}")
+        for path in paths:
+            rows = len(pd.read_csv(path))
+            started = time.perf_counter()
+            load_rates(path)
+            compile_time = time.perf_counter() - started
+            before = best_of(from_csv, path)
+            after = best_of(from_artifact, path)
+            print(f"{os.path.basename(path)[:23]:<24}{rows:>8}{compile_time * 1000:>10,.0f}ms"
+                  f"{before * 1000:>10,.0f}ms{after * 1000:>10,.0f}ms")
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,81 @@
+"""Repeated charges within a bill.
+
+Lines are bucketed in a dict by (bill, item, amount), so finding repeats
+is linear in the number of lines; only lines that share a bucket have their
+dates compared. The key is the normalized bill wording rather than the
+matched CGHS service, since different tests often fuzzy-match the same
+service at the same rate. Repeats that cannot be dated are reported
+separately as possible duplicates.
+"""
+import numpy as np
+import pandas as pd
+
+
+def _day_numbers(dates, n):
+    if dates is None:
+        return [None] * n
+    dates = pd.Series(dates, dtype=object)
+    # Bills write dd/mm/yyyy, but dayfirst would also swap month and day of ISO dates
+    iso = dates.astype(str).str.match(r"\d{4}-")
+    days = pd.to_datetime(dates.where(iso), errors="coerce", format="mixed").fillna(
+        pd.to_datetime(dates.where(~iso), errors="coerce", format="mixed", dayfirst=True))
+    return [None if pd.isna(d) else d.toordinal() for d in days]
+
+
+def duplicate_mask(keys, amounts, dates=None, groups=None, recurring=None, window_days=1):
+    """True for every line that repeats an earlier line of the same bill.
+
+    A line repeats an earlier one with the same key and amount if both are
+    dated the same day, or for services not billed per day (`recurring`
+    False) within `window_days`. Undated lines are never flagged: without a
+    date, two consultations or two identical tests cannot be told apart
+    from one charged twice.
+    """
+    n = len(keys)
+    days = _day_numbers(dates, n)
+    groups = groups if groups is not None else np.zeros(n, dtype=int)
+    recurring = recurring if recurring is not None else np.zeros(n, dtype=bool)
+
+    mask = np.zeros(n, dtype=bool)
+    # bucket -> days seen
+    buckets = {}
+    for i, bucket in enumerate(zip(groups, keys, np.round(amounts, 2))):
+        day = days[i]
+        # Free and unpriced lines cost nothing however often they appear
+        if bucket[2] <= 0 or day is None:
+            continue
+        seen_days = buckets.setdefault(bucket, set())
+        if recurring[i]:
+            mask[i] = day in seen_days
+        else:
+            mask[i] = any(day + gap in seen_days for gap in range(-window_days, window_days + 1))
+        seen_days.add(day)
+    return mask
+
+
+def possible_duplicate_mask(keys, amounts, dates=None, groups=None, recurring=None):
+    """True for every line repeating an earlier line of the same bill where either is undated.
+
+    Such a line has the same key and amount as an earlier one, but without
+    both dates it could be a second visit as well as a charge billed twice.
+    Services billed per day (`recurring` True) are expected to repeat and
+    are never reported.
+    """
+    n = len(keys)
+    days = _day_numbers(dates, n)
+    groups = groups if groups is not None else np.zeros(n, dtype=int)
+    recurring = recurring if recurring is not None else np.zeros(n, dtype=bool)
+
+    mask = np.zeros(n, dtype=bool)
+    # bucket -> whether an undated line was seen
+    buckets = {}
+    for i, bucket in enumerate(zip(groups, keys, np.round(amounts, 2))):
+        if bucket[2] <= 0 or recurring[i]:
+            continue
+        undated = days[i] is None
+        if bucket in buckets:
+            mask[i] = undated or buckets[bucket]
+            buckets[bucket] = buckets[bucket] or undated
+        else:
+            buckets[bucket] = undated
+    return mask
@@ -0,0 +1,43 @@
+"""Services each insurer's policy does not cover, from insurer_exclusions.csv.
+
+Rows without an Insurer (the shipped file has no such column) apply to every
+insurer. Bill items resolve to excluded service names through the same
+`NameResolver` as package rules, once per distinct item, so flagging a bill
+costs one set lookup per line.
+"""
+from collections import defaultdict
+
+import numpy as np
+import pandas as pd
+
+from service_matcher import NameResolver, normalize_text
+
+EXCLUDED_FLAGS = {"yes", "y", "true", "1", "excluded"}
+
+
+class ExclusionIndex:
+    def __init__(self, exclusions=None, cutoff=0.8, cache_size=10000):
+        # insurer -> excluded services; "" holds exclusions common to all insurers
+        self.by_insurer = defaultdict(set)
+        if exclusions is not None and "Services" in exclusions.columns:
+            flags = exclusions["Excluded_Service"] if "Excluded_Service" in exclusions.columns else "yes"
+            insurers = exclusions["Insurer"] if "Insurer" in exclusions.columns else ""
+            rows = pd.DataFrame({"service": exclusions["Services"], "flag": flags, "insurer": insurers})
+            for service, flag, insurer in rows.itertuples(index=False):
+                service = normalize_text(service)
+                if service and normalize_text(flag) in EXCLUDED_FLAGS:
+                    self.by_insurer[normalize_text(insurer)].add(service)
+        self.resolver = NameResolver(set().union(*self.by_insurer.values()), cutoff, cache_size)
+
+    def __len__(self):
+        return len(self.resolver)
+
+    def excluded(self, names, insurers=None):
+        """Mask of lines whose resolved service the line's insurer excludes"""
+        common = self.by_insurer.get("", set())
+        if insurers is None:
+            return np.array([name in common for name in names], dtype=bool)
+        return np.array([
+            name in common or name in self.by_insurer.get(normalize_text(insurer), ())
+            for name, insurer in zip(names, insurers)
+        ], dtype=bool)
@@ -0,0 +1,336 @@
+"""Turn uploaded bill documents (PDF, images, pasted text) into line items."""
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from io import BytesIO
+
+import numpy as np
+import pdfplumber
+from PIL import Image
+
+from ocr import OCR_DPI, gray_to_text, image_to_text
+from pdf_tables import page_layout, page_table_items
+from workers import DEFAULT_WORKERS, imap_ordered
+
+# Bump whenever extraction or parsing output changes, so cached results are not reused
+EXTRACTOR_VERSION = "8"
+EXTRACTION_CACHE_DIR = os.environ.get("MEDIAUDIT_EXTRACTION_CACHE_DIR")
+
+# Below this many pages, shipping the PDF to worker processes costs more than it saves
+PARALLEL_MIN_PAGES = 8
+PAGES_PER_TASK = 4
+
+# A page with fewer characters than this is treated as a scan and OCR'd;
+# scanners often stamp a page number or footer as real text on image pages
+TEXT_LAYER_MIN_CHARS = 20
+
+# Extracted line items carry quantity, unit rate and service date when the bill has them
+ITEM_COLUMNS = ["Item", "Qty", "Unit Rate (₹)", "Amount (₹)", "Date"]
+
+# "₹1,20,000.00", "Rs. 500/-", "INR 750"; the number itself is captured as `name`.
+# "4000." and ".50" are accepted too, as OCR often ends a line with a full stop
+_MONEY = r"(?:₹|rs\.?|inr)?[ \t]*(?P<{name}>\d[\d,]*(?:\.\d*)?|\.\d+)(?:[ \t]*/-)?"
+
+# The priced tail of a bill line: "qty x rate" (x, ×, * or @) and/or the
+# amount, then optionally a GST column given as a percentage and/or
+# "GST <amount>". Searching finds the leftmost, i.e. longest, tail; whatever
+# precedes it is the item.
+LINE_TAIL = re.compile(rf"""
+    [ \t]+(?=[\d₹ri.])
+    (?:(?P<qty>\d+(?:\.\d+)?)[ \t]*(?:x|×|\*|@)[ \t]*{_MONEY.format(name="rate")}
+       (?:[ \t]+{_MONEY.format(name="amount")})?
+     |{_MONEY.format(name="total")})
+    (?:[ \t]+(?:\+?[ \t]*(?:gst|tax)[ \t]*:?[ \t]*)?
+       (?:\d+(?:\.\d+)?[ \t]*%(?:[ \t]*{_MONEY.format(name="gst")})?
+        |(?<=gst)[ \t]*{_MONEY.format(name="gst_amount")}
+        |(?<=tax)[ \t]*{_MONEY.format(name="tax_amount")}))?
+    [ \t]*$
+""", re.I | re.X)
+
+
+# A service date opening the line: "02/03/2024", "02-03-24", "02.03.2024" or "2024-03-02"
+LINE_DATE = re.compile(r"^[ \t]*(?P<date>\d{1,2}[/.-]\d{1,2}[/.-]\d{2,4}|\d{4}-\d{1,2}-\d{1,2})(?:[ \t]+|$)")
+
+
+def _number(text):
+    return float(text.replace(",", "")) if text else None
+
+
+def parse_line_item(line):
+    """(item, qty, unit rate, amount, date) of one bill line, or None if it has no amount"""
+    m = LINE_TAIL.search(line)
+    if m is None:
+        return None
+    dated = LINE_DATE.match(line, 0, m.start())
+    item = line[dated.end() if dated else 0:m.start()].strip().rstrip(" .:-–")
+    if not item:
+        return None
+    qty = _number(m["qty"])
+    rate = _number(m["rate"])
+    amount = _number(m["amount"] or m["total"])
+    if amount is None:
+        amount = qty * rate
+    return item, qty, rate, amount, dated["date"] if dated else None
+
+
+def text_to_items_from_lines(lines):
+    items = []
+    for line in lines:
+        parsed = parse_line_item(line)
+        if parsed is not None:
+            items.append(parsed)
+    return items
+
+
+def pdf_page_count(pdf_bytes):
+    try:
+        with pdfplumber.open(BytesIO(pdf_bytes)) as pdf:
+            return len(pdf.pages)
+    except Exception:
+        return 0
+
+
+def has_text_layer(page):
+    return len(page.chars) >= TEXT_LAYER_MIN_CHARS
+
+
+def ocr_pdf_page(page):
+    """Rasterize a scanned PDF page at OCR_DPI and OCR it"""
+    try:
+        gray = np.asarray(page.to_image(resolution=OCR_DPI).original.convert("L"))
+        return gray_to_text(gray, OCR_DPI)
+    except Exception:
+        return ""
+
+
+def _line_items(text):
+    return text_to_items_from_lines(text.splitlines())
+
+
+def _empty_result(mode):
+    return [] if mode == "table" else ""
+
+
+def _extract_pages(pages, mode, layout=None, start=0):
+    """Yield (page number, result, source, seconds) per page, numbering from `start` + 1.
+
+    The result is the page text, or in "table" mode its line items. Pages
+    with a text layer are read by pdfplumber (source "text"); image-only
+    pages are OCR'd (source "ocr"). A page that cannot be read yields an
+    empty result with source "failed", so later pages keep their numbers.
+    """
+    for page_no, page in enumerate(pages, start=start + 1):
+        started = time.perf_counter()
+        try:
+            if not has_text_layer(page):
+                text = ocr_pdf_page(page)
+                result = _line_items(text) if mode == "table" else text
+                yield page_no, result, "ocr", time.perf_counter() - started
+                continue
+            if mode == "table":
+                rows, layout = page_table_items(page, layout)
+                result = rows if rows is not None else _line_items(page.extract_text() or "")
+            else:
+                result = page.extract_text() or ""
+        except Exception:
+            yield page_no, _empty_result(mode), "failed", time.perf_counter() - started
+            continue
+        yield page_no, result, "text", time.perf_counter() - started
+
+
+def _seed_layout(pages, start):
+    """Table layout a range starting mid-document inherits from earlier pages.
+
+    Checks the page just before the range (bills that repeat the header on
+    every page) and then the first page, rather than walking every page back.
+    """
+    for pos in dict.fromkeys((start - 1, 0)):
+        if 0 <= pos < start:
+            layout = page_layout(pages[pos])
+            if layout is not None:
+                return layout
+    return None
+
+
+def extract_pdf_page_range(task):
+    """Pages [start, stop) of a PDF as (page number, result, source, seconds); runs inside a worker process.
+
+    Always returns one entry per page: pages the range could not get to are
+    reported as "failed" with an empty result.
+    """
+    pdf_bytes, start, stop, mode = task
+    results = []
+    try:
+        with pdfplumber.open(BytesIO(pdf_bytes)) as pdf:
+            layout = _seed_layout(pdf.pages, start) if mode == "table" else None
+            results.extend(_extract_pages(pdf.pages[start:stop], mode, layout, start))
+    except Exception:
+        pass
+    results.extend((page_no, _empty_result(mode), "failed", 0.0)
+                   for page_no in range(start + len(results) + 1, stop + 1))
+    return results
+
+
+def _iter_pdf_pages_serial(pdf_bytes, mode):
+    try:
+        with pdfplumber.open(BytesIO(pdf_bytes)) as pdf:
+            yield from _extract_pages(pdf.pages, mode)
+    except Exception:
+        return
+
+
+def _page_ranges(page_count):
+    # A one-page first task gets the first items back as early as possible
+    yield 0, 1
+    for start in range(1, page_count, PAGES_PER_TASK):
+        yield start, min(start + PAGES_PER_TASK, page_count)
+
+
+def iter_pdf_pages(pdf_bytes, workers=DEFAULT_WORKERS, mode="text", on_page=None):
+    """Yield (page number, page result) in page order as pages are extracted.
+
+    Long PDFs are split into page ranges extracted concurrently in the worker
+    pool; results still arrive in page order. `on_page(page number, source,
+    seconds)` reports whether each page was read from its text layer, OCR'd
+    or could not be read ("failed", with an empty result).
+    """
+    page_count = pdf_page_count(pdf_bytes) if workers > 1 else 0
+    if page_count >= PARALLEL_MIN_PAGES:
+        tasks = [(pdf_bytes, start, stop, mode) for start, stop in _page_ranges(page_count)]
+        chunks = imap_ordered(extract_pdf_page_range, tasks, max_workers=workers)
+        pages = (result for results in chunks for result in results)
+    else:
+        pages = _iter_pdf_pages_serial(pdf_bytes, mode)
+    for page_no, result, source, seconds in pages:
+        if on_page:
+            on_page(page_no, source, seconds)
+        yield page_no, result
+
+
+def iter_pdf_page_texts(pdf_bytes, workers=DEFAULT_WORKERS, on_page=None):
+    return iter_pdf_pages(pdf_bytes, workers, mode="text", on_page=on_page)
+
+
+def iter_pdf_items(pdf_bytes, workers=DEFAULT_WORKERS, mode="table", on_page=None):
+    """Yield (page number, [(item, qty, unit rate, amount, date)]) page by page.
+
+    "table" mode reads columns from word positions, falling back to the
+    line parser on pages without a recognisable table header; "text" mode
+    uses the line parser throughout.
+    Scanned pages are OCR'd and line-parsed in either mode.
+    """
+    if mode == "text":
+        for page_no, text in iter_pdf_page_texts(pdf_bytes, workers, on_page):
+            yield page_no, _line_items(text)
+        return
+    yield from iter_pdf_pages(pdf_bytes, workers, mode="table", on_page=on_page)
+
+
+def extract_text_from_pdf_bytes(pdf_bytes, workers=DEFAULT_WORKERS):
+    return "".join(text + "\n" for _, text in iter_pdf_page_texts(pdf_bytes, workers) if text)
+
+
+def image_dpi(img_bytes):
+    """Horizontal DPI from the image header, if the scanner recorded one"""
+    try:
+        dpi = Image.open(BytesIO(img_bytes)).info.get("dpi")
+    except Exception:
+        return None
+    # Cameras often write a placeholder 72 DPI that says nothing about the page
+    if not dpi or dpi[0] <= 72:
+        return None
+    return float(dpi[0])
+
+
+def extract_text_from_image_bytes(img_bytes):
+    try:
+        return image_to_text(img_bytes, image_dpi(img_bytes))
+    except Exception:
+        return ""
+
+
+class ExtractionCache:
+    """Parsed line items keyed by a hash of the uploaded bytes.
+
+    An in-memory LRU sits in front of an optional on-disk tier of small JSON
+    files, so Streamlit reruns and re-uploads of the same bill skip
+    pdfplumber/tesseract entirely. Keys include `EXTRACTOR_VERSION`.
+    """
+
+    def __init__(self, maxsize=128, directory=EXTRACTION_CACHE_DIR):
+        self.maxsize = maxsize
+        self.directory = directory
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    @staticmethod
+    def key(data, kind):
+        digest = hashlib.sha256(f"{kind}:{EXTRACTOR_VERSION}:".encode())
+        digest.update(data)
+        return digest.hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.directory, f"{key}.json")
+
+    def _remember(self, key, items):
+        self._entries[key] = items
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+    def get(self, key):
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return self._entries[key]
+        if self.directory:
+            try:
+                with open(self._path(key), encoding="utf-8") as f:
+                    items = [tuple(item) for item in json.load(f)]
+            except (OSError, ValueError):
+                pass
+            else:
+                with self._lock:
+                    self.disk_hits += 1
+                    self._remember(key, items)
+                return items
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def put(self, key, items):
+        items = list(items)
+        with self._lock:
+            self._remember(key, items)
+        if self.directory:
+            # Write then rename so readers never see a half-written file
+            tmp_path = f"{self._path(key)}.{os.getpid()}.{threading.get_ident()}.tmp"
+            try:
+                with open(tmp_path, "w", encoding="utf-8") as f:
+                    json.dump(items, f, ensure_ascii=False)
+                os.replace(tmp_path, self._path(key))
+            except OSError:
+                pass
+
+    def stats(self):
+        with self._lock:
+            return {
+                'size': len(self._entries),
+                'maxsize': self.maxsize,
+                'hits': self.hits,
+                'disk_hits': self.disk_hits,
+                'misses': self.misses
+            }
+
+
+extraction_cache = ExtractionCache()
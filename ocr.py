@@ -0,0 +1,130 @@
+"""Image clean-up and tesseract settings for OCR of photographed or scanned bills.
+
+Tesseract's run time grows with pixel count and it reads best at roughly
+300 DPI, so phone photos (often 12 MP) are converted to grayscale, scaled
+down, straightened, binarized and cropped to the itemised table before OCR.
+"""
+import cv2
+import numpy as np
+import pytesseract
+
+OCR_DPI = 300
+# Longest side of an A4 page at OCR_DPI; used when the image carries no DPI
+MAX_SIDE = 3508
+MAX_DESKEW_DEGREES = 15
+MIN_DESKEW_DEGREES = 0.3
+
+# psm 6: one uniform block of text, which suits "item .... amount" bill lines
+TESSERACT_CONFIG = "--oem 1 --psm 6 -c preserve_interword_spaces=1"
+
+
+def decode_grayscale(img_bytes):
+    img = cv2.imdecode(np.frombuffer(img_bytes, np.uint8), cv2.IMREAD_GRAYSCALE)
+    if img is None:
+        raise ValueError("Unreadable image")
+    return img
+
+
+def normalize_resolution(gray, dpi=None):
+    """Downscale to about OCR_DPI; never upscale"""
+    h, w = gray.shape[:2]
+    scale = OCR_DPI / dpi if dpi else MAX_SIDE / max(h, w)
+    if scale >= 1:
+        return gray
+    return cv2.resize(gray, (max(1, int(w * scale)), max(1, int(h * scale))), interpolation=cv2.INTER_AREA)
+
+
+def binarize(gray):
+    """Black text on white, robust to the uneven lighting of phone photos"""
+    blurred = cv2.GaussianBlur(gray, (3, 3), 0)
+    return cv2.adaptiveThreshold(blurred, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C, cv2.THRESH_BINARY, 31, 15)
+
+
+def skew_angle(binary):
+    """Rotation in degrees that straightens the text lines, or 0"""
+    ink = cv2.bitwise_not(binary)
+    # Smear characters into line blobs so the fit follows text rows
+    kernel = cv2.getStructuringElement(cv2.MORPH_RECT, (max(15, binary.shape[1] // 40), 3))
+    rows = cv2.morphologyEx(ink, cv2.MORPH_CLOSE, kernel)
+    contours, _ = cv2.findContours(rows, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+
+    angles = []
+    weights = []
+    for contour in contours:
+        (_, _), (cw, ch), angle = cv2.minAreaRect(contour)
+        if cw < ch:
+            cw, ch = ch, cw
+            angle -= 90
+        # Only long, thin blobs are text lines
+        if cw < binary.shape[1] * 0.1 or cw < 4 * ch:
+            continue
+        angle = (angle + 45) % 90 - 45
+        angles.append(angle)
+        weights.append(cw)
+    if not angles:
+        return 0.0
+    order = np.argsort(angles)
+    cumulative = np.cumsum(np.asarray(weights)[order])
+    median = float(np.asarray(angles)[order][np.searchsorted(cumulative, cumulative[-1] / 2)])
+    if abs(median) < MIN_DESKEW_DEGREES or abs(median) > MAX_DESKEW_DEGREES:
+        return 0.0
+    return median
+
+
+def rotate(binary, angle):
+    h, w = binary.shape[:2]
+    matrix = cv2.getRotationMatrix2D((w / 2, h / 2), angle, 1.0)
+    return cv2.warpAffine(binary, matrix, (w, h), flags=cv2.INTER_NEAREST,
+                          borderMode=cv2.BORDER_CONSTANT, borderValue=255)
+
+
+def crop_table_region(binary, margin=10):
+    """Crop to the ruled table if one is found, else to the inked area.
+
+    Many bills rule off only the hospital header and the column titles and
+    leave the table open below. When there is more text below the last rule
+    than between the rules, the items are below it, so the crop runs from
+    the first rule to the last inked row instead.
+    """
+    ink = binary == 0
+    h, w = ink.shape[:2]
+    row_ink = np.count_nonzero(ink, axis=1)
+    rows = np.flatnonzero(row_ink)
+    if not len(rows):
+        return binary
+    # A row with ink across a third of the page is a ruling line, not text
+    is_rule = row_ink > w // 3
+    rule_rows = np.flatnonzero(is_rule)
+    if len(rule_rows) >= 2 and rule_rows[-1] - rule_rows[0] > h // 10:
+        top, bottom = rule_rows[0], rule_rows[-1]
+        # Rows with more than specks of noise on them
+        text_rows = (row_ink > w // 200) & ~is_rule
+        if np.count_nonzero(text_rows[bottom + 1:]) > np.count_nonzero(text_rows[top:bottom + 1]):
+            bottom = rows[-1]
+    else:
+        top, bottom = rows[0], rows[-1]
+    cols = np.flatnonzero(np.count_nonzero(ink[top:bottom + 1], axis=0))
+    left, right = cols[0], cols[-1]
+    return binary[max(0, top - margin):min(h, bottom + margin + 1),
+                  max(0, left - margin):min(w, right + margin + 1)]
+
+
+def preprocess_gray(gray, dpi=None):
+    binary = binarize(normalize_resolution(gray, dpi))
+    angle = skew_angle(binary)
+    if angle:
+        binary = rotate(binary, angle)
+    return crop_table_region(binary)
+
+
+def preprocess_for_ocr(img_bytes, dpi=None):
+    return preprocess_gray(decode_grayscale(img_bytes), dpi)
+
+
+def gray_to_text(gray, dpi=None):
+    """OCR an already decoded grayscale page, e.g. a rasterized PDF page"""
+    return pytesseract.image_to_string(preprocess_gray(gray, dpi), config=TESSERACT_CONFIG)
+
+
+def image_to_text(img_bytes, dpi=None):
+    return pytesseract.image_to_string(preprocess_for_ocr(img_bytes, dpi), config=TESSERACT_CONFIG)
@@ -0,0 +1,160 @@
+"""Read itemised bill tables from PDF word positions.
+
+Hospital bills are usually laid out as columns (S.No, Date, Item, Qty, Unit
+Rate, Amount, GST). Rather than flattening a page to text and guessing the
+amount from the end of each line, this finds the header row from pdfplumber's
+word boxes and assigns every word below it to a column by its x position.
+"""
+import re
+
+# Checked in order, so "Unit Rate" is a rate, "GST Amount" is GST and "Service Date" is a date
+HEADER_KEYWORDS = [
+    ("date", ("date", "dated", "dt")),
+    ("gst", ("gst", "cgst", "sgst", "igst", "tax")),
+    ("qty", ("qty", "quantity", "units", "nos", "days")),
+    ("rate", ("rate", "price", "mrp")),
+    ("amount", ("amount", "total", "net", "value", "charges")),
+    ("item", ("item", "items", "description", "particulars", "service", "services", "details", "procedure")),
+]
+
+# Words that start a qualifying phrase in a header cell
+HEADER_QUALIFIERS = ("incl", "including", "inclusive", "excl", "excluding", "exclusive", "with", "without", "of",
+                     "per", "in")
+
+TOTAL_ROW = re.compile(r"^(sub\s*-?\s*total|grand\s+total|total|net\s+payable|amount\s+payable)\b", re.I)
+NUMBER_NOISE = re.compile(r"(₹|inr|rs\.?|/-|,|\s)", re.I)
+
+
+class TableLayout:
+    """Column name and x-span of each header cell of a bill table"""
+
+    def __init__(self, columns):
+        # columns: [(name or None, x0, x1)] sorted left to right
+        self.columns = columns
+        self.bounds = [(columns[i][2] + columns[i + 1][1]) / 2 for i in range(len(columns) - 1)]
+
+    def column_of(self, word):
+        center = (word["x0"] + word["x1"]) / 2
+        for i, bound in enumerate(self.bounds):
+            if center < bound:
+                return self.columns[i][0]
+        return self.columns[-1][0]
+
+
+def parse_number(text):
+    if not text:
+        return None
+    try:
+        return float(NUMBER_NOISE.sub("", text))
+    except ValueError:
+        return None
+
+
+def group_lines(words):
+    """Words grouped into visual lines, top to bottom, each sorted left to right"""
+    lines = []
+    for word in sorted(words, key=lambda w: (w["top"], w["x0"])):
+        height = word["bottom"] - word["top"]
+        if lines and word["top"] - lines[-1][0]["top"] <= max(2.0, height * 0.5):
+            lines[-1].append(word)
+        else:
+            lines.append([word])
+    return [sorted(line, key=lambda w: w["x0"]) for line in lines]
+
+
+def _cells(line):
+    """Merge words separated by ordinary spacing into cells"""
+    chars = sum(len(w["text"]) for w in line) or 1
+    gap_limit = 1.2 * sum(w["x1"] - w["x0"] for w in line) / chars
+    cells = [[line[0]]]
+    for word in line[1:]:
+        if word["x0"] - cells[-1][-1]["x1"] > gap_limit:
+            cells.append([word])
+        else:
+            cells[-1].append(word)
+    return [(" ".join(w["text"] for w in cell), cell[0]["x0"], cell[-1]["x1"]) for cell in cells]
+
+
+def _header_name(text):
+    """Column a header cell names, from the first of its phrases that has a keyword.
+
+    Words after "incl.", "of", "per" and the like only qualify the column,
+    so "Amount (incl. GST)" is the amount, "Description of Charges" the item
+    and "No. of Days" a quantity.
+    """
+    tokens = re.findall(r"[a-z]+", text.lower())
+    phrase = []
+    for token in tokens + [None]:
+        if token is not None and token not in HEADER_QUALIFIERS:
+            phrase.append(token)
+            continue
+        for name, keywords in HEADER_KEYWORDS:
+            if any(word in keywords for word in phrase):
+                return name
+        phrase = []
+    return None
+
+
+def find_header(lines):
+    """(line index, TableLayout) of the first line naming item and amount columns"""
+    for i, line in enumerate(lines):
+        cells = _cells(line)
+        columns = [(_header_name(text), x0, x1) for text, x0, x1 in cells]
+        names = [name for name, _, _ in columns]
+        if "item" in names and "amount" in names:
+            return i, TableLayout(columns)
+    return None, None
+
+
+def page_layout(page):
+    """TableLayout of the page's header row, if it has one"""
+    return find_header(group_lines(page.extract_words()))[1]
+
+
+def page_table_items(page, layout=None):
+    """Item rows of one pdfplumber page as (item, qty, unit rate, amount, date).
+
+    Returns (rows, layout). A page with no header row reuses `layout` from the
+    previous page of the same bill; with neither, rows is None so the caller
+    can fall back to plain text parsing.
+    """
+    lines = group_lines(page.extract_words())
+    header_at, header_layout = find_header(lines)
+    if header_layout is not None:
+        layout = header_layout
+        lines = lines[header_at + 1:]
+    elif layout is None:
+        return None, None
+
+    rows = []
+    previous_bottom = None
+    for line in lines:
+        cells = {}
+        for word in line:
+            cells.setdefault(layout.column_of(word), []).append(word["text"])
+        item = " ".join(cells.get("item", [])).strip()
+        qty = parse_number(" ".join(cells.get("qty", [])))
+        rate = parse_number(" ".join(cells.get("rate", [])))
+        amount = parse_number(" ".join(cells.get("amount", [])))
+        date = " ".join(cells.get("date", [])).strip() or None
+        if amount is None and qty is not None and rate is not None:
+            amount = qty * rate
+
+        line_top = min(w["top"] for w in line)
+        line_height = max(w["bottom"] - w["top"] for w in line)
+        if item and TOTAL_ROW.match(item):
+            # Everything after the totals is footer
+            break
+        if amount is None:
+            # A description wrapped onto the next line belongs to the row above
+            wrapped = qty is None and rate is None
+            if wrapped and item and rows and previous_bottom is not None and line_top - previous_bottom < line_height:
+                name, q, r, a, d = rows[-1]
+                rows[-1] = (f"{name} {item}", q, r, a, d)
+                previous_bottom = max(w["bottom"] for w in line)
+            continue
+        if not item:
+            continue
+        rows.append((item, qty, rate, amount, date))
+        previous_bottom = max(w["bottom"] for w in line)
+    return rows, layout
@@ -0,0 +1,255 @@
+"""Precompiled, memory-mapped form of the CGHS rate table.
+
+Parsing the rate CSV, normalizing every service name and building the
+trigram index costs far more than an audit once the schedule grows to tens
+of thousands of rows across tiers and hospital tariffs. `load_rates` does
+that work once per CSV version and saves the result next to the CSV as a
+single file: a JSON header followed by 64-byte aligned NumPy arrays (rates,
+effective dates, name ids, UTF-8 name blobs with their offsets and the
+trigram postings in CSR form). Later loads map the file read-only, so worker
+processes share its pages through the OS page cache instead of each holding
+a parsed copy. Names stay in the mapped blobs and are decoded one at a time
+when a lookup touches them; sorted name tables are searched by bisection, so
+no process builds a dict or list over the whole schedule.
+
+The header records a SHA-256 of the CSV bytes and `ARTIFACT_VERSION`; the
+artifact is rebuilt whenever either differs.
+"""
+import hashlib
+import io
+import json
+import os
+import threading
+from bisect import bisect_left
+from collections import defaultdict
+
+import numpy as np
+import pandas as pd
+
+from audit_engine import REFERENCE_CSV, normalize_text
+from service_matcher import PostingIndex, ServiceMatcher, trigrams
+
+ARTIFACT_VERSION = 2
+ARTIFACT_SUFFIX = ".compiled"
+MAGIC = b"MEDIRATE"
+ALIGN = 64
+
+
+def artifact_path(csv_path=REFERENCE_CSV):
+    return os.path.splitext(csv_path)[0] + ARTIFACT_SUFFIX
+
+
+def _aligned(offset):
+    return -(-offset // ALIGN) * ALIGN
+
+
+def _pack_strings(values):
+    """(UTF-8 blob, offsets) with string i at blob[offsets[i]:offsets[i + 1]]"""
+    encoded = [value.encode("utf-8") for value in values]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum([len(value) for value in encoded])
+    return np.frombuffer(b"".join(encoded), dtype=np.uint8), offsets
+
+
+class StringTable:
+    """Read-only sequence of strings over a UTF-8 blob and its offsets.
+
+    Strings are decoded on access. When they are sorted, `find` searches
+    them without building an index.
+    """
+
+    def __init__(self, blob, offsets):
+        self._blob = blob
+        self._offsets = offsets
+
+    def __len__(self):
+        return len(self._offsets) - 1
+
+    def __getitem__(self, i):
+        if not -len(self) <= i < len(self):
+            raise IndexError(i)
+        i %= len(self)
+        return self._blob[self._offsets[i]:self._offsets[i + 1]].tobytes().decode("utf-8")
+
+    def __iter__(self):
+        data = self._blob.tobytes()
+        starts = self._offsets.tolist()
+        for start, end in zip(starts, starts[1:]):
+            yield data[start:end].decode("utf-8")
+
+    def take(self, positions):
+        """Strings at `positions`, decoded without copying the rest of the blob"""
+        positions = np.asarray(positions, dtype=np.int64)
+        data = memoryview(self._blob)
+        starts = self._offsets[positions].tolist()
+        ends = self._offsets[positions + 1].tolist()
+        return [data[start:end].tobytes().decode("utf-8") for start, end in zip(starts, ends)]
+
+    def find(self, name):
+        """Position of `name` in a sorted table, or None"""
+        i = bisect_left(self, name)
+        return i if i < len(self) and self[i] == name else None
+
+
+def compile_table(table):
+    """Header and flat arrays for a rate table.
+
+    `table` has Service and Rate (₹) columns and optionally Schedule and
+    Effective From, as read from the rate CSV.
+    """
+    table = table.reset_index(drop=True)
+    n = len(table)
+    service_norm = table["Service"].map(normalize_text)
+    # Catalogue order is first appearance in the file, as RateReference uses
+    services = list(pd.unique(service_norm))
+    schedule = table["Schedule"].map(normalize_text) if "Schedule" in table.columns else pd.Series("", index=table.index)
+    schedules = [""] + sorted(set(schedule) - {""})
+    if "Effective From" in table.columns:
+        effective = pd.to_datetime(table["Effective From"], errors="coerce", format="mixed")
+        effective = effective.to_numpy(dtype="datetime64[ns]").astype("datetime64[D]")
+    else:
+        effective = np.full(n, np.datetime64("NaT"), dtype="datetime64[D]")
+
+    postings = defaultdict(list)
+    for pos, service in enumerate(services):
+        for gram in trigrams(service):
+            postings[gram].append(pos)
+    grams = sorted(postings)
+    starts = np.zeros(len(grams) + 1, dtype=np.int64)
+    starts[1:] = np.cumsum([len(postings[gram]) for gram in grams])
+    flat = np.fromiter((pos for gram in grams for pos in postings[gram]), dtype=np.int32, count=int(starts[-1]))
+
+    arrays = {
+        "rate": table["Rate (₹)"].to_numpy(dtype=np.float64),
+        "effective": effective,
+        "service_id": pd.Index(services).get_indexer(service_norm).astype(np.int32),
+        "schedule_id": pd.Index(schedules).get_indexer(schedule).astype(np.int32),
+        # Character lengths, which the matcher's score bounds use; byte offsets differ for non-ASCII names
+        "service_len": np.array([len(service) for service in services], dtype=np.int32),
+        "gram_starts": starts,
+        "postings": flat
+    }
+    for name, values in (("display", table["Service"].astype(str).tolist()), ("services", services),
+                         ("schedules", schedules), ("grams", grams)):
+        arrays[name], arrays[f"{name}_offsets"] = _pack_strings(values)
+    header = {
+        "version": ARTIFACT_VERSION,
+        "counts": {"display": n, "services": len(services), "schedules": len(schedules), "grams": len(grams)}
+    }
+    return header, arrays
+
+
+def write_artifact(path, header, arrays):
+    header = dict(header, arrays={})
+    layout = []
+    offset = 0
+    for name, array in arrays.items():
+        array = np.ascontiguousarray(array)
+        offset = _aligned(offset)
+        header["arrays"][name] = [array.dtype.str, list(array.shape), offset]
+        layout.append((offset, array))
+        offset += array.nbytes
+    head = json.dumps(header).encode("utf-8")
+    data_start = _aligned(len(MAGIC) + 8 + len(head))
+
+    # Write then rename so a worker starting meanwhile maps either the old file or the new one
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        with open(tmp_path, "wb") as f:
+            f.write(MAGIC)
+            f.write(len(head).to_bytes(8, "little"))
+            f.write(head)
+            for start, array in layout:
+                f.seek(data_start + start)
+                f.write(array.tobytes())
+            # Pad to the end of the last array, even when it is empty
+            f.truncate(data_start + _aligned(offset))
+        os.replace(tmp_path, path)
+    except OSError:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
+
+
+def read_artifact(path):
+    """Header and read-only memory-mapped arrays; ValueError if not a current artifact"""
+    buffer = np.memmap(path, dtype=np.uint8, mode="r")
+    if buffer[:len(MAGIC)].tobytes() != MAGIC:
+        raise ValueError(f"{path} is not a rate artifact")
+    head_len = int.from_bytes(buffer[len(MAGIC):len(MAGIC) + 8].tobytes(), "little")
+    head_start = len(MAGIC) + 8
+    header = json.loads(buffer[head_start:head_start + head_len].tobytes())
+    if header.get("version") != ARTIFACT_VERSION:
+        raise ValueError(f"{path} was built by artifact version {header.get('version')}")
+    data_start = _aligned(head_start + head_len)
+
+    arrays = {}
+    for name, (dtype, shape, offset) in header["arrays"].items():
+        dtype = np.dtype(dtype)
+        start = data_start + offset
+        count = int(np.prod(shape))
+        arrays[name] = buffer[start:start + count * dtype.itemsize].view(dtype).reshape(shape)
+    return header, arrays
+
+
+class CompiledRates:
+    """Rate table arrays plus a matcher over its distinct service names.
+
+    `rate`, `effective`, `service_id` and `schedule_id` are per CSV row;
+    `display`, `services` and `schedules` are `StringTable`s (schedules
+    sorted, with the base schedule "" first). Everything, trigram postings
+    included, stays in the mapped file and is only read per lookup.
+    """
+
+    def __init__(self, header, arrays, path=None):
+        self.path = path
+        self.digest = header.get("source")
+        self.rate = arrays["rate"]
+        self.effective = arrays["effective"]
+        self.service_id = arrays["service_id"]
+        self.schedule_id = arrays["schedule_id"]
+        self.display = StringTable(arrays["display"], arrays["display_offsets"])
+        self.services = StringTable(arrays["services"], arrays["services_offsets"])
+        self.schedules = StringTable(arrays["schedules"], arrays["schedules_offsets"])
+        index = PostingIndex(StringTable(arrays["grams"], arrays["grams_offsets"]),
+                             arrays["gram_starts"], arrays["postings"])
+        self.matcher = ServiceMatcher(self.services, index=index, lengths=arrays["service_len"])
+
+    @classmethod
+    def from_table(cls, table):
+        """In-memory compile, for tables that do not come from a CSV file"""
+        header, arrays = compile_table(table)
+        return cls(header, arrays)
+
+    def __len__(self):
+        return len(self.rate)
+
+
+def load_rates(csv_path=REFERENCE_CSV, path=None):
+    """CompiledRates for a rate CSV, rebuilding its artifact when the CSV changed.
+
+    Raises OSError if the CSV cannot be read. When the artifact cannot be
+    written (read-only checkout) the compiled arrays are used from memory.
+    """
+    path = path or artifact_path(csv_path)
+    with open(csv_path, "rb") as f:
+        data = f.read()
+    # Hashing the bytes is cheap next to parsing them, and unlike mtime cannot miss a rewrite
+    digest = hashlib.sha256(data).hexdigest()
+    try:
+        header, arrays = read_artifact(path)
+        if header.get("source") == digest:
+            return CompiledRates(header, arrays, path)
+    except (OSError, ValueError, KeyError):
+        pass
+
+    header, arrays = compile_table(pd.read_csv(io.BytesIO(data)))
+    header["source"] = digest
+    try:
+        write_artifact(path, header, arrays)
+        header, arrays = read_artifact(path)
+    except (OSError, ValueError):
+        path = None
+    return CompiledRates(header, arrays, path)
@@ -0,0 +1,276 @@
+"""Hot-reloadable, versioned reference data for audits.
+
+`ReferenceStore` owns the rate, alias, package and exclusion files. Each
+`current()` call is cheap: at most every `check_interval` seconds one
+caller starts a background thread that stats the files, hashes them only if
+the stat changed, and builds a new immutable snapshot when the content
+really differs. The snapshot is swapped in with a single assignment, so
+audits already holding a `RateReference` finish on the rates they started
+with, and no audit waits for the check or the rebuild; they get the new
+version once it is in place.
+
+The rate table may carry two optional columns:
+
+- ``Schedule``: a CGHS city tier ("Tier II") or a hospital's own tariff
+  name; rows without one are the base CGHS schedule.
+- ``Effective From``: the date a rate applies from; undated rows always
+  apply.
+
+For each service the most specific schedule wins (hospital, then tier,
+then base) and within it the latest rate already in effect. Scaling is
+per service: when neither the hospital nor the tier lists a service, its
+base rate is scaled by the tier's `CITY_TIER_FACTORS` entry.
+
+The rate CSV is read through its memory-mapped compiled artifact (see
+`rate_artifact`), so a cold start or a new worker skips CSV parsing and the
+matcher index build unless the file actually changed.
+"""
+import hashlib
+import os
+import threading
+import time
+from datetime import date
+
+import numpy as np
+import pandas as pd
+
+from audit_engine import (ALIAS_CSV, EXCLUSION_CSV, MATCH_TIERS, PACKAGE_CSV, REFERENCE_CSV, RateReference,
+                          load_alias_csv, load_exclusion_csv, load_package_csv, load_reference_csv, normalize_text)
+from rate_artifact import CompiledRates, load_rates
+
+# CGHS rates are set for Tier I cities; Tier II and III are 10% and 20% lower
+CITY_TIER_FACTORS = {"Tier I": 1.0, "Tier II": 0.9, "Tier III": 0.8}
+
+REFERENCE_FILES = {
+    'rates': REFERENCE_CSV,
+    'aliases': ALIAS_CSV,
+    'packages': PACKAGE_CSV,
+    'exclusions': EXCLUSION_CSV
+}
+
+FALLBACK_LOADERS = {
+    'rates': load_reference_csv,
+    'aliases': load_alias_csv,
+    'packages': load_package_csv,
+    'exclusions': load_exclusion_csv
+}
+
+
+def _file_stats(paths):
+    stats = []
+    for path in paths.values():
+        try:
+            stat = os.stat(path)
+            stats.append((stat.st_mtime_ns, stat.st_size))
+        except OSError:
+            stats.append(None)
+    return tuple(stats)
+
+
+def _file_digest(paths):
+    digest = hashlib.sha256()
+    for name, path in paths.items():
+        digest.update(name.encode())
+        try:
+            with open(path, "rb") as f:
+                digest.update(f.read())
+        except OSError:
+            digest.update(b"\0missing")
+    return digest.hexdigest()
+
+
+def _to_date(value):
+    if value is None:
+        return None
+    return pd.Timestamp(value).normalize()
+
+
+def _to_day(timestamp):
+    return timestamp.to_datetime64().astype("datetime64[D]")
+
+
+class ReferenceSnapshot:
+    """One version of the reference files plus the references built from it"""
+
+    def __init__(self, tables, version, digest):
+        self.version = version
+        self.digest = digest
+        self.loaded_at = time.time()
+        self.aliases = tables['aliases']
+        self.packages = tables['packages']
+        self.exclusions = tables['exclusions']
+
+        compiled = tables['rates']
+        if not isinstance(compiled, CompiledRates):
+            compiled = CompiledRates.from_table(compiled)
+        self.compiled = compiled
+        self.schedules = [name for name in compiled.schedules if name]
+        # Any two dates between the same pair of effective dates select the same rows
+        self.effective_dates = np.unique(compiled.effective[~np.isnat(compiled.effective)])
+
+        self._references = {}
+        self._lock = threading.Lock()
+
+    def _period(self, as_of):
+        return int(np.searchsorted(self.effective_dates, _to_day(as_of), side="right"))
+
+    def select_rates(self, schedules=(), tier=None, as_of=None):
+        """One (Service, Rate) row per service for the schedules, tier and date.
+
+        Works on the compiled per-row arrays, so only the selected rows' names
+        are ever decoded.
+        """
+        as_of = _to_date(as_of or date.today())
+        order = [normalize_text(s) for s in schedules if normalize_text(s)]
+        if tier:
+            order.append(normalize_text(tier))
+        compiled = self.compiled
+        # Rank of each schedule id; schedules not asked for keep the sentinel and are dropped
+        unused = len(order) + 1
+        rank = np.full(len(compiled.schedules), unused, dtype=np.int64)
+        for i, name in enumerate(order + [""]):
+            pos = compiled.schedules.find(name)
+            if pos is not None:
+                rank[pos] = i
+
+        effective = compiled.effective
+        rows = np.flatnonzero((rank[compiled.schedule_id] < unused)
+                              & (np.isnat(effective) | (effective <= _to_day(as_of))))
+        # Per service: most specific schedule first, then the latest rate already in effect
+        # (undated rows last, as NaT is the smallest int64), then file order
+        latest_first = ~effective[rows].astype(np.int64)
+        ranked = rows[np.lexsort((rows, latest_first, rank[compiled.schedule_id[rows]],
+                                  compiled.service_id[rows]))]
+        service = compiled.service_id[ranked]
+        best = np.sort(ranked[np.r_[True, service[1:] != service[:-1]]] if len(ranked) else ranked)
+
+        rate = compiled.rate[best].astype(float)
+        factor = CITY_TIER_FACTORS.get(tier, 1.0) if tier else 1.0
+        if factor != 1.0:
+            # Schedule id 0 is the base schedule
+            rate = np.where(compiled.schedule_id[best] != 0, rate, rate * factor)
+        return pd.DataFrame({"Service": compiled.display.take(best), "Rate (₹)": rate})
+
+    def reference(self, hospital=None, tier=None, as_of=None):
+        as_of = _to_date(as_of or date.today())
+        schedules = (hospital,) if hospital and normalize_text(hospital) in self.schedules else ()
+        key = (schedules, tier, self._period(as_of))
+        reference = self._references.get(key)
+        if reference is None:
+            with self._lock:
+                reference = self._references.get(key)
+                if reference is None:
+                    table = self.select_rates(schedules, tier, as_of)
+                    reference = RateReference(table, self.aliases, self.packages, self.exclusions,
+                                              matcher=self.compiled.matcher)
+                    reference.key = (self.digest, hospital if schedules else None, tier, as_of)
+                    self._references[key] = reference
+        return reference
+
+    def match_stats(self):
+        """`RateReference.match_stats` summed over every hospital, tier and period of this version"""
+        with self._lock:
+            references = list(self._references.values())
+        counts = dict.fromkeys(MATCH_TIERS, 0)
+        cache = {'size': 0, 'maxsize': 0, 'hits': 0, 'misses': 0, 'evictions': 0}
+        for reference in references:
+            stats = reference.match_stats()
+            for tier, n in stats['counts'].items():
+                counts[tier] += n
+            for name in cache:
+                cache[name] += stats['cache'][name]
+        total = sum(counts.values())
+        lookups = cache['hits'] + cache['misses']
+        cache['hit_ratio'] = cache['hits'] / lookups if lookups else 0.0
+        return {
+            'total': total,
+            'counts': counts,
+            'ratios': {tier: (n / total if total else 0.0) for tier, n in counts.items()},
+            'cache': cache
+        }
+
+
+class ReferenceStore:
+    def __init__(self, paths=None, check_interval=2.0):
+        self.paths = dict(paths or REFERENCE_FILES)
+        self.check_interval = check_interval
+        self.last_error = None
+        self._reload_lock = threading.Lock()
+        self._checked_at = time.monotonic()
+        self._stats = _file_stats(self.paths)
+        try:
+            tables = self._read_tables()
+        except Exception:
+            tables = {name: FALLBACK_LOADERS[name](path) for name, path in self.paths.items()}
+        self._snapshot = ReferenceSnapshot(tables, 1, _file_digest(self.paths))
+
+    @property
+    def snapshot(self):
+        return self._snapshot
+
+    @property
+    def version(self):
+        return self._snapshot.version
+
+    def _read_tables(self):
+        tables = {}
+        for name, path in self.paths.items():
+            try:
+                # The rate table comes from its compiled artifact, rebuilt here if the CSV changed
+                tables[name] = load_rates(path) if name == 'rates' else pd.read_csv(path)
+            except FileNotFoundError:
+                if name == 'rates':
+                    raise
+                tables[name] = FALLBACK_LOADERS[name](path)
+        return tables
+
+    def refresh(self, force=False):
+        """Reload if the files changed; returns True when a new version was swapped in"""
+        with self._reload_lock:
+            return self._refresh(force)
+
+    def _refresh(self, force=False):
+        self._checked_at = time.monotonic()
+        stats = _file_stats(self.paths)
+        if stats == self._stats and not force:
+            return False
+        self._stats = stats
+        digest = _file_digest(self.paths)
+        # A touch or a rewrite with identical content keeps the current version
+        if digest == self._snapshot.digest and not force:
+            return False
+        try:
+            snapshot = ReferenceSnapshot(self._read_tables(), self._snapshot.version + 1, digest)
+            # Build the default reference before the swap, off the audit path
+            snapshot.reference()
+        except Exception as e:
+            # A half-written or broken file keeps the last good version
+            self.last_error = f"{type(e).__name__}: {e}"
+            return False
+        self.last_error = None
+        self._snapshot = snapshot
+        return True
+
+    def current(self, hospital=None, tier=None, as_of=None):
+        """RateReference for a hospital tariff, city tier and date (today by default)"""
+        # Whoever finds a check due hands it to a thread; everyone keeps the current snapshot meanwhile
+        if time.monotonic() - self._checked_at >= self.check_interval and self._reload_lock.acquire(blocking=False):
+            self._checked_at = time.monotonic()
+            try:
+                threading.Thread(target=self._background_refresh, name="reference-reload", daemon=True).start()
+            except RuntimeError:
+                self._reload_lock.release()
+        return self._snapshot.reference(hospital, tier, as_of)
+
+    def _background_refresh(self):
+        # Runs holding the reload lock taken in current()
+        try:
+            self._refresh()
+        except Exception as e:
+            self.last_error = f"{type(e).__name__}: {e}"
+        finally:
+            self._reload_lock.release()
+
+    def match_stats(self):
+        """Match lookups across all references of the current version"""
+        return self._snapshot.match_stats()
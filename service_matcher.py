@@ -0,0 +1,242 @@
+"""Trigram-indexed fuzzy matching of bill items against CGHS service names.
+
+`ServiceMatcher` gives the same best match and score as a linear scan of
+difflib ratios over the whole catalogue for every service that shares at
+least one padded trigram with the query, but only considers candidates
+pulled from an inverted index, and skips difflib for any candidate whose
+upper-bound score cannot beat the best found so far.
+"""
+import copy
+import difflib
+import re
+import threading
+from bisect import bisect_left
+from collections import OrderedDict, defaultdict
+
+import numpy as np
+import pandas as pd
+
+
+def normalize_text(s):
+    if pd.isna(s):
+        return ""
+    return str(s).strip().lower()
+
+
+def trigrams(text):
+    """Padded character trigrams of each word, as used by pg_trgm"""
+    grams = set()
+    for word in text.split():
+        padded = f"  {word} "
+        for i in range(len(padded) - 2):
+            grams.add(padded[i:i + 3])
+    return grams
+
+
+class ServiceMatcher:
+    def __init__(self, services, max_candidates=None, index=None, lengths=None):
+        if lengths is None:
+            # Keep catalogue order so ties resolve like the linear scan
+            self.services = list(dict.fromkeys(services))
+            self._lengths = np.array([len(s) for s in self.services], dtype=np.int64)
+        else:
+            # Already distinct, with their lengths precomputed (e.g. a mapped StringTable); used as is
+            self.services = services
+            self._lengths = lengths
+        # Optional hard cap on scored candidates; trades exactness for speed
+        self.max_candidates = max_candidates
+        # Boolean mask of positions a restricted view may return; None means the whole catalogue
+        self._allowed = None
+        self._allowed_count = len(self.services)
+        if index is None:
+            index = defaultdict(list)
+            for pos, service in enumerate(self.services):
+                for gram in trigrams(service):
+                    index[gram].append(pos)
+        # Anything with .get(gram, default) -> catalogue positions, e.g. a PostingIndex
+        self._index = index
+
+    def __len__(self):
+        return self._allowed_count
+
+    def restricted_to(self, services):
+        """Matcher over a subset of the catalogue that shares this one's index.
+
+        Matches are the same as a matcher built from `services` alone as long
+        as they keep catalogue order; names not in the catalogue are ignored.
+        """
+        # Only needed while the view is built, so a mapped catalogue is not held decoded
+        positions = {service: pos for pos, service in enumerate(self.services)}
+        allowed = np.zeros(len(self.services), dtype=bool)
+        allowed[[positions[s] for s in services if s in positions]] = True
+        if self._allowed is None and allowed.all():
+            return self
+        view = copy.copy(self)
+        view._allowed = allowed if self._allowed is None else allowed & self._allowed
+        view._allowed_count = int(view._allowed.sum())
+        return view
+
+    def candidates(self, query, cutoff):
+        """Catalogue positions worth scoring, most shared trigrams first"""
+        postings = [np.asarray(self._index.get(gram, ()), dtype=np.int64) for gram in trigrams(query)]
+        if not postings:
+            return []
+        # Counting in NumPy: a common gram can post to most of a large catalogue
+        pos, shared = np.unique(np.concatenate(postings), return_counts=True)
+        if self._allowed is not None:
+            keep = self._allowed[pos]
+            pos, shared = pos[keep], shared[keep]
+        # ratio() can never exceed 2*min(len)/(sum of lens)
+        qlen = len(query)
+        clen = self._lengths[pos]
+        keep = 2.0 * np.minimum(qlen, clen) / (qlen + clen) >= cutoff
+        pos, shared = pos[keep], shared[keep]
+        order = np.lexsort((pos, -shared))
+        if self.max_candidates is not None:
+            order = order[:self.max_candidates]
+        return pos[order].tolist()
+
+    def match(self, query, cutoff=0.70):
+        if not query:
+            return None, 0.0
+        best_pos = None
+        best_score = 0.0
+        qlen = len(query)
+        positions = self.candidates(query, cutoff)
+        for pos, clen in zip(positions, self._lengths[positions].tolist()):
+            if 2.0 * min(qlen, clen) / (qlen + clen) < best_score:
+                continue
+            sm = difflib.SequenceMatcher(None, query, self.services[pos])
+            # Cheap upper bound first; only beat or tie-break the current best
+            if sm.quick_ratio() < best_score:
+                continue
+            score = sm.ratio()
+            if score > best_score or (score == best_score and best_pos is not None and pos < best_pos):
+                best_score = score
+                best_pos = pos
+        if best_pos is not None and best_score >= cutoff:
+            return self.services[best_pos], best_score
+        return None, best_score
+
+
+class PostingIndex:
+    """Read-only trigram index stored as flat arrays (e.g. memory-mapped).
+
+    `grams` is a sorted sequence, searched by bisection rather than loaded
+    into a dict; the positions of grams[i] are
+    postings[starts[i]:starts[i + 1]].
+    """
+
+    def __init__(self, grams, starts, postings):
+        self._grams = grams
+        self._starts = starts
+        self._postings = postings
+
+    def __len__(self):
+        return len(self._grams)
+
+    def get(self, gram, default=None):
+        i = bisect_left(self._grams, gram)
+        if i == len(self._grams) or self._grams[i] != gram:
+            return default
+        return self._postings[self._starts[i]:self._starts[i + 1]].tolist()
+
+
+class MatchCache:
+    """Thread-safe bounded LRU of normalized item text -> (match, score)"""
+
+    def __init__(self, maxsize=10000):
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        with self._lock:
+            try:
+                value = self._entries[key]
+            except KeyError:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self._entries),
+                'maxsize': self.maxsize,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_ratio': self.hits / lookups if lookups else 0.0
+            }
+
+
+class NameResolver:
+    """Resolve bill items to one of a small set of rule names.
+
+    Tries the normalized item and its matched CGHS service as exact names,
+    then the longest rule name either contains as whole words, then the fuzzy
+    matcher. Used for package and exclusion rules; results are cached per
+    item.
+    """
+
+    def __init__(self, names, cutoff=0.8, cache_size=10000):
+        self.names = set(names)
+        self.cutoff = cutoff
+        self.matcher = ServiceMatcher(sorted(self.names))
+        # Longest names first, so "room rent (deluxe)" finds "room rent" and
+        # "knee replacement package - left" finds the package, not a shorter name
+        self.pattern = re.compile(r"\b(?:%s)\b" % "|".join(
+            re.escape(name) for name in sorted(self.names, key=len, reverse=True))) if self.names else None
+        self.cache = MatchCache(cache_size)
+
+    def __len__(self):
+        return len(self.names)
+
+    def resolve(self, item, service=None):
+        if item in self.names:
+            return item
+        if service in self.names:
+            return service
+        if not self.names:
+            return None
+        key = (item, service)
+        name = self.cache.get(key)
+        if name is None:
+            name = ""
+            for text in (item, service):
+                if not isinstance(text, str) or not text:
+                    continue
+                found = self.pattern.search(text)
+                name = found.group(0) if found else self.matcher.match(text, cutoff=self.cutoff)[0] or ""
+                if name:
+                    break
+            self.cache.put(key, name)
+        return name or None
+
+    def resolve_lines(self, items, services):
+        """Rule name (or None) per line, resolving each distinct item once"""
+        resolved = {}
+        names = []
+        for item, service in zip(items, services):
+            if item not in resolved:
+                resolved[item] = self.resolve(item, service)
+            names.append(resolved[item])
+        return names
@@ -0,0 +1,121 @@
+import asyncio
+import json
+import os
+import shutil
+
+import pytest
+
+from api import AuditApi
+from audit_store import AuditStore
+from reference_store import REFERENCE_FILES, ReferenceStore
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+KEY = "test-key"
+
+
+@pytest.fixture(scope="module")
+def api(tmp_path_factory):
+    tmp = tmp_path_factory.mktemp("api")
+    paths = {}
+    for name, filename in REFERENCE_FILES.items():
+        shutil.copy(os.path.join(ROOT, filename), tmp / filename)
+        paths[name] = str(tmp / filename)
+    app = AuditApi(concurrency=2, max_pending=8, keys=[KEY], audits=AuditStore(str(tmp / "audits.db")),
+                   references=ReferenceStore(paths))
+    yield app
+    app.shutdown()
+
+
+def call(app, method, path, body=b"", headers=(), query=b""):
+    messages = [{"type": "http.request", "body": body, "more_body": False}]
+    sent = []
+
+    async def receive():
+        return messages.pop(0)
+
+    async def send(message):
+        sent.append(message)
+
+    scope = {"type": "http", "method": method, "path": path, "query_string": query,
+             "headers": [(k.encode(), v.encode()) for k, v in headers]}
+    asyncio.run(app(scope, receive, send))
+    return sent[0]["status"], json.loads(sent[1]["body"])
+
+
+def post_json(app, request, key=KEY):
+    headers = [("content-type", "application/json")] + ([("x-api-key", key)] if key else [])
+    return call(app, "POST", "/audits", json.dumps(request).encode(), headers)
+
+
+def test_requires_a_valid_key(api):
+    assert post_json(api, {"items": [["Room Rent", 4000]]}, key=None)[0] == 401
+    assert post_json(api, {"items": [["Room Rent", 4000]]}, key="wrong")[0] == 401
+
+
+def test_create_and_fetch(api):
+    status, created = post_json(api, {"patient_name": "A", "items": [{"item": "Room Rent", "amount": 4000},
+                                                                     ["MRI", "9,000"]]})
+    assert status == 201
+    assert [line["service"] for line in created["lines"]] == ["Room Rent", "MRI"]
+    status, fetched = call(api, "GET", f"/audits/{created['id']}", headers=[("authorization", f"Bearer {KEY}")])
+    assert status == 200
+    assert fetched == created
+
+
+def test_csv_body(api):
+    status, created = call(api, "POST", "/audits", b"Service,Amount\nRoom Rent,4000\n",
+                           [("x-api-key", KEY), ("content-type", "text/csv")], query=b"flag_exclusions=false")
+    assert status == 201
+    assert created["total_billed"] == 4000
+
+
+def test_csv_columns_are_named_like_bulk_uploads(api):
+    # "Service Date" is the date, not a second item column
+    body = b"S.No,Service Date,Item,Amount\n1,02/03/2024,MRI,5000\n2,02/03/2024,MRI,5000\n"
+    status, created = call(api, "POST", "/audits", body, [("x-api-key", KEY), ("content-type", "text/csv")])
+    assert status == 201
+    assert [line["service"] for line in created["lines"]] == ["MRI", "MRI"]
+    assert created["lines"][1]["status"] == "Duplicate"
+
+
+@pytest.mark.parametrize("items", [
+    [],
+    "Room Rent",
+    [{"item": "Room Rent"}],
+    [{"amount": 4000}],
+    [{"item": "", "amount": 4000}],
+    [{"item": "Room Rent", "amount": None}],
+    [{"item": "Room Rent", "amount": True}],
+    [{"item": "Room Rent", "amount": [4000]}],
+    [[None, 4000]],
+    ["Room Rent"]
+])
+def test_rejects_malformed_items(api, items):
+    status, body = post_json(api, {"items": items})
+    assert status == 400
+    assert "error" in body
+
+
+@pytest.mark.parametrize("field, value", [
+    ("city_tier", ["Tier I"]),
+    ("city_tier", "Tier IV"),
+    ("hospital", {"name": "Apollo"}),
+    ("admission_date", "not a date"),
+    ("admission_date", 20240101),
+    ("insurer", 7),
+    ("flag_exclusions", [])
+])
+def test_rejects_bad_options(api, field, value):
+    status, body = post_json(api, {field: value, "items": [["Room Rent", 4000]]})
+    assert status == 400
+    assert field in body["error"]
+
+
+def test_unexpected_errors_are_not_echoed(api, monkeypatch):
+    def broken(*args, **kwargs):
+        raise RuntimeError("secret path /srv/data")
+
+    monkeypatch.setattr(api, "create_audit", broken)
+    status, body = post_json(api, {"items": [["Room Rent", 4000]]})
+    assert status == 500
+    assert body == {"error": "Internal server error"}
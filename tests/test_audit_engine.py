@@ -0,0 +1,163 @@
+"""The columnar engine against the per-line loop it replaced"""
+import difflib
+import random
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from audit_engine import (RESULT_COLUMNS, RateReference, audit_bill, load_reference_csv, normalize_text,
+                          score_lines, summarize_groups)
+
+CONSUMABLES = ['syringe', 'glove', 'mask', 'cotton', 'bandage', 'gauze']
+
+
+def baseline_match(item, services, cutoff=0.65):
+    best, best_score = None, 0.0
+    for candidate in services:
+        score = difflib.SequenceMatcher(None, item, candidate).ratio()
+        if score > best_score:
+            best, best_score = candidate, score
+    return best if best_score >= cutoff else None
+
+
+def baseline_audit(items, table):
+    """The original app loop: fuzzy match and a boolean-mask rate lookup per line"""
+    service_norm = table["Service"].map(normalize_text)
+    services = service_norm.tolist()
+    results, alerts = [], []
+    total_billed = total_standard = potential_savings = 0.0
+    types = {"Inflated Consumables": 0, "Duplicate Billing": 0, "Upcoding": 0, "Unbundling": 0}
+    for _, row in items.iterrows():
+        item = normalize_text(row["Item"])
+        if not item:
+            continue
+        try:
+            amount = float(str(row["Amount (₹)"]).replace(",", "").replace("₹", "").strip())
+        except ValueError:
+            amount = 0.0
+        total_billed += amount
+        status, kind, comment, standard = "Normal", "", "", amount
+        matched = baseline_match(item, services)
+        if matched:
+            rate = float(table[service_norm == matched].iloc[0]["Rate (₹)"])
+            standard = rate
+            total_standard += rate
+            if amount > rate * 1.15:
+                status = "Overcharged"
+                savings = amount - rate
+                potential_savings += savings
+                if any(word in item for word in CONSUMABLES):
+                    kind = "Inflated Consumables"
+                elif amount > rate * 2:
+                    kind = "Upcoding"
+                else:
+                    kind = "Overcharge Detected"
+                types[kind] = types.get(kind, 0) + 1
+                comment = f"₹{amount:,.0f} vs ₹{rate:,.0f} (Save ₹{savings:,.0f})"
+                alerts.append(f"⚠️ {row['Item']}: {kind} - Save ₹{savings:,.0f}")
+            else:
+                total_standard += amount
+        else:
+            status, comment = "Unlisted", "Not in CGHS rates"
+            total_standard += amount
+        results.append([row["Item"], amount, standard, status, kind, comment])
+    types.pop("Overcharge Detected", None)
+    flagged = sum(1 for r in results if r[3] == "Overcharged")
+    return {
+        "results": pd.DataFrame(results, columns=RESULT_COLUMNS),
+        "total_billed": total_billed,
+        "total_standard": total_standard,
+        "potential_savings": potential_savings,
+        "flagged_count": flagged,
+        "audit_score": max(0, 100 - flagged * 10),
+        "alerts": alerts,
+        "overcharge_types": types
+    }
+
+
+@pytest.fixture(scope="module")
+def table():
+    return load_reference_csv()
+
+
+def random_bill(table, rng, lines=25):
+    names = table["Service"].tolist()
+    rates = dict(zip(names, table["Rate (₹)"]))
+    rows = []
+    for _ in range(lines):
+        name = rng.choice(names)
+        kind = rng.random()
+        if kind < 0.4:
+            item = name
+        elif kind < 0.6:
+            item = f"  {name.upper()} "
+        elif kind < 0.75:
+            item = name + rng.choice([" charges", " (per day)", "s", " - left"])
+        elif kind < 0.85:
+            item = rng.choice(["Surgical Gloves (Box)", "Cotton roll", "Syringe 5ml", "Misc consumables"])
+        elif kind < 0.9:
+            item = rng.choice(["", None, "zzqx"])
+        else:
+            # A typo; the indexed matcher only scores services sharing a trigram with the item
+            cut = rng.randrange(len(name))
+            item = name[:cut] + name[cut + 1:]
+        amount = round(rates[name] * rng.choice([0.5, 1.0, 1.1, 1.15, 1.16, 1.5, 2.0, 2.01, 3.0]), 2)
+        rows.append((item, rng.choice([amount, f"₹{amount:,.2f}", str(amount), "n/a"])))
+    # Days apart, so repeats the old loop never checked for are not flagged as duplicates
+    dates = [f"2024-{1 + i // 8:02d}-{1 + 3 * (i % 8):02d}" for i in range(lines)]
+    return pd.DataFrame(rows, columns=["Item", "Amount (₹)"]).assign(Date=dates)
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_audit_bill_matches_the_per_line_loop(table, seed):
+    items = random_bill(table, random.Random(seed))
+    expected = baseline_audit(items, table)
+    result = audit_bill(items, RateReference(table))
+
+    pd.testing.assert_frame_equal(result.results_df.astype({"Service": object}),
+                                  expected["results"].astype({"Service": object}), check_dtype=False)
+    for name in ("total_billed", "total_standard", "potential_savings"):
+        assert getattr(result, name) == pytest.approx(expected[name])
+    assert result.flagged_count == expected["flagged_count"]
+    assert result.audit_score == expected["audit_score"]
+    assert result.alerts == expected["alerts"]
+    assert result.overcharge_types == expected["overcharge_types"]
+
+
+def test_raw_table_and_pairs_are_accepted(table):
+    pairs = [("Room Rent", 9000), ("MRI", "5,000")]
+    by_pairs = audit_bill(pairs, table)
+    by_frame = audit_bill(pd.DataFrame(pairs, columns=["Item", "Amount (₹)"]), RateReference(table))
+    pd.testing.assert_frame_equal(by_pairs.results_df, by_frame.results_df)
+
+
+def test_batch_scoring_matches_per_bill_audits(table):
+    rng = random.Random(99)
+    bills = [random_bill(table, rng, lines=rng.randint(1, 12)) for _ in range(15)]
+    codes = np.concatenate([np.full(len(bill), i) for i, bill in enumerate(bills)])
+    reference = RateReference(table)
+    lines = score_lines(pd.concat(bills, ignore_index=True), reference, codes)
+    batched = dict(summarize_groups(lines, codes[lines.index]))
+    for i, bill in enumerate(bills):
+        single = audit_bill(bill, reference)
+        if single.results_df.empty:
+            assert i not in batched
+            continue
+        pd.testing.assert_frame_equal(batched[i].results_df, single.results_df)
+        assert batched[i].total_standard == pytest.approx(single.total_standard)
+        assert batched[i].alerts == single.alerts
+
+
+def test_exact_alias_and_fuzzy_tiers(table):
+    aliases = pd.DataFrame({"Alias": ["Consultation Charges", "Unknown Alias"], "Service": ["Doctor Fees", "Nope"]})
+    reference = RateReference(table, aliases)
+    assert reference.match("doctor fees") == ("doctor fees", 1.0)
+    assert reference.match("consultation charges") == ("doctor fees", 1.0)
+    assert reference.match("unknown alias")[0] != "nope"
+    assert reference.match("doctor feez")[0] == "doctor fees"
+    reference.match("doctor feez")
+    stats = reference.match_stats()
+    assert stats["counts"]["exact"] == 1
+    assert stats["counts"]["alias"] == 1
+    assert stats["cache"]["hits"] == 1
@@ -0,0 +1,107 @@
+import random
+from datetime import datetime, timedelta
+
+import pandas as pd
+import pytest
+
+from audit_store import DATE_FORMAT, AuditRecord, AuditStore
+
+OWNER = "session-1"
+
+
+@pytest.fixture
+def store(tmp_path):
+    return AuditStore(str(tmp_path / "audits.db"), retention_days=30)
+
+
+def record(billed, days_old=0, **fields):
+    results = pd.DataFrame({"Service": ["Room Rent"], "Billed (₹)": [billed], "Standard (₹)": [4000.0],
+                            "Status": ["Normal"], "Type": [""], "Comments": [""]})
+    date = (datetime.now() - timedelta(days=days_old)).strftime(DATE_FORMAT)
+    return AuditRecord(results, patient_name="A", hospital="H", date=date, total_billed=billed, **fields)
+
+
+def test_round_trip_keeps_lines(store):
+    saved = record(4000.5, alerts=["x"], overcharge_types={"Upcoding": 1})
+    audit_id = store.save_audit(OWNER, saved)
+    loaded = store.audit(OWNER, audit_id, lines=True)
+    assert loaded.results_df().equals(saved.results_df())
+    assert loaded.alerts == ("x",)
+    assert dict(loaded.overcharge_types) == {"Upcoding": 1}
+    assert store.audit("someone else", audit_id) is None
+
+
+def test_prune_keeps_recent_and_referenced_audits(store):
+    recent = store.save_audit(OWNER, record(1000))
+    old = store.save_audit(OWNER, record(1000, days_old=45))
+    old_queued = store.save_audit(OWNER, record(1000, days_old=45), queued=True)
+    old_paid = store.save_audit(OWNER, record(1000, days_old=45))
+    store.record_payments(OWNER, [old_paid], "UPI")
+    old_negotiated = store.save_audit(OWNER, record(1000, days_old=45))
+    store.add_negotiation(OWNER, {"id": "NEG-1", "audit_id": old_negotiated})
+
+    assert store.prune() == 1
+    assert store.audit(OWNER, old) is None
+    assert store.results_df(OWNER, old).empty
+    for audit_id in (recent, old_queued, old_paid, old_negotiated):
+        assert store.audit(OWNER, audit_id) is not None
+    assert store.queue_totals(OWNER) == (1, 1000.0)
+
+
+def test_retention_zero_keeps_everything(tmp_path):
+    store = AuditStore(str(tmp_path / "keep.db"), retention_days=0)
+    audit_id = store.save_audit(OWNER, record(1000, days_old=4000))
+    assert store.prune() == 0
+    assert store.audit(OWNER, audit_id) is not None
+
+
+def scanned_totals(store, owner):
+    bills, total = store._connect().execute(
+        "SELECT COUNT(*), COALESCE(SUM(total_billed), 0) FROM audits WHERE owner = ? AND queued = 1",
+        (owner,)).fetchone()
+    return bills, round(total, 2)
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_queue_totals_track_the_queue(store, seed):
+    rng = random.Random(seed)
+    owners = [OWNER, "session-2"]
+    ids = {owner: [] for owner in owners}
+    for _ in range(300):
+        owner = rng.choice(owners)
+        action = rng.random()
+        if action < 0.35 or not ids[owner]:
+            billed = round(rng.uniform(0, 50000), 2) if rng.random() < 0.9 else None
+            ids[owner].append(store.save_audit(owner, record(billed), queued=rng.random() < 0.6))
+        elif action < 0.55:
+            store.queue(owner, rng.choice(ids[owner]))
+        elif action < 0.7:
+            store.unqueue(owner, rng.sample(ids[owner], min(3, len(ids[owner]))))
+        elif action < 0.8:
+            store.record_payments(owner, [rng.choice(ids[owner])], "UPI")
+        elif action < 0.9:
+            audit_id = ids[owner].pop(rng.randrange(len(ids[owner])))
+            with store._connect() as conn:
+                conn.execute("DELETE FROM payments WHERE audit_id = ?", (audit_id,))
+                conn.execute("DELETE FROM audits WHERE id = ?", (audit_id,))
+        elif rng.random() < 0.3:
+            store.clear_queue(owner)
+        for name in owners:
+            bills, total = store.queue_totals(name)
+            assert (bills, pytest.approx(total)) == scanned_totals(store, name)
+
+
+def test_queue_totals_backfill_existing_database(tmp_path):
+    path = str(tmp_path / "old.db")
+    store = AuditStore(path)
+    for billed in (1000.1, 2000.2, None):
+        store.save_audit(OWNER, record(billed), queued=True)
+    store.save_audit(OWNER, record(500), queued=False)
+    # As left by a version without the running totals
+    with store._connect() as conn:
+        conn.executescript("DROP TRIGGER audits_queued_insert; DROP TRIGGER audits_queued_update;"
+                           " DROP TRIGGER audits_queued_delete; DROP TABLE queue_totals;")
+    reopened = AuditStore(path)
+    assert reopened.queue_totals(OWNER) == (3, 3000.3)
+    reopened.queue(OWNER, reopened.save_audit(OWNER, record(1.0)))
+    assert reopened.queue_totals(OWNER) == (4, 3001.3)
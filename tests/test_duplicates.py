@@ -0,0 +1,100 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from audit_engine import RateReference, audit_bill
+from duplicates import duplicate_mask, possible_duplicate_mask
+
+RATES = pd.DataFrame({
+    "Service": ["Room Rent", "Doctor Consultation", "Lab Test", "MRI"],
+    "Rate (₹)": [4000, 2500, 1500, 5000]
+})
+
+
+@pytest.fixture(scope="module")
+def reference():
+    return RateReference(RATES)
+
+
+def statuses(reference, rows, columns=("Item", "Amount (₹)")):
+    result = audit_bill(pd.DataFrame(rows, columns=list(columns)), reference)
+    return result.results_df["Status"].tolist(), result.overcharge_types["Duplicate Billing"]
+
+
+def test_different_tests_matching_one_service_are_not_duplicates(reference):
+    # Both fuzzy-match "lab test" at the same rate, but are different tests
+    status, count = statuses(reference, [("Lab Test - CBC", 1500), ("Lab Test - LFT", 1500)])
+    assert status == ["Normal", "Normal"]
+    assert count == 0
+
+
+def test_undated_repeat_is_a_possible_duplicate(reference):
+    # Without dates two consultations may be two visits, so no saving is claimed
+    result = audit_bill(pd.DataFrame({"Item": ["Lab Test", "Lab Test", "Lab Test"], "Amount (₹)": [1500] * 3}),
+                        reference)
+    assert result.results_df["Status"].tolist() == ["Normal", "Possible Duplicate", "Possible Duplicate"]
+    assert result.overcharge_types["Duplicate Billing"] == 2
+    assert result.flagged_count == 2
+    assert result.potential_savings == 0
+    assert result.alerts == ["⚠️ Lab Test: Possible Duplicate"] * 2
+
+
+def test_undated_per_day_charges_are_not_flagged(reference):
+    status, count = statuses(reference, [("Room Rent", 4000), ("Room Rent", 4000)])
+    assert status == ["Normal", "Normal"]
+    assert count == 0
+
+
+def test_dated_repeats_days_apart_are_not_flagged(reference):
+    status, count = statuses(reference, [("Doctor Consultation", 2500, "01/03/2024"),
+                                         ("Doctor Consultation", 2500, "05/03/2024")],
+                             columns=("Item", "Amount (₹)", "Date"))
+    assert status == ["Normal", "Normal"]
+    assert count == 0
+
+
+def test_blank_dates_from_the_portal_editor_count_as_undated(reference):
+    status, _ = statuses(reference, [("MRI", 5000, ""), ("MRI", 5000, "02/03/2024"), ("MRI", 5000, "02/03/2024")],
+                         columns=("Item", "Amount (₹)", "Date"))
+    assert status == ["Normal", "Possible Duplicate", "Duplicate"]
+
+
+def test_same_day_repeat_is_flagged(reference):
+    result = audit_bill(pd.DataFrame({
+        "Item": ["MRI", "MRI", "Lab Test"],
+        "Amount (₹)": [5000, 5000, 1500],
+        "Date": ["02/03/2024", "2024-03-02", "02/03/2024"]
+    }), reference)
+    assert result.results_df["Status"].tolist() == ["Normal", "Duplicate", "Normal"]
+    assert result.overcharge_types["Duplicate Billing"] == 1
+    assert result.potential_savings == 5000
+
+
+def test_per_day_services_repeat_only_on_the_same_day():
+    keys = np.array(["room rent", "room rent", "room rent"], dtype=object)
+    mask = duplicate_mask(keys, np.array([4000.0, 4000.0, 4000.0]),
+                          dates=["01/03/2024", "02/03/2024", "02/03/2024"],
+                          recurring=np.array([True, True, True]))
+    assert mask.tolist() == [False, False, True]
+
+
+def test_window_and_bill_boundaries():
+    keys = np.array(["mri", "mri", "mri", "mri"], dtype=object)
+    amounts = np.array([5000.0, 5000.0, 5000.0, 5000.0])
+    dates = ["2024-03-01", "2024-03-02", "2024-03-10", "2024-03-10"]
+    assert duplicate_mask(keys, amounts, dates=dates, window_days=1).tolist() == [False, True, False, True]
+    assert duplicate_mask(keys, amounts, dates=dates, groups=np.array([1, 2, 3, 4])).tolist() == [False] * 4
+
+
+def test_free_lines_are_ignored():
+    keys = np.array(["gloves", "gloves"], dtype=object)
+    assert not duplicate_mask(keys, np.array([0.0, 0.0]), dates=["2024-03-01", "2024-03-01"]).any()
+
+
+def test_possible_duplicates_need_an_undated_line():
+    keys = np.array(["mri"] * 4, dtype=object)
+    amounts = np.array([5000.0] * 4)
+    assert possible_duplicate_mask(keys, amounts).tolist() == [False, True, True, True]
+    assert possible_duplicate_mask(keys, amounts, dates=["2024-03-01", "2024-03-05", None, "2024-03-09"]).tolist() \
+        == [False, False, True, True]
+    assert not possible_duplicate_mask(keys, amounts, recurring=np.ones(4, dtype=bool)).any()
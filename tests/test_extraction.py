@@ -0,0 +1,122 @@
+import itertools
+
+import pytest
+
+import extraction
+from extraction import parse_line_item, text_to_items_from_lines
+
+
+def parse_before(line):
+    """The rsplit parser LINE_TAIL replaced, for "item amount" lines"""
+    parts = line.strip().rsplit(" ", 1)
+    if len(parts) == 2:
+        left, right = parts
+        token = right.replace("₹", "").replace(",", "").replace("Rs.", "").strip()
+        if token.replace(".", "", 1).isdigit():
+            return left.strip(), float(token)
+    return None
+
+
+@pytest.mark.parametrize("item, amount", list(itertools.product(
+    ["Room rent", "Lab Test CBC", "X", "2D Echo"],
+    ["4000", "4000.", "4,000", "4,000.", "4000.50", "1,20,000.00", ".5", "0", "₹4000", "₹4000.", "Rs.4000",
+     "Rs.4000.", "₹.5", "4000..", "₹", "Rs.", "4.0.0", "abc"]
+)))
+def test_plain_lines_match_the_old_parser(item, amount):
+    line = f"{item} {amount}"
+    parsed = parse_line_item(line)
+    assert (None if parsed is None else (parsed[0], parsed[3])) == parse_before(line)
+
+
+@pytest.mark.parametrize("line, expected", [
+    ("Room Rent ₹1,20,000.00", ("Room Rent", None, None, 120000.0, None)),
+    ("Doctor Fees Rs 500/-", ("Doctor Fees", None, None, 500.0, None)),
+    ("MRI Brain INR 750", ("MRI Brain", None, None, 750.0, None)),
+    ("Syringe 5ml 10 x 25", ("Syringe 5ml", 10.0, 25.0, 250.0, None)),
+    ("Syringe 5ml 10 × 25 240", ("Syringe 5ml", 10.0, 25.0, 240.0, None)),
+    ("ICU Charges 2 @ ₹8,000 16,000", ("ICU Charges", 2.0, 8000.0, 16000.0, None)),
+    ("Lab Test CBC 1500 18% 270", ("Lab Test CBC", None, None, 1500.0, None)),
+    ("Lab Test CBC 1500 GST 270", ("Lab Test CBC", None, None, 1500.0, None)),
+    ("Nursing Charges ....... 1200", ("Nursing Charges", None, None, 1200.0, None)),
+    ("Room rent 4000.", ("Room rent", None, None, 4000.0, None)),
+    ("Syringe 2 x 50.", ("Syringe", 2.0, 50.0, 100.0, None)),
+    ("02/03/2024 MRI Brain 5000", ("MRI Brain", None, None, 5000.0, "02/03/2024")),
+    ("2024-03-02  Syringe 2 x 50", ("Syringe", 2.0, 50.0, 100.0, "2024-03-02")),
+])
+def test_formats(line, expected):
+    assert parse_line_item(line) == expected
+
+
+@pytest.mark.parametrize("line", ["APOLLO HOSPITAL - FINAL BILL", "", "4000", "Total ...", "Date: 12/03/2024",
+                                  "12/03/2024 4000"])
+def test_lines_without_an_item_and_amount(line):
+    assert parse_line_item(line) is None
+
+
+def test_text_to_items_from_lines():
+    assert text_to_items_from_lines(["HEADER", "Room Rent 4000", "", "MRI 2 x 5000"]) == [
+        ("Room Rent", None, None, 4000.0, None), ("MRI", 2.0, 5000.0, 10000.0, None)]
+
+
+class FakePage:
+    def __init__(self, text):
+        self.text = text
+        # A broken page still looks like it has a text layer
+        self.chars = [None] * extraction.TEXT_LAYER_MIN_CHARS
+
+    def extract_text(self):
+        if self.text is None:
+            raise ValueError("broken content stream")
+        return self.text
+
+
+class FakePdf:
+    def __init__(self, texts):
+        self.pages = [FakePage(text) for text in texts]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+def page_text(page_no):
+    return f"Page {page_no:02d} Lab Test CBC 1500"
+
+
+@pytest.fixture
+def fake_pdf(monkeypatch):
+    """A twelve-page text PDF whose page 3 cannot be read; worker ranges in `unopenable` fail outright"""
+    texts = [page_text(i) for i in range(1, 13)]
+    texts[2] = None
+    state = {"unopenable": set(), "opening": None}
+
+    def open_pdf(stream):
+        if state["opening"] in state["unopenable"]:
+            raise OSError("worker could not open the PDF")
+        return FakePdf(texts)
+
+    def page_range(task):
+        state["opening"] = task[1]
+        return extraction.extract_pdf_page_range(task)
+
+    monkeypatch.setattr(extraction.pdfplumber, "open", open_pdf)
+    monkeypatch.setattr(extraction, "pdf_page_count", lambda data: len(texts))
+    monkeypatch.setattr(extraction, "imap_ordered", lambda fn, tasks, max_workers: map(page_range, tasks))
+    return state
+
+
+@pytest.mark.parametrize("workers, unopenable, failed", [(1, set(), {3}), (4, set(), {3}), (4, {5}, {3, 6, 7, 8, 9})])
+def test_failed_pages_keep_later_page_numbers(fake_pdf, workers, unopenable, failed):
+    fake_pdf["unopenable"] = unopenable
+    sources = {}
+
+    def note_page(page_no, source, seconds):
+        sources[page_no] = source
+
+    pages = list(extraction.iter_pdf_page_texts(b"%PDF", workers=workers, on_page=note_page))
+    assert [page_no for page_no, _ in pages] == list(range(1, 13))
+    for page_no, text in pages:
+        assert text == ("" if page_no in failed else page_text(page_no))
+        assert sources[page_no] == ("failed" if page_no in failed else "text")
@@ -0,0 +1,49 @@
+import cv2
+import numpy as np
+import pytest
+
+from ocr import crop_table_region, preprocess_gray
+
+WIDTH, HEIGHT = 2480, 3508
+HEADER_RULE_Y, TITLE_RULE_Y = 350, 880
+FIRST_ITEM_Y, ITEM_SPACING = 1000, 180
+
+
+def bill_page(items=12, closing_rule=False, footer=False):
+    """A 300 DPI A4 page: hospital header and column titles ruled off, then the items"""
+    img = np.full((HEIGHT, WIDTH), 240, np.uint8)
+    cv2.putText(img, "CITY HOSPITAL", (200, 250), cv2.FONT_HERSHEY_SIMPLEX, 4, 20, 8)
+    cv2.line(img, (150, HEADER_RULE_Y), (WIDTH - 150, HEADER_RULE_Y), 0, 6)
+    cv2.putText(img, "Particulars", (200, TITLE_RULE_Y - 60), cv2.FONT_HERSHEY_SIMPLEX, 2, 20, 4)
+    cv2.putText(img, "Amount", (1900, TITLE_RULE_Y - 60), cv2.FONT_HERSHEY_SIMPLEX, 2, 20, 4)
+    cv2.line(img, (150, TITLE_RULE_Y), (WIDTH - 150, TITLE_RULE_Y), 0, 6)
+    for i in range(items):
+        y = FIRST_ITEM_Y + i * ITEM_SPACING
+        cv2.putText(img, f"Lab Test {i + 1}", (200, y), cv2.FONT_HERSHEY_SIMPLEX, 2, 20, 4)
+        cv2.putText(img, f"{1500 + i * 10}.00", (1900, y), cv2.FONT_HERSHEY_SIMPLEX, 2, 20, 4)
+    last_item_y = FIRST_ITEM_Y + (items - 1) * ITEM_SPACING
+    if closing_rule:
+        cv2.line(img, (150, last_item_y + 60), (WIDTH - 150, last_item_y + 60), 0, 6)
+    if footer:
+        cv2.putText(img, "Grand Total", (200, last_item_y + 200), cv2.FONT_HERSHEY_SIMPLEX, 2, 20, 4)
+    return img, last_item_y
+
+
+def test_open_table_keeps_the_items_below_the_last_rule():
+    page, last_item_y = bill_page()
+    cropped = preprocess_gray(page, dpi=300)
+    # From the first rule down to the baseline of the last item
+    assert cropped.shape[0] >= last_item_y - HEADER_RULE_Y
+
+
+@pytest.mark.parametrize("footer", [False, True])
+def test_closed_table_is_cropped_to_the_rules(footer):
+    page, last_item_y = bill_page(closing_rule=True, footer=footer)
+    cropped = preprocess_gray(page, dpi=300)
+    ruled = last_item_y + 60 - HEADER_RULE_Y
+    assert ruled <= cropped.shape[0] <= ruled + 40
+
+
+def test_blank_page_is_left_alone():
+    blank = np.full((100, 200), 255, np.uint8)
+    assert crop_table_region(blank) is blank
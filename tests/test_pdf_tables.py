@@ -0,0 +1,62 @@
+import pytest
+
+from pdf_tables import _header_name, find_header, group_lines, page_table_items
+
+CHAR_WIDTH = 6
+
+
+@pytest.mark.parametrize("text, name", [
+    ("Amount (incl. GST)", "amount"),
+    ("Amount incl. Tax", "amount"),
+    ("Amount with GST", "amount"),
+    ("Description of Charges", "item"),
+    ("Particulars", "item"),
+    ("GST Amount", "gst"),
+    ("CGST %", "gst"),
+    ("Unit Rate", "rate"),
+    ("Price per Unit", "rate"),
+    ("Service Date", "date"),
+    ("Date of Service", "date"),
+    ("No. of Days", "qty"),
+    ("Qty", "qty"),
+    ("Total Amount", "amount"),
+    ("S.No", None),
+])
+def test_header_names(text, name):
+    assert _header_name(text) == name
+
+
+def words(*cells, top=100.0):
+    """pdfplumber-style word boxes for one line, given (text, x0) per cell"""
+    out = []
+    for text, x0 in cells:
+        for word in text.split():
+            out.append({"text": word, "x0": x0, "x1": x0 + CHAR_WIDTH * len(word), "top": top, "bottom": top + 10})
+            x0 += CHAR_WIDTH * (len(word) + 1)
+    return out
+
+
+class FakePage:
+    def __init__(self, *lines):
+        self.lines = lines
+
+    def extract_words(self):
+        return [word for i, line in enumerate(self.lines) for word in words(*line, top=100.0 + 20 * i)]
+
+
+@pytest.mark.parametrize("item_title, amount_title", [
+    ("Description of Charges", "Amount (incl. GST)"),
+    ("Particulars", "Amount incl. Tax"),
+])
+def test_tables_with_qualified_headers_are_read_as_tables(item_title, amount_title):
+    page = FakePage(
+        [("Service Date", 20), (item_title, 120), ("Qty", 320), (amount_title, 400), ("GST Amount", 540)],
+        [("02/03/2024", 20), ("MRI Brain", 120), ("1", 320), ("5,000.00", 400), ("900.00", 540)],
+        [("03/03/2024", 20), ("Lab Test CBC", 120), ("2", 320), ("1,500.00", 400), ("270.00", 540)],
+        [("Grand Total", 120), ("6,500.00", 400)],
+    )
+    assert find_header(group_lines(page.extract_words()))[0] == 0
+    rows, layout = page_table_items(page)
+    assert layout is not None
+    assert rows == [("MRI Brain", 1.0, None, 5000.0, "02/03/2024"),
+                    ("Lab Test CBC", 2.0, None, 1500.0, "03/03/2024")]
@@ -0,0 +1,102 @@
+import difflib
+import random
+
+import pandas as pd
+import pytest
+
+from audit_engine import MATCH_CUTOFF
+from rate_artifact import CompiledRates
+from service_matcher import MatchCache, NameResolver, ServiceMatcher, trigrams
+
+WORDS = ["room", "rent", "doctor", "fees", "lab", "test", "mri", "ct", "scan", "x-ray", "icu", "nursing", "surgery",
+         "knee", "cardiac", "echo", "blood", "culture", "cbc", "usg", "abdomen", "chest", "ward", "sérum", "ω-3"]
+
+
+def linear_match(query, services, cutoff):
+    """The linear scan the matcher replaced: best difflib ratio over every service"""
+    best, best_score = None, 0.0
+    for service in services:
+        score = difflib.SequenceMatcher(None, query, service).ratio()
+        if score > best_score:
+            best, best_score = service, score
+    return (best, best_score) if best_score >= cutoff else (None, best_score)
+
+
+def catalogue(rng, size=400):
+    names = [" ".join(rng.sample(WORDS, rng.randint(1, 4))) for _ in range(size)]
+    return list(dict.fromkeys(names))
+
+
+def queries(rng, services, count=150):
+    out = []
+    for _ in range(count):
+        name = rng.choice(services)
+        kind = rng.random()
+        if kind < 0.3:
+            cut = rng.randrange(len(name))
+            out.append(name[:cut] + name[cut + 1:])
+        elif kind < 0.6:
+            out.append(name + rng.choice([" charges", "s", " (left)"]))
+        elif kind < 0.8:
+            out.append(" ".join(reversed(name.split())))
+        else:
+            out.append(" ".join(rng.sample(WORDS, rng.randint(1, 3))))
+    return out
+
+
+def matchers(services):
+    """In-memory matcher and one over the compiled (flat-array) index"""
+    compiled = CompiledRates.from_table(pd.DataFrame({"Service": services, "Rate (₹)": 1.0}))
+    return [ServiceMatcher(services), compiled.matcher]
+
+
+@pytest.mark.parametrize("seed", range(2))
+@pytest.mark.parametrize("cutoff", [0.5, MATCH_CUTOFF, 0.8])
+def test_matches_the_linear_scan(seed, cutoff):
+    rng = random.Random(seed)
+    services = catalogue(rng)
+    for matcher in matchers(services):
+        for query in queries(rng, services):
+            expected = linear_match(query, services, cutoff)
+            # Exact for every service sharing a trigram with the query, which the best match always does here
+            if expected[0] is not None:
+                assert trigrams(query) & trigrams(expected[0])
+            name, score = matcher.match(query, cutoff=cutoff)
+            assert name == expected[0]
+            if name is not None:
+                assert score == pytest.approx(expected[1])
+
+
+def test_restricted_view_matches_a_matcher_built_from_the_subset():
+    rng = random.Random(7)
+    services = catalogue(rng)
+    subset = [s for s in services if rng.random() < 0.3]
+    for matcher in matchers(services):
+        view = matcher.restricted_to(subset + ["not in the catalogue"])
+        own = ServiceMatcher(subset)
+        assert len(view) == len(subset)
+        for query in queries(rng, services, 100):
+            assert view.match(query, 0.6) == own.match(query, 0.6)
+        assert matcher.restricted_to(services) is matcher
+
+
+def test_empty_query_and_catalogue():
+    assert ServiceMatcher(["mri"]).match("") == (None, 0.0)
+    assert ServiceMatcher([]).match("mri") == (None, 0.0)
+
+
+def test_match_cache_is_bounded_lru():
+    cache = MatchCache(maxsize=2)
+    cache.put("a", 1)
+    cache.put("b", 2)
+    assert cache.get("a") == 1
+    cache.put("c", 3)
+    assert cache.get("b") is None
+    assert cache.stats()["evictions"] == 1
+
+
+def test_name_resolver_prefers_whole_word_names():
+    resolver = NameResolver(["room rent", "knee replacement package"])
+    assert resolver.resolve("room rent (deluxe)") == "room rent"
+    assert resolver.resolve("knee replacement package - left") == "knee replacement package"
+    assert resolver.resolve("mri brain") is None
@@ -0,0 +1,53 @@
+"""CGHS package procedures and the components their package rate already covers.
+
+The rule table is compiled once into a package -> components map, its
+inverse and a `NameResolver` over every rule name, so a bill is checked in
+one pass: each line resolves to at most one rule name, and a component is
+flagged when a package that includes it is billed in the same bill.
+"""
+from collections import defaultdict
+
+import numpy as np
+
+from service_matcher import NameResolver, normalize_text
+
+
+class PackageRules:
+    def __init__(self, rules=None, cutoff=0.8, cache_size=10000):
+        self.components = defaultdict(set)
+        self.packages_of = defaultdict(set)
+        self.display = {}
+        if rules is not None:
+            for package, component in zip(rules["Package"], rules["Component"]):
+                p, c = normalize_text(package), normalize_text(component)
+                if not p or not c or p == c:
+                    continue
+                self.components[p].add(c)
+                self.packages_of[c].add(p)
+                self.display.setdefault(p, str(package).strip())
+        self.resolver = NameResolver(set(self.components) | set(self.packages_of), cutoff, cache_size)
+
+    def __len__(self):
+        return len(self.components)
+
+    def unbundled(self, names, groups=None):
+        """Package each line is already included in, or None, per line.
+
+        `names` are resolved rule names (None for lines no rule mentions);
+        `groups` the bill number of each line when several bills are checked.
+        """
+        n = len(names)
+        groups = groups if groups is not None else np.zeros(n, dtype=int)
+        billed_packages = defaultdict(set)
+        for group, name in zip(groups, names):
+            if name in self.components:
+                billed_packages[group].add(name)
+
+        covering = [None] * n
+        for i, (group, name) in enumerate(zip(groups, names)):
+            packages = self.packages_of.get(name)
+            if packages and billed_packages.get(group):
+                found = packages & billed_packages[group]
+                if found:
+                    covering[i] = self.display[min(found)]
+        return covering
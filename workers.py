@@ -0,0 +1,83 @@
+"""Process pool shared by bulk audits and document extraction.
+
+Work is submitted in chunks and results come back in submission order, so
+callers can stream them to the UI as soon as the next one is ready while the
+output stays deterministic regardless of which worker finishes first.
+"""
+import atexit
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+DEFAULT_WORKERS = int(os.environ.get("MEDIAUDIT_WORKERS", os.cpu_count() or 1))
+DEFAULT_CHUNK_SIZE = int(os.environ.get("MEDIAUDIT_CHUNK_SIZE", 250))
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+# Per-process reference store used by worker-side audits; it reloads changed files itself
+_worker_store = None
+
+
+def get_pool(max_workers=None):
+    """Long-lived pool per worker count; process start-up is paid once"""
+    max_workers = max_workers or DEFAULT_WORKERS
+    with _pools_lock:
+        pool = _pools.get(max_workers)
+        if pool is None:
+            # spawn rather than fork: the Streamlit server is multi-threaded
+            pool = ProcessPoolExecutor(max_workers=max_workers,
+                                       mp_context=multiprocessing.get_context("spawn"))
+            _pools[max_workers] = pool
+        return pool
+
+
+def _discard_pool(max_workers):
+    with _pools_lock:
+        pool = _pools.pop(max_workers or DEFAULT_WORKERS, None)
+    if pool is not None:
+        pool.shutdown(wait=False, cancel_futures=True)
+
+
+@atexit.register
+def shutdown_pools():
+    with _pools_lock:
+        pools = list(_pools.values())
+        _pools.clear()
+    for pool in pools:
+        pool.shutdown(wait=False, cancel_futures=True)
+
+
+def imap_ordered(fn, work_units, max_workers=None):
+    """Run `fn` over work units in the pool, yielding results in input order"""
+    pool = get_pool(max_workers)
+    try:
+        futures = [pool.submit(fn, unit) for unit in work_units]
+        for future in futures:
+            yield future.result()
+    except BrokenProcessPool:
+        # A crashed worker poisons the executor; start fresh next time
+        _discard_pool(max_workers)
+        raise
+
+
+def worker_reference(key):
+    """The `RateReference.key` reference, rebuilt inside a worker process.
+
+    Raises RuntimeError when the worker cannot load the same version of the
+    reference files, e.g. they changed again after the batch started.
+    """
+    from reference_store import ReferenceStore
+
+    global _worker_store
+    if _worker_store is None:
+        _worker_store = ReferenceStore()
+    digest, hospital, tier, as_of = key
+    if _worker_store.snapshot.digest != digest:
+        _worker_store.refresh()
+    snapshot = _worker_store.snapshot
+    if snapshot.digest != digest:
+        raise RuntimeError("Reference files changed while the batch was running; run it again")
+    return snapshot.reference(hospital, tier, as_of)